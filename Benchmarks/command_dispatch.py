@@ -0,0 +1,105 @@
+#!/bin/python3
+"""Measures inbound command dispatch in commands per second with many controls registered.
+
+The device's dispatch table is compared with the string path it replaced, which decoded and split every
+command, chained comparisons on its type and built a "TYPE_id" key for each control lookup. Both run the same
+mix of control commands, CONNECT and WHO against a device with no sockets.
+"""
+
+import argparse
+import random
+import timeit
+
+import dashio
+from dashio.dashdevice import dashDeviceCore
+
+
+def legacy_on_message(device, payload):
+    """The command path before the dispatch table, replies limited to what the mix needs."""
+    reply = []
+    for line in payload.decode("utf-8").split("\n"):
+        data = line.strip()
+        if not data:
+            continue
+        data_array = data.split("\t")
+        rx_device_id = data_array[0]
+        if rx_device_id == "WHO":
+            who = device.device_id_str + "\tWHO\t{}\t{}\n".format(device.device_type, device.device_name_cntrl.control_id)
+            reply.append(who.encode("utf-8"))
+            continue
+        elif rx_device_id != device.device_id:
+            continue
+        cntrl_type = data_array[1]
+        if cntrl_type == "CONNECT":
+            reply.append(device.b_connect)
+        elif cntrl_type == "STATUS":
+            pass
+        elif cntrl_type == "CFG":
+            pass
+        elif cntrl_type == "NAME":
+            device.device_name_cntrl.message_rx_event(data_array[2:])
+        else:
+            try:
+                key = cntrl_type + "_" + data_array[2]
+            except IndexError:
+                continue
+            try:
+                device.control_dict[key].message_rx_event(data_array[3:])
+            except KeyError:
+                pass
+    return b"".join(reply)
+
+
+def make_device(controls):
+    device = dashDeviceCore("bench", "BENCH01", "Bench")
+    for i in range(controls):
+        button = dashio.Button("BTN{}".format(i))
+        button.message_rx_event += lambda msg: None
+        device.add_control(button)
+    return device
+
+
+def make_commands(controls, number, mix):
+    commands = []
+    for _ in range(number):
+        roll = random.random()
+        if roll < mix:
+            commands.append("\tBENCH01\tBTTN\tBTN{}\tclick\n".format(random.randrange(controls)))
+        elif roll < mix + (1 - mix) / 2:
+            commands.append("\tBENCH01\tCONNECT\n")
+        else:
+            commands.append("\tWHO\n")
+    return [command.encode("utf-8") for command in commands]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-c", "--controls", type=int, default=1000, help="Controls registered on the device.")
+    parser.add_argument("-n", "--number", type=int, default=100000, help="Commands dispatched per run.")
+    parser.add_argument("-m", "--mix", type=float, default=0.9, help="Fraction of commands sent to controls.")
+    parser.add_argument("-r", "--repeat", type=int, default=10, help="Runs per path, the best is reported.")
+    args = parser.parse_args()
+
+    device = make_device(args.controls)
+    commands = make_commands(args.controls, args.number, args.mix)
+    batch = b"".join(commands)
+
+    paths = (
+        ("legacy", lambda payload: legacy_on_message(device, payload)),
+        ("table", device._on_message),
+    )
+    assert paths[0][1](batch) == paths[1][1](batch)
+    # Repeats alternate between the paths so drifting machine load affects both alike, the best run is kept.
+    best = {name: [float("inf"), float("inf")] for name, _ in paths}
+    for _ in range(args.repeat):
+        for name, on_message in paths:
+            single = timeit.timeit(lambda: [on_message(c) for c in commands], number=1)
+            batched = timeit.timeit(lambda: on_message(batch), number=1)
+            best[name] = [min(best[name][0], single), min(best[name][1], batched)]
+    print("{:>8} {:>14} {:>16}".format("path", "one per frame", "batched frame"))
+    for name, (single, batched) in best.items():
+        print("{:>8} {:>12.0f}/s {:>14.0f}/s".format(name, args.number / single, args.number / batched))
+
+
+if __name__ == "__main__":
+    main()
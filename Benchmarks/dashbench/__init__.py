@@ -0,0 +1,12 @@
+"""A reproducible benchmark suite for the dashio stack.
+
+Each case builds a real dashDevice with a tcpConnection or zmqConnection on loopback in a fresh process and
+drives it with synthetic clients. Results are written as JSON to Benchmarks/results and compared against a
+baseline stored there, run from the Benchmarks directory:
+
+    python -m dashbench --save-baseline     # on the code before a change
+    python -m dashbench                     # after it, compared with the baseline
+"""
+
+# Bumped when results written by an older suite can no longer be compared.
+RESULTS_FORMAT = 1
@@ -0,0 +1,117 @@
+"""Runs the dashio benchmark suite, see the dashbench package."""
+
+import argparse
+import os
+import sys
+
+import dashbench
+from . import RESULTS_FORMAT, results
+from .cases import CASES
+from .runner import run_isolated
+
+DEFAULTS = {
+    "controls": 20,
+    "requests": 2000,
+    "clients": 10,
+    "updates": 1000,
+    "history": 10000,
+    "history_requests": 200,
+    "budget": 500,
+    "memory_controls": 500,
+}
+
+# Results are kept beside the package, in Benchmarks/results, whichever directory the suite runs from. Git
+# ignores them, each machine keeps its own baseline.
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "results")
+
+# Fewer requests and a smaller history for a check that the suite runs, not for comparing.
+QUICK = {
+    "requests": 200,
+    "updates": 200,
+    "history": 2000,
+    "history_requests": 50,
+    "memory_controls": 100,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m dashbench", description=dashbench.__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--only", nargs="+", choices=sorted(CASES), help="Run only these cases.")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs per case, the best is kept.")
+    parser.add_argument("-p", "--port", type=int, default=5800, help="First of the loopback ports the cases use.")
+    parser.add_argument("--quick", action="store_true", help="A short run, to check the suite works.")
+    parser.add_argument("--controls", type=int, help="Dials on the device for the latency cases.")
+    parser.add_argument("--clients", type=int, help="TCP clients for the fanout case.")
+    parser.add_argument("--history", type=int, help="Data points in the history requested.")
+    parser.add_argument(
+        "-o", "--output", default=os.path.join(RESULTS_DIR, "dashbench_results.json"), help="The JSON results written."
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        default=os.path.join(RESULTS_DIR, "dashbench_baseline.json"),
+        help="The baseline compared with.",
+    )
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the baseline too.")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.1, help="Relative change treated as the same.")
+    parser.add_argument(
+        "--fail-on-regression", action="store_true", help="Exit with status 1 when a result is worse than baseline."
+    )
+    args = parser.parse_args()
+
+    options = dict(DEFAULTS)
+    if args.quick:
+        options.update(QUICK)
+    for option in ("controls", "clients", "history"):
+        if getattr(args, option) is not None:
+            options[option] = getattr(args, option)
+
+    names = args.only or list(CASES)
+    ports = {}
+    port = args.port
+    for name in names:
+        ports[name] = port
+        port += CASES[name][1]
+
+    # Repeats alternate between the cases so drifting machine load affects all alike.
+    runs = {name: [] for name in names}
+    for repeat in range(args.repeat):
+        for name in names:
+            print("run {} of {}: {}".format(repeat + 1, args.repeat, name), file=sys.stderr)
+            runs[name].append(run_isolated(name, options, ports[name]))
+    combined = {}
+    for name in names:
+        combined.update(results.best_of(runs[name]))
+
+    document = {"meta": results.metadata(options), "results": combined}
+    results.write(args.output, document)
+    print(results.format_results(combined))
+    print("\nwritten to {}".format(args.output))
+    if args.save_baseline:
+        results.write(args.baseline, document)
+        print("saved as the baseline {}".format(args.baseline))
+        return 0
+    if not os.path.exists(args.baseline):
+        print("no baseline at {}, save one with --save-baseline".format(args.baseline))
+        return 0
+
+    baseline = results.load(args.baseline)
+    if baseline["meta"].get("format") != RESULTS_FORMAT:
+        print("the baseline {} was written by another version of the suite".format(args.baseline))
+        return 0
+    for key in ("machine", "cpus", "python", "options"):
+        if baseline["meta"].get(key) != document["meta"][key]:
+            print("warning: the baseline's {} differs, {} against {}".format(
+                key, baseline["meta"].get(key), document["meta"][key]))
+    rows = results.compare(combined, baseline["results"], args.tolerance)
+    print("\ncompared with {} ({})".format(args.baseline, baseline["meta"].get("commit") or baseline["meta"]["time"]))
+    print(results.format_comparison(rows))
+    if args.fail_on_regression and any(row[4] == "worse" for row in rows):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,220 @@
+"""The benchmark cases, each a function of the options and a first free port returning named results.
+
+A result is a dict of its value, unit and whether lower or higher is better. Latencies are timed per request
+on the client, from sending it until the whole reply has arrived.
+"""
+
+import gc
+import multiprocessing
+import selectors
+import socket
+import time
+import tracemalloc
+
+import dashio
+
+from .topology import DEVICE_ID, TcpClient, TcpTopology, ZmqClient, ZmqTopology, iso, message
+
+
+def result(value, unit, better):
+    return {"value": value, "unit": unit, "better": better}
+
+
+def percentiles(samples, *quantiles):
+    samples = sorted(samples)
+    return [samples[min(len(samples) - 1, int(q * len(samples)))] for q in quantiles]
+
+
+def timed_requests(client, request, size, number):
+    samples = []
+    for _ in range(number):
+        start = time.perf_counter()
+        client.request(request, size)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def latency_results(prefix, samples):
+    p50, p99 = percentiles(samples, 0.5, 0.99)
+    return {
+        prefix + "_p50": result(p50 * 1e6, "us", "lower"),
+        prefix + "_p99": result(p99 * 1e6, "us", "lower"),
+    }
+
+
+def tcp_latency(options, port):
+    """STATUS and CFG reply latency through a tcpConnection, for a device with options["controls"] dials."""
+    topology = TcpTopology(port, dials=options["controls"])
+    client = TcpClient(port)
+    topology.wait_for_clients(1)
+    results = {}
+    for command in ("STATUS", "CFG"):
+        request = message(command)
+        # Replies are the same size every time, the first is read whole to learn it.
+        size = client.reply_size(request)
+        samples = timed_requests(client, request, size, options["requests"])
+        results.update(latency_results("tcp_{}".format(command.lower()), samples))
+    client.close()
+    topology.close()
+    return results
+
+
+def zmq_latency(options, port):
+    """STATUS and CFG reply latency through a zmqConnection, for a device with options["controls"] dials."""
+    topology = ZmqTopology(port, port + 1, dials=options["controls"])
+    client = ZmqClient(port, port + 1)
+    client.join(message("STATUS"))
+    results = {}
+    for command in ("STATUS", "CFG"):
+        samples = timed_requests(client, message(command), None, options["requests"])
+        results.update(latency_results("zmq_{}".format(command.lower()), samples))
+    client.close()
+    topology.close()
+    return results
+
+
+def fanout_sink(port, clients, pipe, idle=2.0):
+    """Connect the clients and count the frames each receives, run in its own process.
+
+    For each count of frames per client it is sent it reports the frames received and the time.monotonic of
+    the last, once every client has them all or nothing has arrived for idle seconds.
+    """
+    selector = selectors.DefaultSelector()
+    sockets = []
+    for _ in range(clients):
+        client = socket.create_connection(("127.0.0.1", port))
+        client.setblocking(False)
+        selector.register(client, selectors.EVENT_READ)
+        sockets.append(client)
+    pipe.send("connected")
+    buffer = bytearray(1 << 16)
+    while True:
+        expected = pipe.recv()
+        if expected is None:
+            return
+        counts = dict.fromkeys(sockets, 0)
+        complete = 0
+        frames = 0
+        last = None
+        while complete < clients:
+            events = selector.select(idle)
+            if not events:
+                break
+            for key, _ in events:
+                size = key.fileobj.recv_into(buffer)
+                received = buffer.count(b"\n", 0, size)
+                last = time.monotonic()
+                frames += received
+                before = counts[key.fileobj]
+                counts[key.fileobj] = before + received
+                if before < expected <= before + received:
+                    complete += 1
+        pipe.send((frames, last))
+
+
+def tcp_fanout(options, port):
+    """Control updates broadcast by a tcpConnection to options["clients"] clients in another process.
+
+    The updates are set as fast as the caller can, time.monotonic is shared between processes so delivery
+    is timed from the first update set until the last frame arrives.
+    """
+    clients = options["clients"]
+    updates = options["updates"]
+    topology = TcpTopology(port, dials=1)
+    dial = topology.dials[0]
+    pipe, child_pipe = multiprocessing.Pipe()
+    sink = multiprocessing.get_context("spawn").Process(target=fanout_sink, args=(port, clients, child_pipe))
+    sink.start()
+    pipe.recv()
+    topology.wait_for_clients(clients)
+    # One update through first, so the device and connection have joined.
+    pipe.send(1)
+    dial.dial_value = -1
+    pipe.recv()
+
+    pipe.send(updates)
+    start = time.monotonic()
+    for value in range(updates):
+        dial.dial_value = value
+    sent = time.monotonic() - start
+    frames, last = pipe.recv()
+    pipe.send(None)
+    sink.join()
+    topology.close()
+    delivered = frames / (last - start) if frames else 0.0
+    return {
+        "fanout_update_us": result(sent / updates * 1e6, "us", "lower"),
+        "fanout_deliveries_per_s": result(delivered, "1/s", "higher"),
+        "fanout_delivered_pct": result(100.0 * frames / (clients * updates), "%", "higher"),
+    }
+
+
+def history_request(options, port):
+    """TGRPH requests for a TimeGraph line's whole history of options["history"] points, over TCP.
+
+    The history is asked for in full and downsampled to options["budget"] points, by min/max and by LTTB.
+    """
+    size = options["history"]
+    topology = TcpTopology(port)
+    now = int(time.time())
+    for graph_id, method in (("G0", dashio.DownsampleMethod.MIN_MAX), ("G1", dashio.DownsampleMethod.LTTB)):
+        line = dashio.TimeGraphLine("L0", max_data_points=size, downsample_method=method)
+        for i in range(size):
+            segment = "\t{},{}".format(iso(now - size + i), i).encode("utf-8")
+            line._buffer.append(now - size + i, float(i), segment)
+        graph = dashio.TimeGraph(graph_id)
+        graph.add_line("L0", line)
+        topology.device.add_control(graph)
+    client = TcpClient(topology.port)
+    topology.wait_for_clients(1)
+    since = iso(now - size - 1)
+    results = {}
+    for name, request in (
+        ("history_full", message("TGRPH", "G0", since)),
+        ("history_budget", message("TGRPH", "G0", since, options["budget"])),
+        ("history_budget_lttb", message("TGRPH", "G1", since, options["budget"])),
+    ):
+        reply_size = client.reply_size(request)
+        samples = timed_requests(client, request, reply_size, options["history_requests"])
+        results.update(latency_results(name, samples))
+    client.close()
+    topology.close()
+    return results
+
+
+MEMORY_CONTROLS = (
+    ("dial", dashio.Dial),
+    ("knob", dashio.Knob),
+    ("textbox", dashio.TextBox),
+    ("timegraph", dashio.TimeGraph),
+)
+
+
+def memory_per_control(options, port):
+    """Python memory held per control added to a device, traced over options["memory_controls"] of each type."""
+    number = options["memory_controls"]
+    tracemalloc.start()
+    device = dashio.dashDevice("bench", DEVICE_ID, "Bench")
+    results = {}
+    for name, control_type in MEMORY_CONTROLS:
+        gc.collect()
+        before = tracemalloc.get_traced_memory()[0]
+        controls = [control_type("{}{}".format(name.upper(), i)) for i in range(number)]
+        for control in controls:
+            device.add_control(control)
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+        results["memory_{}_bytes".format(name)] = result((after - before) / number, "B", "lower")
+    tracemalloc.stop()
+    device.close()
+    return results
+
+
+# Case names and the ports each uses from its first.
+CASES = {
+    "tcp_latency": (tcp_latency, 1),
+    "zmq_latency": (zmq_latency, 2),
+    "tcp_fanout": (tcp_fanout, 1),
+    "history_request": (history_request, 1),
+    "memory_per_control": (memory_per_control, 0),
+}
@@ -0,0 +1,117 @@
+"""Writing results as JSON and comparing them against a baseline."""
+
+import datetime
+import json
+import os
+import platform
+import subprocess
+
+import zmq
+
+from . import RESULTS_FORMAT
+
+
+def dashio_version():
+    try:
+        from importlib.metadata import PackageNotFoundError, version
+    except ImportError:
+        return "unknown"
+    try:
+        return version("dashio")
+    except PackageNotFoundError:
+        return "unknown"
+
+
+def git_commit():
+    try:
+        output = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return output.stdout.strip()
+
+
+def metadata(options):
+    return {
+        "format": RESULTS_FORMAT,
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "dashio": dashio_version(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "pyzmq": zmq.pyzmq_version(),
+        "libzmq": zmq.zmq_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "options": options,
+    }
+
+
+def best_of(runs):
+    """Combine the results of repeated runs, keeping the best value of each and every run's value."""
+    combined = {}
+    for run in runs:
+        for name, value in run.items():
+            entry = combined.setdefault(name, dict(value, runs=[]))
+            entry["runs"].append(value["value"])
+            pick = min if value["better"] == "lower" else max
+            entry["value"] = pick(entry["value"], value["value"])
+    return combined
+
+
+def write(path, document):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as results_file:
+        json.dump(document, results_file, indent=2, sort_keys=True)
+        results_file.write("\n")
+
+
+def load(path):
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def compare(results, baseline, tolerance):
+    """Returns (name, baseline value, value, change, verdict) for the results in both.
+
+    The change is relative to the baseline, the verdict is better or worse when it is beyond tolerance in
+    that direction and same otherwise.
+    """
+    rows = []
+    for name, value in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if base["value"]:
+            change = (value["value"] - base["value"]) / base["value"]
+        else:
+            change = 0.0 if value["value"] == base["value"] else float("inf")
+        verdict = "same"
+        if abs(change) > tolerance:
+            improved = change < 0 if value["better"] == "lower" else change > 0
+            verdict = "better" if improved else "worse"
+        rows.append((name, base["value"], value["value"], change, verdict))
+    return rows
+
+
+def format_results(results):
+    lines = ["{:<28} {:>14} {:<4} {}".format("result", "best", "unit", "runs")]
+    for name, value in sorted(results.items()):
+        runs = " ".join("{:.4g}".format(run) for run in value["runs"])
+        lines.append("{:<28} {:>14.4g} {:<4} {}".format(name, value["value"], value["unit"], runs))
+    return "\n".join(lines)
+
+
+def format_comparison(rows):
+    lines = ["{:<28} {:>14} {:>14} {:>9} {}".format("result", "baseline", "now", "change", "verdict")]
+    for name, base, value, change, verdict in rows:
+        lines.append("{:<28} {:>14.4g} {:>14.4g} {:>+8.1f}% {}".format(name, base, value, change * 100, verdict))
+    return "\n".join(lines)
@@ -0,0 +1,44 @@
+"""Runs each case in a fresh process.
+
+dashDevice terminates its zmq context when closed, so a case can't share a process with the next. A fresh
+process also starts every case with the same heap, for the memory case.
+"""
+
+import multiprocessing
+import multiprocessing.connection
+import traceback
+
+from .cases import CASES
+
+
+def run_case(name, options, port, pipe):
+    case, _ = CASES[name]
+    try:
+        pipe.send((True, case(options, port)))
+    except Exception:
+        pipe.send((False, traceback.format_exc()))
+
+
+def run_isolated(name, options, port, timeout=300.0):
+    """Returns the case's results, raises RuntimeError when it fails, dies or takes longer than timeout."""
+    context = multiprocessing.get_context("spawn")
+    pipe, child_pipe = context.Pipe()
+    child = context.Process(target=run_case, args=(name, options, port, child_pipe))
+    child.start()
+    child_pipe.close()
+    ready = multiprocessing.connection.wait([pipe, child.sentinel], timeout)
+    if pipe not in ready:
+        child.terminate()
+        child.join()
+        if ready:
+            raise RuntimeError("{} exited with code {}".format(name, child.exitcode))
+        raise RuntimeError("{} timed out".format(name))
+    ok, outcome = pipe.recv()
+    # The case has closed its objects, a device's thread may still be terminating the context.
+    child.join(5.0)
+    if child.is_alive():
+        child.terminate()
+        child.join()
+    if not ok:
+        raise RuntimeError("{} failed:\n{}".format(name, outcome))
+    return outcome
@@ -0,0 +1,130 @@
+"""Loopback topologies of real devices and connections, and the synthetic clients that drive them."""
+
+import datetime
+import socket
+import time
+
+import zmq
+
+import dashio
+
+DEVICE_ID = "BENCH01"
+
+
+def iso(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).isoformat()
+
+
+def message(*fields):
+    return ("\t" + "\t".join([DEVICE_ID] + [str(field) for field in fields]) + "\n").encode("utf-8")
+
+
+class TcpTopology:
+    """A dashDevice behind a tcpConnection listening on loopback."""
+
+    def __init__(self, port, dials=0, **connection_options):
+        self.port = port
+        self.connection = dashio.tcpConnection(ip="127.0.0.1", port=port, **connection_options)
+        self.device = dashio.dashDevice("bench", DEVICE_ID, "Bench")
+        self.dials = [dashio.Dial("D{}".format(i)) for i in range(dials)]
+        for dial in self.dials:
+            self.device.add_control(dial)
+        self.connection.add_device(self.device)
+
+    def wait_for_clients(self, clients, timeout=10.0):
+        deadline = time.monotonic() + timeout
+        while len(self.connection.clients) < clients:
+            if time.monotonic() > deadline:
+                raise TimeoutError("{} of {} clients connected".format(len(self.connection.clients), clients))
+            time.sleep(0.01)
+
+    def close(self):
+        self.device.close()
+        self.connection.close()
+
+
+class ZmqTopology:
+    """A dashDevice behind a zmqConnection, its external PUB and SUB on loopback."""
+
+    def __init__(self, pub_port, sub_port, dials=0):
+        self.pub_port = pub_port
+        self.sub_port = sub_port
+        self.connection = dashio.zmqConnection(zmq_out_url="127.0.0.1", pub_port=pub_port, sub_port=sub_port)
+        self.device = dashio.dashDevice("bench", DEVICE_ID, "Bench")
+        self.dials = [dashio.Dial("D{}".format(i)) for i in range(dials)]
+        for dial in self.dials:
+            self.device.add_control(dial)
+        self.connection.add_device(self.device)
+
+    def close(self):
+        self.device.close()
+        self.connection.close()
+
+
+class TcpClient:
+    """A client on a plain socket, as the Dash app connects over TCP."""
+
+    def __init__(self, port, timeout=5.0):
+        self.socket = socket.create_connection(("127.0.0.1", port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.settimeout(timeout)
+        self.buffer = bytearray(1 << 20)
+
+    def reply_size(self, request, quiet=0.2):
+        """Send request and read until the socket is quiet, returns the size of the whole reply."""
+        self.socket.sendall(request)
+        size = self.socket.recv_into(self.buffer)
+        timeout = self.socket.gettimeout()
+        self.socket.settimeout(quiet)
+        try:
+            while True:
+                size += self.socket.recv_into(self.buffer)
+        except socket.timeout:
+            pass
+        self.socket.settimeout(timeout)
+        return size
+
+    def request(self, request, size):
+        """Send request and read until size bytes of reply have arrived."""
+        self.socket.sendall(request)
+        received = 0
+        while received < size:
+            received += self.socket.recv_into(self.buffer)
+
+    def close(self):
+        self.socket.close()
+
+
+class ZmqClient:
+    """A client on a SUB and PUB pair, as zmqConnection's peers connect."""
+
+    def __init__(self, pub_port, sub_port, context=None, timeout=5.0):
+        self.context = context or zmq.Context.instance()
+        self.sub = self.context.socket(zmq.SUB)
+        self.sub.setsockopt(zmq.SUBSCRIBE, b"")
+        self.sub.setsockopt(zmq.RCVTIMEO, int(timeout * 1000))
+        self.sub.connect("tcp://127.0.0.1:{}".format(pub_port))
+        self.pub = self.context.socket(zmq.PUB)
+        self.pub.connect("tcp://127.0.0.1:{}".format(sub_port))
+
+    def join(self, request, timeout=10.0):
+        """Repeat request until a reply arrives, PUB and SUB drop what is sent before they have joined."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self.pub.send(request)
+            if self.sub.poll(100):
+                self.sub.recv()
+                # Drop the replies to earlier repeats.
+                while self.sub.poll(200):
+                    self.sub.recv()
+                return
+        raise TimeoutError("No reply from the zmqConnection")
+
+    def request(self, request, size=None):
+        """Send request and wait for its reply, zmqConnection publishes each reply as one message."""
+        self.pub.send(request)
+        self.sub.recv()
+
+    def close(self):
+        self.sub.close(0)
+        self.pub.close(0)
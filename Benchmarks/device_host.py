@@ -0,0 +1,146 @@
+#!/bin/python3
+"""Measures a DeviceHost serving many devices against one dashDevice thread per device.
+
+A stand-in connection sends STATUS requests for random devices over the same inproc endpoints a real
+connection binds, and times the replies. Setup time, threads, sockets and resident memory are reported for
+each device count.
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import resource
+import time
+
+import zmq
+
+import dashio
+
+
+class StandInConnection:
+    """Binds the inproc endpoints a connection would and sends commands through them."""
+
+    def __init__(self, connection_id):
+        context = zmq.Context.instance()
+        self.connection_id = connection_id
+        self.tx = context.socket(zmq.PUB)
+        self.tx.bind("inproc://TX_{}".format(connection_id))
+        self.rx = context.socket(zmq.SUB)
+        self.rx.bind("inproc://RX_{}".format(connection_id))
+        self.rx.setsockopt(zmq.SUBSCRIBE, b"")
+
+    def request(self, commands, window=100, timeout=10.0):
+        """Send the commands, window at a time as PUB drops past its high water mark, and return the seconds
+        taken until all of them are answered."""
+        self.rx.setsockopt(zmq.RCVTIMEO, int(timeout * 1000))
+        b_connection_id = self.connection_id.encode("utf-8")
+        start = time.perf_counter()
+        for i in range(0, len(commands), window):
+            batch = commands[i:i + window]
+            for command in batch:
+                self.tx.send_multipart([b_connection_id, b"0", command])
+            for _ in batch:
+                self.rx.recv_multipart()
+        return time.perf_counter() - start
+
+    def warm_up(self, device_ids):
+        """Wait until every device answers, the first commands can be lost while subscriptions settle."""
+        b_connection_id = self.connection_id.encode("utf-8")
+        self.rx.setsockopt(zmq.RCVTIMEO, 100)
+        for device_id in device_ids:
+            for _ in range(50):
+                self.tx.send_multipart([b_connection_id, b"0", "\t{}\tCONNECT\n".format(device_id).encode("utf-8")])
+                try:
+                    self.rx.recv_multipart()
+                    break
+                except zmq.error.Again:
+                    pass
+            else:
+                raise RuntimeError("{} did not answer".format(device_id))
+        # Drop answers to retries that came in late.
+        self.rx.setsockopt(zmq.RCVTIMEO, 100)
+        while True:
+            try:
+                self.rx.recv_multipart()
+            except zmq.error.Again:
+                break
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def add_controls(device):
+    device.add_control(dashio.Dial("DIAL"))
+
+
+def bench_host(size, connection, number):
+    start = time.perf_counter()
+    host = dashio.DeviceHost()
+    for i in range(size):
+        device = host.add_device("bench", "DEV{}".format(i), "Device {}".format(i))
+        device.add_connection(connection.connection_id)
+        add_controls(device)
+    setup = time.perf_counter() - start
+    return setup, 1, 2, run_requests(size, connection, number)
+
+
+def bench_threads(size, connection, number):
+    start = time.perf_counter()
+    devices = [dashio.dashDevice("bench", "DEV{}".format(i), "Device {}".format(i)) for i in range(size)]
+    # dashDevice creates its sockets in its own thread, let them all get going first.
+    for device in devices:
+        while not hasattr(device, "rx_zmq_sub"):
+            time.sleep(0.001)
+    time.sleep(0.1)
+    for device in devices:
+        device.add_connection(connection.connection_id)
+        add_controls(device)
+    setup = time.perf_counter() - start
+    result = run_requests(size, connection, number)
+    return setup, size, 2 * size, result
+
+
+def run_requests(size, connection, number):
+    connection.warm_up(["DEV{}".format(i) for i in range(size)])
+    commands = ["\tDEV{}\tSTATUS\n".format(random.randrange(size)).encode("utf-8") for _ in range(number)]
+    return connection.request(commands)
+
+
+def run_in_child(bench, size, number, pipe):
+    # Each run gets a fresh process, stopping thousands of device threads cleanly isn't what's measured.
+    result = bench(size, StandInConnection("bench"), number)
+    pipe.send(result + (max_rss_mb(),))
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=2000, help="STATUS requests timed per size.")
+    parser.add_argument(
+        "-s", "--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="Device counts."
+    )
+    parser.add_argument(
+        "-t", "--thread-limit", type=int, default=100, help="Largest device count run with a thread per device."
+    )
+    args = parser.parse_args()
+
+    print("{:>8} {:>8} {:>10} {:>8} {:>8} {:>12} {:>10}".format(
+        "mode", "devices", "setup (s)", "threads", "sockets", "req/s", "rss (MB)"))
+    for size in args.sizes:
+        modes = [("host", bench_host)]
+        if size <= args.thread_limit:
+            modes.append(("threads", bench_threads))
+        for mode, bench in modes:
+            receiver, sender = multiprocessing.Pipe(False)
+            child = multiprocessing.Process(target=run_in_child, args=(bench, size, args.number, sender))
+            child.start()
+            setup, threads, sockets, elapsed, rss = receiver.recv()
+            child.join()
+            print("{:>8} {:>8} {:>10.2f} {:>8} {:>8} {:>12.0f} {:>10.1f}".format(
+                mode, size, setup, threads, sockets, args.number / elapsed, rss))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/bin/python3
+"""Measures TimeGraph and EventLog history request latency against history size.
+
+Each request asks for the newest ten entries. The indexed lookup is compared with a linear scan over the
+same history, which is how requests were served before the timestamp index.
+"""
+
+import argparse
+import datetime
+import time
+import timeit
+
+import dashio
+
+
+def iso(epoch):
+    return datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).isoformat()
+
+
+def timed(request, index, number):
+    """Time request with the index's bisect lookup, then with it swapped for a linear scan."""
+    indexed = timeit.timeit(request, number=number) / number
+
+    def linear_scan(epoch):
+        start = 0
+        for view in index.view():
+            for ts in view:
+                if ts > epoch:
+                    return start
+                start += 1
+        return start
+
+    index.index_after = linear_scan
+    scanned = timeit.timeit(request, number=number) / number
+    del index.index_after
+    return indexed, scanned
+
+
+def bench_time_graph(size, number):
+    now = int(time.time())
+    line = dashio.TimeGraphLine("bench", max_data_points=size)
+    for i in range(size):
+        segment = "\t{},{}".format(iso(now - size + i), i).encode("utf-8")
+        line._buffer.append(now - size + i, float(i), segment)
+    request = iso(now - 10)
+    return timed(lambda: line.get_line_from_timestamp(request), line._buffer.index, number)
+
+
+def bench_event_log(size, number):
+    now = int(time.time())
+    log = dashio.EventLog("bench")
+    for i in range(size):
+        ed = dashio.EventData("header", str(i))
+        ed.timestamp = datetime.datetime.fromtimestamp(now - size + i, datetime.timezone.utc)
+        log.add_event_data(ed)
+    request = iso(now - 10)
+    return timed(lambda: log.message_rx_event([request]), log._index, number)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=200, help="Requests timed per size.")
+    parser.add_argument(
+        "-s", "--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000], help="History sizes."
+    )
+    args = parser.parse_args()
+
+    print("{:>10} {:>10} {:>14} {:>14}".format("control", "history", "indexed (us)", "scan (us)"))
+    for size in args.sizes:
+        for name, bench in (("TimeGraph", bench_time_graph), ("EventLog", bench_event_log)):
+            indexed, scanned = bench(size, args.number)
+            print("{:>10} {:>10} {:>14.1f} {:>14.1f}".format(name, size, indexed * 1e6, scanned * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/bin/python3
+"""Measures the CPU time and wakeups of idle devices and connections.
+
+Nothing is sent, so every wakeup is the loop checking in on its own. Wakeups are the context switches of each
+object's thread over the measured period, read from /proc on Linux, and CPU is the whole process's. Zeroconf
+and the zmq I/O threads are counted in the process CPU but not in the wakeups.
+"""
+
+import argparse
+import resource
+import time
+
+import dashio
+
+
+def context_switches(thread):
+    switches = 0
+    with open("/proc/self/task/{}/status".format(thread.native_id)) as status:
+        for line in status:
+            # Both voluntary_ctxt_switches and nonvoluntary_ctxt_switches.
+            if "ctxt_switches:" in line:
+                switches += int(line.split()[1])
+    return switches
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def make_objects(devices, port):
+    tcp = dashio.tcpConnection(port=port)
+    zmq_connection = dashio.zmqConnection(pub_port=port + 1, sub_port=port + 2)
+    host = dashio.DeviceHost()
+    objects = [("tcpConnection", [tcp]), ("zmqConnection", [zmq_connection]), ("DeviceHost", [host])]
+    threaded = []
+    for i in range(devices):
+        device = dashio.dashDevice("idle", "IDLE{}".format(i), "Idle {}".format(i))
+        tcp.add_device(device)
+        threaded.append(device)
+        hosted = host.add_device("idle", "HOSTED{}".format(i), "Hosted {}".format(i))
+        tcp.add_device(hosted)
+    objects.append(("dashDevice", threaded))
+    return objects
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-d", "--devices", type=int, default=10, help="Threaded and hosted devices each.")
+    parser.add_argument("-s", "--seconds", type=float, default=10.0, help="Seconds measured.")
+    parser.add_argument("-p", "--port", type=int, default=5700, help="First of the ports the connections use.")
+    args = parser.parse_args()
+
+    objects = make_objects(args.devices, args.port)
+    # Let startup settle before measuring.
+    time.sleep(1.0)
+    before = {name: [context_switches(thread) for thread in threads] for name, threads in objects}
+    cpu = cpu_seconds()
+    time.sleep(args.seconds)
+    cpu = cpu_seconds() - cpu
+    after = {name: [context_switches(thread) for thread in threads] for name, threads in objects}
+
+    print("{:>14} {:>8} {:>18}".format("object", "threads", "wakeups/s each"))
+    for name, threads in objects:
+        wakeups = sum(after[name]) - sum(before[name])
+        print("{:>14} {:>8} {:>18.1f}".format(name, len(threads), wakeups / args.seconds / len(threads)))
+    print("process CPU {:.2f}% of a core".format(100 * cpu / args.seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/bin/python3
+"""Measures what collecting metrics costs as a share of the hot path.
+
+The hot path is a STATUS request from a TCP client through a tcpConnection and dashDevice and back, timed
+end to end on loopback. The metrics it collects on the way are timed apart, the device's counters and sampled
+timers and the counters the connection adds to per frame, by repeating the same operations alone.
+"""
+
+import argparse
+import socket
+import time
+import timeit
+
+import dashio
+from dashio.metrics import SAMPLE_MASK, ConnectionMetrics, DeviceMetrics, MetricsRegistry
+
+
+def round_trip_seconds(device_id, port, number):
+    client = socket.create_connection(("127.0.0.1", port))
+    client.settimeout(5)
+    request = "\t{}\tSTATUS\n".format(device_id).encode("utf-8")
+    client.sendall(request)
+    client.recv(65536)
+    start = time.perf_counter()
+    for _ in range(number):
+        client.sendall(request)
+        client.recv(65536)
+    elapsed = time.perf_counter() - start
+    client.close()
+    return elapsed / number
+
+
+def device_metric_seconds(number):
+    metrics = DeviceMetrics("BENCH01", registry=MetricsRegistry())
+    command_type = b"STATUS"
+
+    def per_frame():
+        # As dashDevice counts a one command frame, and times it one frame in SAMPLE_EVERY.
+        metrics.frames_in += 1
+        sampled = not metrics.frames_in & SAMPLE_MASK
+        if sampled:
+            start = time.perf_counter()
+        metrics.commands[command_type] += 1
+        if sampled:
+            metrics.reply_seconds.observe(time.perf_counter() - start)
+
+    return min(timeit.repeat(per_frame, number=number, repeat=5)) / number
+
+
+def connection_metric_seconds(number):
+    metrics = ConnectionMetrics("tcp", "bench", registry=MetricsRegistry())
+    message = b"\tBENCH01\tSTATUS\n"
+
+    def per_frame():
+        # A request in and its reply out, as tcpConnection's loop counts them.
+        metrics.frames_in += 1
+        metrics.bytes_in += len(message)
+        size = len(message)
+        metrics.frames_out += 1
+        metrics.bytes_out += size
+
+    return min(timeit.repeat(per_frame, number=number, repeat=5)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", "--number", type=int, default=5000, help="Requests timed.")
+    parser.add_argument("-c", "--controls", type=int, default=20, help="Dials on the device, all in each STATUS.")
+    parser.add_argument("-p", "--port", type=int, default=5720, help="TCP port.")
+    args = parser.parse_args()
+
+    tcp = dashio.tcpConnection(port=args.port)
+    device = dashio.dashDevice("bench", "BENCH01", "Bench")
+    tcp.add_device(device)
+    for i in range(args.controls):
+        device.add_control(dashio.Dial("DIAL{}".format(i)))
+    time.sleep(0.5)
+    round_trip = round_trip_seconds(device.device_id, args.port, args.number)
+
+    device_cost = device_metric_seconds(args.number * 10)
+    connection_cost = connection_metric_seconds(args.number * 10)
+
+    print("round trip per request   {:8.1f} us".format(round_trip * 1e6))
+    print("device metrics           {:8.3f} us".format(device_cost * 1e6))
+    print("connection metrics       {:8.3f} us".format(connection_cost * 1e6))
+    print("overhead                 {:8.2f} %".format(100 * (device_cost + connection_cost) / round_trip))
+
+
+if __name__ == "__main__":
+    main()
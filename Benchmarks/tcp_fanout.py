@@ -0,0 +1,138 @@
+#!/bin/python3
+"""Measures broadcasting one frame to many TCP clients, in sends and deliveries per second and allocations.
+
+The broadcast tcpConnection makes for ALL messages is compared with the path it replaced, which sent the data
+as bytes to each client in turn, copying it into a new zmq message each time, and when debugging decoded it for
+the log per client. Both send over a zmq STREAM socket to loopback clients drained by a separate process.
+
+Sends per second is the sending loop alone, what the connection thread pays, delivered per second waits for
+the clients to read it all. The peak of Python allocations is traced over one run of each, the bytes zmq
+copies are counted from the sizes sent.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import selectors
+import socket
+import time
+import tracemalloc
+
+import zmq
+
+from dashio.tcpconnection import SNDMORE_NOBLOCK
+
+
+def legacy_fanout(tcpsocket, ids, data):
+    debug = logging.root.isEnabledFor(logging.DEBUG)
+    for id in ids:
+        if debug:
+            logging.debug("TCP ID: %s, Tx: %s", id.hex(), data.decode('utf-8').rstrip())
+        tcpsocket.send(id, zmq.SNDMORE)
+        tcpsocket.send(data, zmq.NOBLOCK)
+
+
+def frame_fanout(tcpsocket, ids, data):
+    if logging.root.isEnabledFor(logging.DEBUG):
+        logging.debug("TCP %d clients, Tx: %s", len(ids), data.bytes.decode('utf-8').rstrip())
+    for id in ids:
+        tcpsocket.send(id, SNDMORE_NOBLOCK)
+        tcpsocket.send(data, zmq.NOBLOCK, copy=False)
+
+
+def sink(port, clients, pipe):
+    """Connect the clients and read whatever is sent to them, reporting the bytes each run delivers."""
+    selector = selectors.DefaultSelector()
+    for _ in range(clients):
+        client = socket.create_connection(("127.0.0.1", port))
+        client.setblocking(False)
+        selector.register(client, selectors.EVENT_READ)
+    pipe.send("connected")
+    buffer = bytearray(1 << 16)
+    while True:
+        expected = pipe.recv()
+        if expected is None:
+            return
+        received = 0
+        while received < expected:
+            for key, _ in selector.select():
+                received += key.fileobj.recv_into(buffer)
+        pipe.send(received)
+
+
+def run(fanout, tcpsocket, ids, data, number, pipe):
+    """Returns the seconds spent sending, which is what the connection thread pays, and until delivered."""
+    pipe.send(len(ids) * len(data.bytes if isinstance(data, zmq.Frame) else data) * number)
+    start = time.perf_counter()
+    for _ in range(number):
+        fanout(tcpsocket, ids, data)
+    sent = time.perf_counter() - start
+    pipe.recv()
+    return sent, time.perf_counter() - start
+
+
+def traced_peak(fanout, tcpsocket, ids, data, number, pipe):
+    tracemalloc.start()
+    pipe.send(len(ids) * len(data.bytes if isinstance(data, zmq.Frame) else data) * number)
+    for _ in range(number):
+        fanout(tcpsocket, ids, data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    pipe.recv()
+    return peak
+
+
+def bench(clients, size, number, repeat):
+    context = zmq.Context.instance()
+    tcpsocket = context.socket(zmq.STREAM)
+    # Unlimited so nothing is dropped while the sink catches up, this measures the sending side.
+    tcpsocket.setsockopt(zmq.SNDHWM, 0)
+    port = tcpsocket.bind_to_random_port("tcp://127.0.0.1")
+    pipe, child_pipe = multiprocessing.Pipe()
+    child = multiprocessing.Process(target=sink, args=(port, clients, child_pipe), daemon=True)
+    child.start()
+    pipe.recv()
+    ids = []
+    while len(ids) < clients:
+        id, _ = tcpsocket.recv_multipart()
+        ids.append(id)
+
+    payload = ("\tBENCH01\tTEXT\tT1\t" + "x" * max(0, size - 18) + "\n").encode("utf-8")
+    paths = (("legacy", legacy_fanout, payload), ("frame", frame_fanout, zmq.Frame(payload)))
+    best = {name: [float("inf"), float("inf")] for name, _, _ in paths}
+    # Repeats alternate between the paths so drifting machine load affects both alike, the best run is kept.
+    for _ in range(repeat):
+        for name, fanout, data in paths:
+            sent, delivered = run(fanout, tcpsocket, ids, data, number, pipe)
+            best[name] = [min(best[name][0], sent), min(best[name][1], delivered)]
+    peaks = {name: traced_peak(fanout, tcpsocket, ids, data, number, pipe) for name, fanout, data in paths}
+    pipe.send(None)
+    child.join()
+    tcpsocket.close(0)
+    deliveries = clients * number
+    return [(name, deliveries / best[name][0], deliveries / best[name][1], peaks[name]) for name, _, _ in paths]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-c", "--clients", type=int, nargs="+", default=[1, 10, 100, 500], help="Client counts.")
+    parser.add_argument("-s", "--size", type=int, default=1024, help="Bytes per broadcast frame.")
+    parser.add_argument("-n", "--number", type=int, default=200, help="Broadcasts per run.")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Runs per path, the best is reported.")
+    parser.add_argument("-d", "--debug", action="store_true", help="Enable debug logging, to a null handler.")
+    args = parser.parse_args()
+    if args.debug:
+        logging.root.addHandler(logging.NullHandler())
+        logging.root.setLevel(logging.DEBUG)
+
+    print("{:>8} {:>8} {:>12} {:>14} {:>12} {:>17}".format(
+        "clients", "path", "sends/s", "delivered/s", "py peak (B)", "zmq copied/bcast"))
+    for clients in args.clients:
+        for name, sent, delivered, peak in bench(clients, args.size, args.number, args.repeat):
+            # The legacy path copies the data into a zmq message per client, the frame path never copies it.
+            copied = clients * args.size if name == "legacy" else 0
+            print("{:>8} {:>8} {:>12.0f} {:>14.0f} {:>12} {:>17}".format(clients, name, sent, delivered, peak, copied))
+
+
+if __name__ == "__main__":
+    main()
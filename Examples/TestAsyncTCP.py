@@ -0,0 +1,55 @@
+#!/bin/python3
+
+import argparse
+import asyncio
+import logging
+import signal
+
+import dashio
+
+
+def parse_commandline_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", const=1, default=1, type=int, nargs="?", help="0 = warnings, 1 = info, 2 = debug.")
+    parser.add_argument("-p", "--port", type=int, help="Port number.", default=5000, dest="port")
+    parser.add_argument("-c", "--connection_name", dest="connection", default="TestAsyncTCP", help="IotDashboard Connection name")
+    parser.add_argument("-n", "--devices", type=int, dest="devices", default=10, help="Number of devices to serve.")
+    return parser.parse_args()
+
+
+async def main(args):
+    # Every device and the connection share this one event loop and thread.
+    tcp_con = dashio.asyncTcpConnection(port=args.port)
+    devices = []
+    for i in range(args.devices):
+        device = dashio.asyncDashDevice(args.connection, "ASYNC{:04d}".format(i), "Async Device {}".format(i))
+        tcp_con.add_device(device)
+
+        knob = dashio.Knob("KNB", control_position=dashio.ControlPosition(0.1, 0.1, 0.8, 0.4))
+        dial = dashio.Dial("DIAL", control_position=dashio.ControlPosition(0.1, 0.5, 0.8, 0.4))
+        device.add_control(knob)
+        device.add_control(dial)
+
+        async def knob_event_handler(msg, knob=knob, dial=dial):
+            # Handlers can be coroutines, they run as tasks on the loop.
+            knob.knob_value = float(msg[0])
+            await asyncio.sleep(0.5)
+            dial.dial_value = float(msg[0])
+
+        knob.message_rx_event += knob_event_handler
+        devices.append(device)
+
+    shutdown = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGINT, shutdown.set)
+    await shutdown.wait()
+
+    for device in devices:
+        device.close()
+    tcp_con.close()
+    await asyncio.gather(tcp_con.task, *[device.task for device in devices])
+
+
+if __name__ == "__main__":
+    args = parse_commandline_arguments()
+    logging.basicConfig(level=[logging.WARN, logging.INFO, logging.DEBUG][min(args.verbose, 2)])
+    asyncio.run(main(args))
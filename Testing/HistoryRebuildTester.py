@@ -0,0 +1,77 @@
+#!/bin/python3
+"""Reopens TimeGraph history files with another capacity or segment size and checks what they keep.
+
+Files are written to a temporary directory, empty and full ones, and reopened with a larger and a smaller
+geometry. Each rebuild should keep the newest records that fit, in order, and leave no .rebuild file behind.
+A file whose last append was cut short before its commit should reopen with that record as the newest.
+"""
+
+import os
+import shutil
+import tempfile
+
+from dashio.iotcontrol.mapped_ring_buffer import _HEAD_COUNT_OFFSET, MappedRingBuffer
+
+
+def fill(path, capacity, count, segment_size=64):
+    history = MappedRingBuffer(path, capacity, segment_size)
+    for n in range(count):
+        history.append(1000 + n, float(n), "\t{},{}".format(1000 + n, n).encode("utf-8"))
+    history.close()
+
+
+def records(history):
+    return [bytes(segment) for segment in history.segments()]
+
+
+def main():
+    directory = tempfile.mkdtemp(prefix="dashio_history_")
+    failures = 0
+
+    def check(passed, text):
+        nonlocal failures
+        failures += not passed
+        print("{}: {}".format("PASS" if passed else "FAIL", text))
+
+    def reopen(name, capacity, count, new_capacity, segment_size=64, new_segment_size=64):
+        path = os.path.join(directory, name)
+        fill(path, capacity, count, segment_size)
+        try:
+            history = MappedRingBuffer(path, new_capacity, new_segment_size)
+        except Exception as error:
+            check(False, "{} reopened, raised {!r}".format(name, error))
+            return
+        kept = records(history)
+        history.close()
+        expected = ["\t{},{}".format(1000 + n, n).encode("utf-8") for n in range(count)][-new_capacity:][-capacity:]
+        check(kept == expected, "{} kept its newest {} records in order".format(name, len(expected)))
+        check(not os.path.exists(path + ".rebuild"), "{} left no rebuild file".format(name))
+
+    reopen("empty_larger", 60, 0, 120)
+    reopen("empty_smaller", 60, 0, 30)
+    reopen("empty_segment", 60, 0, 60, new_segment_size=32)
+    reopen("partial_larger", 60, 40, 120)
+    reopen("full_larger", 60, 150, 120)
+    reopen("full_smaller", 60, 150, 20)
+    reopen("full_segment", 60, 150, 60, new_segment_size=128)
+
+    # An append cut short before its commit, in the same second as the newest record.
+    path = os.path.join(directory, "torn_append")
+    history = MappedRingBuffer(path, 4)
+    for n in range(4):
+        history.append(1000 + n // 2, float(n), "\t{},{}".format(1000 + n // 2, n).encode("utf-8"))
+    head_count = bytes(history._mm[_HEAD_COUNT_OFFSET:_HEAD_COUNT_OFFSET + 16])
+    history.append(1001, 4.0, b"\t1001,4")
+    history._mm[_HEAD_COUNT_OFFSET:_HEAD_COUNT_OFFSET + 16] = head_count
+    history.close()
+    history = MappedRingBuffer(path, 4)
+    check(records(history) == [b"\t1000,1", b"\t1001,2", b"\t1001,3", b"\t1001,4"],
+          "an append torn within the newest record's second is kept as the newest")
+    history.close()
+
+    shutil.rmtree(directory, ignore_errors=True)
+    return failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
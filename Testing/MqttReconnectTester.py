@@ -0,0 +1,134 @@
+#!/bin/python3
+"""Takes an mqttConnection through a broker outage against the stand-in broker and checks what reaches it.
+
+While the broker is down a dial is set many times, event log entries are added and an alarm is sent. Once it
+is back the connection should reconnect, subscribe again and drain its queue: the dial's last value only,
+every log entry in order, and the alarm. With --asyncio an asyncMqttConnection, run on an event loop in its own
+thread, is taken through the same outage.
+"""
+
+import argparse
+import asyncio
+import logging
+import shutil
+import tempfile
+import threading
+import time
+
+import dashio
+
+from mqtt_broker_standin import BrokerStandIn
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def start_async_connection(host, port, **kwargs):
+    """Start an asyncMqttConnection on an event loop in a thread of its own, closed and joined as mqttConnection."""
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    holder = {}
+
+    async def create():
+        holder["connection"] = dashio.asyncMqttConnection(host, port, **kwargs)
+        started.set()
+        await holder["connection"].task
+
+    thread = threading.Thread(target=loop.run_until_complete, args=(create(),), daemon=True)
+    thread.start()
+    started.wait()
+    connection = holder["connection"]
+    connection.close = lambda close=connection.close: loop.call_soon_threadsafe(close)
+    connection.join = thread.join
+    return connection
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-o", "--outage", type=float, default=5.0, help="Seconds the broker is down.")
+    parser.add_argument("-u", "--updates", type=int, default=500, help="Dial updates while it is down.")
+    parser.add_argument("-e", "--events", type=int, default=20, help="Log entries while it is down.")
+    parser.add_argument("-r", "--drain-rate", type=float, default=20.0, help="Messages a second drained.")
+    parser.add_argument("-a", "--asyncio", action="store_true", help="Test an asyncMqttConnection.")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format="%(asctime)s, %(message)s")
+
+    queue_path = tempfile.mkdtemp(prefix="dashio_queue_")
+    broker = BrokerStandIn()
+    options = dict(
+        username="test",
+        reconnect_min_delay=0.5,
+        reconnect_max_delay=2,
+        queue_path=queue_path,
+        drain_rate=args.drain_rate,
+    )
+    if args.asyncio:
+        connection = start_async_connection(broker.host, broker.port, **options)
+    else:
+        connection = dashio.mqttConnection("RECON01", broker.host, broker.port, **options)
+    device = dashio.dashDevice("ReconnectTest", "RECON01", "Reconnect Test")
+    dial = dashio.Dial("D1")
+    log = dashio.EventLog("L1")
+    alarm = dashio.Alarm("A1")
+    for control in (dial, log, alarm):
+        device.add_control(control)
+    connection.add_device(device)
+    topic = "test/RECON01/data"
+    failures = 0
+
+    def check(passed, text):
+        nonlocal failures
+        failures += not passed
+        print("{}: {}".format("PASS" if passed else "FAIL", text))
+
+    check(wait_for(lambda: "test/RECON01/control" in broker.subscriptions, 10), "subscribed to the control topic")
+    dial.dial_value = 1
+    check(wait_for(lambda: any(b"\tD1\t" in p for p in broker.payloads(topic)), 10), "published while connected")
+
+    broker.stop()
+    check(wait_for(lambda: not connection.publisher.connected, 5), "saw the broker go")
+    published = len(broker.published)
+    for value in range(args.updates):
+        dial.dial_value = value
+        if value % (args.updates // args.events or 1) == 0 and len(log.log_list) < args.events:
+            log.add_event_data(dashio.EventData("Event", str(len(log.log_list))))
+        time.sleep(args.outage / args.updates)
+    alarm.send()
+    time.sleep(0.5)
+    store = connection.publisher.store
+    print("Stored {} frames, {} collapsed, {} bytes on disk".format(store.pending, store.collapsed, store.bytes))
+
+    reconnects = connection.metrics.reconnects
+    broker.start()
+    check(wait_for(lambda: connection.metrics.reconnects > reconnects, 10), "reconnected")
+    check(wait_for(lambda: "test/RECON01/control" in broker.subscriptions, 5), "subscribed again")
+    drained_at = time.monotonic()
+    check(wait_for(lambda: not store.pending, 30), "drained the queue")
+    drain_seconds = time.monotonic() - drained_at
+
+    frames = b"".join(payload for _, payload, _, _ in broker.published[published:]).split(b"\n")
+    dial_values = [frame for frame in frames if frame.startswith(b"\tRECON01\tDIAL\tD1\t")]
+    events = [frame.split(b"\t")[-1] for frame in frames if frame.startswith(b"\tRECON01\tLOG\tL1\t")]
+    messages = len(broker.published) - published
+    check(dial_values == [b"\tRECON01\tDIAL\tD1\t%d" % (args.updates - 1)], "the dial's last value only")
+    check(events == [str(n).encode() for n in range(len(log.log_list))], "every log entry, in order")
+    check(any(frame.startswith(b"\tRECON01\tA1\t") for frame in frames), "the alarm")
+    print("{} messages drained in {:.2f}s".format(messages, drain_seconds))
+
+    connection.close()
+    connection.join(5)
+    device.close()
+    broker.stop()
+    shutil.rmtree(queue_path, ignore_errors=True)
+    return failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,57 @@
+#!/bin/python3
+"""Feeds sequences of values through a ValueThrottle and checks what is sent and when.
+
+The policy is a deadband of 1, a min_interval of 0.1s and a settle_time of 2s. A change within the deadband
+should go once changes settle, a larger one once min_interval passes, even after a change within the deadband
+armed the settle timer.
+"""
+
+import time
+
+from dashio.iotcontrol.send_policy import SendPolicy, ValueThrottle
+
+
+def run(values, wait):
+    """Update a throttle with each value in turn, then wait. Returns what was sent, with seconds from start."""
+    sent = []
+    start = time.monotonic()
+
+    def send(msg):
+        sent.append((msg, time.monotonic() - start))
+
+    throttle = ValueThrottle(SendPolicy(deadband=1, min_interval=0.1, settle_time=2), send)
+    for value in values:
+        throttle.update(value, str(value))
+    time.sleep(wait)
+    throttle.cancel()
+    return sent
+
+
+def main():
+    failures = 0
+
+    def check(passed, text, sent):
+        nonlocal failures
+        failures += not passed
+        print("{}: {} {}".format("PASS" if passed else "FAIL", text, [(msg, round(at, 2)) for msg, at in sent]))
+
+    sent = run([0, 50], 0.5)
+    check([msg for msg, _ in sent] == ["0", "50"] and 0.05 < sent[1][1] < 0.3,
+          "a large change is sent once min_interval passes", sent)
+
+    sent = run([0, 0.5, 50], 0.5)
+    check([msg for msg, _ in sent] == ["0", "50"] and 0.05 < sent[1][1] < 0.3,
+          "a large change after one within the deadband is sent once min_interval passes", sent)
+
+    sent = run([0, 0.5], 2.5)
+    check([msg for msg, _ in sent] == ["0", "0.5"] and 1.9 < sent[1][1] < 2.3,
+          "a change within the deadband is sent once changes settle", sent)
+
+    sent = run([0, 0.5, 50, 50.5], 0.5)
+    check([msg for msg, _ in sent] == ["0", "50.5"] and 0.05 < sent[1][1] < 0.3,
+          "only the latest of the values held back is sent", sent)
+    return failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,123 @@
+#!/bin/python3
+"""Connects plain TCP clients to a tcpConnection and an asyncTcpConnection and checks both treat them the same.
+
+Each connection allows 2 clients and disconnects clients idle for 1s. Commands from a client should reach the
+devices, frames for ALL should reach every client, a third client should be closed as it connects and an idle
+client once the idle timeout passes.
+"""
+
+import asyncio
+import socket
+import threading
+import time
+
+import zmq
+
+import dashio
+
+PORT = 5990
+
+
+def start_async_connection(**kwargs):
+    # The asyncTcpConnection runs on an event loop in its own thread, as the tester's clients block.
+    started = threading.Event()
+    loop = asyncio.new_event_loop()
+    holder = {}
+
+    async def create():
+        holder["connection"] = dashio.asyncTcpConnection(**kwargs)
+        started.set()
+        await holder["connection"].task
+
+    threading.Thread(target=loop.run_until_complete, args=(create(),), daemon=True).start()
+    started.wait()
+    connection = holder["connection"]
+    connection.stop = lambda: loop.call_soon_threadsafe(connection.close)
+    return connection
+
+
+def start_thread_connection(**kwargs):
+    connection = dashio.tcpConnection(**kwargs)
+    connection.stop = connection.close
+    return connection
+
+
+def client(port):
+    s = socket.create_connection(("127.0.0.1", port))
+    s.settimeout(3)
+    return s
+
+
+def closed(s):
+    """Whether the connection closed s, waiting up to its timeout."""
+    try:
+        return s.recv(1024) == b""
+    except (socket.timeout, ConnectionResetError):
+        return False
+
+
+def wait_clients(connection, count):
+    end = time.monotonic() + 3
+    while len(connection.clients) != count and time.monotonic() < end:
+        time.sleep(0.01)
+    return len(connection.clients) == count
+
+
+def test(name, start, port, check):
+    context = zmq.Context.instance()
+    connection = start(port=port, max_clients=2, idle_timeout=1)
+    # Stand in for the devices, receiving what clients send and sending to the clients.
+    commands = context.socket(zmq.SUB)
+    commands.connect("inproc://TX_{}".format(connection.connection_id))
+    commands.setsockopt(zmq.SUBSCRIBE, b"")
+    replies = context.socket(zmq.PUB)
+    replies.connect("inproc://RX_{}".format(connection.connection_id))
+    time.sleep(0.2)
+
+    first = client(port)
+    second = client(port)
+    check(wait_clients(connection, 2), name + ": two clients connect")
+
+    third = client(port)
+    check(closed(third), name + ": a client past max_clients is closed")
+    check(len(connection.clients) == 2, name + ": only the two clients are kept")
+
+    first.sendall(b"\tD1\tWHO")
+    first.sendall(b"\n")
+    received = commands.recv_multipart() if commands.poll(2000) else None
+    check(received is not None and received[0] == connection.connection_id.encode() and received[2] == b"\tD1\tWHO\n",
+          name + ": a command split across sends reaches the devices once whole")
+
+    replies.send_multipart([b"ALL", b"", b"\tD1\tDIAL\tD01\t5\n"])
+    check(first.recv(1024) == b"\tD1\tDIAL\tD01\t5\n" and second.recv(1024) == b"\tD1\tDIAL\tD01\t5\n",
+          name + ": a frame for ALL reaches every client")
+
+    # The second client stays quiet while the first keeps sending.
+    for _ in range(4):
+        time.sleep(0.5)
+        first.sendall(b"\tD1\tWHO\n")
+    check(closed(second), name + ": an idle client is disconnected")
+    check(wait_clients(connection, 1), name + ": the idle client is forgotten")
+
+    for s in (first, second, third):
+        s.close()
+    connection.stop()
+    commands.close()
+    replies.close()
+
+
+def main():
+    failures = 0
+
+    def check(passed, text):
+        nonlocal failures
+        failures += not passed
+        print("{}: {}".format("PASS" if passed else "FAIL", text))
+
+    test("tcpConnection", start_thread_connection, PORT, check)
+    test("asyncTcpConnection", start_async_connection, PORT + 1, check)
+    return failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,188 @@
+#!/bin/python3
+"""A stand-in MQTT 3.1.1 broker for testing connections locally, no TLS or authentication.
+
+It accepts every client, acknowledges QoS 1 publishes and subscriptions, and passes each publish on at QoS 0
+to the clients subscribed to exactly its topic, wildcards aren't supported. Every publish is recorded in
+published. Outages are made with stop and start, on the same port, or kick to drop the clients only.
+"""
+
+import argparse
+import socket
+import struct
+import threading
+import time
+
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+
+class BrokerStandIn:
+    def __init__(self, port=0, host="127.0.0.1"):
+        """
+        Keyword Arguments:
+            port {int} -- The port to listen on, 0 for any free one. (default: {0})
+            host {str} -- The interface to listen on. (default: {"127.0.0.1"})
+        """
+        self.host = host
+        self.port = port
+        # Publishes received as (topic, payload, qos, time.monotonic()).
+        self.published = []
+        self.subscriptions = {}
+        self.connects = 0
+        self._lock = threading.Lock()
+        self._clients = []
+        self._listener = None
+        self.start()
+
+    def start(self):
+        """Listen for clients, on the port listened on before if stopped."""
+        listener = socket.socket()
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(8)
+        self.port = listener.getsockname()[1]
+        self._listener = listener
+        threading.Thread(target=self.__accept, args=(listener,), daemon=True).start()
+
+    def stop(self):
+        """Stop listening and drop the clients, clients can't connect until start."""
+        if self._listener is not None:
+            # Closing alone leaves a thread blocked in accept, and the port accepting, on Linux.
+            try:
+                self._listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._listener.close()
+            self._listener = None
+        self.kick()
+
+    def kick(self):
+        """Drop the clients connected."""
+        with self._lock:
+            clients = self._clients
+            self._clients = []
+            self.subscriptions = {}
+        for client in clients:
+            try:
+                client.shutdown(socket.SHUT_RDWR)
+                client.close()
+            except OSError:
+                pass
+
+    def topics(self):
+        """The topics published to, in the order first published."""
+        return list(dict.fromkeys(topic for topic, _, _, _ in self.published))
+
+    def payloads(self, topic):
+        return [payload for published_topic, payload, _, _ in self.published if published_topic == topic]
+
+    def __accept(self, listener):
+        while True:
+            try:
+                client, _ = listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._clients.append(client)
+            threading.Thread(target=self.__serve, args=(client,), daemon=True).start()
+
+    def __read(self, client, size):
+        data = b""
+        while len(data) < size:
+            received = client.recv(size - len(data))
+            if not received:
+                raise EOFError
+            data += received
+        return data
+
+    def __send(self, client, packet_type, flags, body):
+        length = len(body)
+        encoded = bytearray()
+        while True:
+            digit = length % 128
+            length //= 128
+            encoded.append(digit | 128 if length else digit)
+            if not length:
+                break
+        try:
+            client.sendall(bytes([packet_type << 4 | flags]) + bytes(encoded) + body)
+        except OSError:
+            pass
+
+    def __serve(self, client):
+        try:
+            while True:
+                header = self.__read(client, 1)[0]
+                multiplier = 1
+                length = 0
+                while True:
+                    digit = self.__read(client, 1)[0]
+                    length += (digit & 127) * multiplier
+                    multiplier *= 128
+                    if not digit & 128:
+                        break
+                body = self.__read(client, length)
+                packet_type = header >> 4
+                if packet_type == CONNECT:
+                    self.connects += 1
+                    self.__send(client, CONNACK, 0, b"\x00\x00")
+                elif packet_type == PUBLISH:
+                    qos = (header >> 1) & 3
+                    topic_length = struct.unpack(">H", body[:2])[0]
+                    topic = body[2:2 + topic_length].decode("utf-8")
+                    payload = body[2 + topic_length:]
+                    if qos:
+                        packet_id, payload = payload[:2], payload[2:]
+                        self.__send(client, PUBACK, 0, packet_id)
+                    self.published.append((topic, payload, qos, time.monotonic()))
+                    with self._lock:
+                        subscribers = list(self.subscriptions.get(topic, ()))
+                    for subscriber in subscribers:
+                        self.__send(subscriber, PUBLISH, 0, body[:2 + topic_length] + payload)
+                elif packet_type == SUBSCRIBE:
+                    packet_id = body[:2]
+                    offset = 2
+                    granted = bytearray()
+                    while offset < len(body):
+                        topic_length = struct.unpack(">H", body[offset:offset + 2])[0]
+                        topic = body[offset + 2:offset + 2 + topic_length].decode("utf-8")
+                        offset += 3 + topic_length
+                        with self._lock:
+                            self.subscriptions.setdefault(topic, set()).add(client)
+                        granted.append(0)
+                    self.__send(client, SUBACK, 0, packet_id + bytes(granted))
+                elif packet_type == PINGREQ:
+                    self.__send(client, PINGRESP, 0, b"")
+                elif packet_type == DISCONNECT:
+                    break
+        except (EOFError, OSError):
+            pass
+        with self._lock:
+            for subscribers in self.subscriptions.values():
+                subscribers.discard(client)
+        client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-p", "--port", type=int, default=1883, help="The port to listen on.")
+    args = parser.parse_args()
+    broker = BrokerStandIn(args.port)
+    print("Listening on {}:{}".format(broker.host, broker.port))
+    try:
+        while True:
+            time.sleep(5)
+            print("{} publishes from {} connects".format(len(broker.published), broker.connects))
+    except KeyboardInterrupt:
+        broker.stop()
+
+
+if __name__ == "__main__":
+    main()
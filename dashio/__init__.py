@@ -3,6 +3,13 @@ from .tcpconnection import tcpConnection
 from .mqttconnection import mqttConnection
 from .zmqconnection import zmqConnection
 from .dashconnection import dashConnection
+from .asyncdashdevice import asyncDashDevice
+from .asynctcpconnection import asyncTcpConnection
+from .asyncmqttconnection import asyncMqttConnection
+from .asynczmqconnection import asyncZmqConnection
+from .asyncdashconnection import asyncDashConnection
+from .devicehost import DeviceHost
+from .metrics import MetricsRegistry, MetricsServer, default_registry as metrics_registry
 from .iotcontrol.enums import (
     Color,
     Icon,
@@ -19,7 +26,10 @@ from .iotcontrol.enums import (
     ButtonState,
     LabelStyle,
     KnobStyle,
-    GraphXAxisLabelsStyle
+    GraphXAxisLabelsStyle,
+    DownsampleMethod,
+    HandlerPolicy,
+    OverflowPolicy
 )
 from .iotcontrol.graph import Graph, GraphLine
 from .iotcontrol.slider_single_bar import SliderSingleBar
@@ -39,3 +49,4 @@ from .iotcontrol.page import Page
 from .iotcontrol.control import ControlPosition
 from .iotcontrol.button_group import ButtonGroup
 from .iotcontrol.event_log import EventData, EventLog
+from .iotcontrol.send_policy import SendPolicy
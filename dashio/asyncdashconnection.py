@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import paho.mqtt.client as mqtt
+import shortuuid
+import ssl
+import zmq
+import zmq.asyncio
+
+from .asyncmqttconnection import MqttLoopAdapter
+from .compression import take_compress_request
+from .metrics import ConnectionMetrics
+from .mqttpublisher import MqttPublisher
+
+
+class asyncDashConnection:
+    """A dashConnection run as a task on an asyncio event loop instead of its own thread.
+
+    It must be created from a coroutine running on the loop.
+    """
+
+    def __on_connect(self, client, userdata, flags, rc):
+        logging.debug("rc: %s", str(rc))
+        if rc == 0:
+            if self._connected_before:
+                self.metrics.reconnects += 1
+            self._connected_before = True
+            # The broker forgets subscriptions with the session, they are made again on every connect.
+            for control_topic in self._control_topics:
+                self.dash_c.subscribe(control_topic, 0)
+            self.publisher.on_connect()
+            # Announces made before the first connect were dropped, the devices announce again each time.
+            for device in self._devices:
+                device.send_dash_connect()
+
+    def __on_message(self, client, obj, msg):
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("DASH RX: %s", str(msg.payload, "utf-8", "replace").strip())
+        self.metrics.frames_in += 1
+        self.metrics.bytes_in += len(msg.payload)
+        commands, modes = take_compress_request(msg.payload)
+        if modes is not None:
+            # Asked of the connection for the device's data topic, the reply goes now rather than with the
+            # next frame.
+            self.publisher.compress_request(msg.topic.rsplit("/", 1)[0] + "/data", modes)
+            self.publisher.flush()
+        if commands:
+            self.tx_zmq_pub.send_multipart([self.b_connection_id, b'1', commands])
+
+    def __topic(self, address, b_device_id):
+        # Topics are built once per device and message kind and looked up by the frame's address and device ID.
+        try:
+            return self._topics[(address, b_device_id)]
+        except KeyError:
+            if address == b'ANNOUNCE':
+                kind = "announce"
+            elif address == b'ALARM':
+                kind = "alarm"
+            else:
+                kind = "data"
+            topic = "{}/{}/{}".format(self.username, b_device_id.decode('utf-8').strip(), kind)
+            self._topics[(address, b_device_id)] = topic
+            return topic
+
+    def __on_publish(self, client, obj, mid):
+        self.publisher.on_publish(mid)
+
+    def __on_subscribe(self, client, obj, mid, granted_qos):
+        logging.debug("Subscribed: %s %s", str(mid), str(granted_qos))
+
+    def __on_log(self, client, obj, level, string):
+        logging.debug(string)
+
+    def add_device(self, device):
+        device.add_connection(self.connection_id)
+        control_topic = "{}/{}/control".format(self.username, device.device_id)
+        self._control_topics.append(control_topic)
+        self._devices.append(device)
+        self.dash_c.subscribe(control_topic, 0)
+        device.send_dash_connect()
+
+    def __init__(
+        self,
+        username,
+        password,
+        host='dash.dashio.io',
+        port=8883,
+        context=None,
+        publish_window=0.0,
+        max_payload=16384,
+        max_inflight=20,
+        max_queued=1000,
+        max_rate=None,
+        compression=False,
+        compress_threshold=1024,
+        reconnect_min_delay=1,
+        reconnect_max_delay=120,
+    ):
+        """
+        Arguments:
+            username {str} -- username for the dash connection.
+            password {str} -- password for the dash connection.
+
+        Keyword Arguments:
+            host {str} -- The server name of the dash host. (default: {'dash.dashio.io'})
+            port {int} -- Port number to connect to. (default: {8883})
+            context {zmq.asyncio.Context} -- The zmq context to use, by default one sharing
+                zmq.Context.instance(). (default: {None})
+            publish_window {float} -- Seconds frames wait to be joined with others to the same topic, 0 joins
+                only those already waiting. (default: {0.0})
+            max_payload {int} -- The most bytes of frames joined in one message. (default: {16384})
+            max_inflight {int} -- The most alarms waiting for acknowledgement, they are sent at QoS 1.
+                (default: {20})
+            max_queued {int} -- The most messages held by paho, unwritten or unacknowledged. (default: {1000})
+            max_rate {float} -- The most messages published per second, None for no limit. (default: {None})
+            compression {bool} -- Whether a dashboard asking for a device's data to be compressed gets it.
+                Every dashboard reading the device then gets its large messages compressed. (default: {False})
+            compress_threshold {int} -- The smallest message compressed. (default: {1024})
+            reconnect_min_delay {float} -- Seconds before the first try to reconnect, doubled for each that
+                fails. (default: {1})
+            reconnect_max_delay {float} -- The most seconds between tries to reconnect. (default: {120})
+        """
+        self.context = context or zmq.asyncio.Context(zmq.Context.instance())
+
+        self.connection_id = shortuuid.uuid()
+        self.b_connection_id = self.connection_id.encode('utf-8')
+        self.metrics = ConnectionMetrics("dash", self.connection_id)
+        self._connected_before = False
+
+        self.username = username
+        self._control_topics = []
+        self._devices = []
+        self._topics = {}
+
+        self.tx_zmq_pub = self.context.socket(zmq.PUB)
+        self.tx_zmq_pub.bind("inproc://TX_{}".format(self.connection_id))
+
+        self.rx_zmq_sub = self.context.socket(zmq.SUB)
+        self.rx_zmq_sub.bind("inproc://RX_{}".format(self.connection_id))
+        # Subscribe on ALL, and my connection
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b"ALL")
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b"ANNOUNCE")
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b"ALARM")
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, self.b_connection_id)
+
+        self.dash_c = mqtt.Client()
+        self.publisher = MqttPublisher(
+            self.dash_c,
+            self.metrics,
+            window=publish_window,
+            max_payload=max_payload,
+            max_inflight=max_inflight,
+            max_queued=max_queued,
+            max_rate=max_rate,
+            compression=compression,
+            compress_threshold=compress_threshold,
+        )
+        self.dash_c.on_message = self.__on_message
+        self.dash_c.on_connect = self.__on_connect
+        self.dash_c.on_publish = self.__on_publish
+        self.dash_c.on_subscribe = self.__on_subscribe
+        self.dash_c.on_log = self.__on_log
+        self.dash_c.tls_set(
+            ca_certs=None,
+            certfile=None,
+            keyfile=None,
+            cert_reqs=ssl.CERT_REQUIRED,
+            tls_version=ssl.PROTOCOL_TLSv1_2,
+            ciphers=None,
+        )
+        self.dash_c.tls_insecure_set(False)
+        self.dash_c.username_pw_set(username, password)
+
+        loop = asyncio.get_running_loop()
+        self.adapter = MqttLoopAdapter(self.dash_c, loop, reconnect_min_delay, reconnect_max_delay)
+        self.dash_c.connect_async(host, port)
+        self.adapter.connect()
+        self.task = loop.create_task(self.run())
+
+    def close(self):
+        self.task.cancel()
+
+    async def run(self):
+        try:
+            while True:
+                # Every frame waiting is taken so those to the same topic can be published together.
+                if await self.rx_zmq_sub.poll(self.publisher.timeout()):
+                    while True:
+                        try:
+                            [address, id, data] = await self.rx_zmq_sub.recv_multipart(zmq.NOBLOCK)
+                        except zmq.error.Again:
+                            break
+                        if logging.root.isEnabledFor(logging.DEBUG):
+                            logging.debug("TX: %s", data.decode('utf-8', 'replace').rstrip())
+                        if address != b'ANNOUNCE' and address != b'ALARM':
+                            address = b'ALL'
+                        self.publisher.add(self.__topic(address, data.split(b'\t', 2)[1]), data, address == b'ALARM')
+                self.publisher.flush()
+        except asyncio.CancelledError:
+            pass
+        except zmq.error.ContextTerminated:
+            logging.debug("Dash connection %s context terminated", self.connection_id)
+        finally:
+            self.publisher.flush(force=True)
+            self.adapter.close()
+            self.dash_c.disconnect()
+            self.tx_zmq_pub.close()
+            self.rx_zmq_sub.close()
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import zmq
+import zmq.asyncio
+
+from .dashdevice import dashDeviceCore
+
+
+class asyncDashDevice(dashDeviceCore):
+
+    """A dashDevice run as a task on an asyncio event loop instead of its own thread.
+
+    Any number of async devices and connections can share one loop. They must be created from a coroutine
+    running on that loop, and their controls updated from it. Control handlers may be coroutine functions,
+    they are run as tasks on the loop.
+    """
+
+    def __init__(self, device_type, device_id, device_name, context=None, coalesce_window=0.0) -> None:
+        """
+        Parameters
+        ----------
+        device_type : str
+            The type of device, shown by the dashboard.
+        device_id : str
+            A unique identifier for the device.
+        device_name : str
+            The name of the device, shown by the dashboard.
+        context : zmq.asyncio.Context, optional
+            The zmq context to use. By default one sharing zmq.Context.instance() so threaded connections can
+            be used too.
+        coalesce_window : float, optional
+            Seconds to hold control updates before sending them as one frame. Within the window only the
+            latest state of each control is sent. 0 sends every update immediately.
+        """
+        self.context = context or zmq.asyncio.Context(zmq.Context.instance())
+        self.tx_zmq_pub = self.context.socket(zmq.PUB)
+        self.rx_zmq_sub = self.context.socket(zmq.SUB)
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b"")
+        dashDeviceCore.__init__(self, device_type, device_id, device_name, coalesce_window)
+        self._loop = asyncio.get_running_loop()
+        self._flush_handle = None
+        self.task = self._loop.create_task(self.run())
+
+    def _call_soon(self, func, *args):
+        # The sockets belong to the loop, calls from timer and other threads are made on it.
+        try:
+            on_loop = asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            func(*args)
+        else:
+            self._loop.call_soon_threadsafe(func, *args)
+
+    def _queue_data(self, msg):
+        # Updates can come from timer threads as well as the loop, so the flush is scheduled thread safely.
+        opened = super()._queue_data(msg)
+        if opened:
+            self._loop.call_soon_threadsafe(self.__arm_flush)
+        return opened
+
+    def __arm_flush(self):
+        self._flush_handle = self._loop.call_later(self.coalesce_window, self._flush_data)
+
+    def close(self):
+        self.task.cancel()
+
+    async def run(self):
+        try:
+            while True:
+                msg = await self.rx_zmq_sub.recv_multipart()
+                if len(msg) == 3:
+                    reply = self._on_message(msg[2])
+                    if reply:
+                        await self.tx_zmq_pub.send_multipart([msg[0], msg[1], reply])
+        except asyncio.CancelledError:
+            pass
+        except zmq.error.ContextTerminated:
+            logging.debug("Device %s context terminated", self.device_id)
+        finally:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+            self._flush_data()
+            self.tx_zmq_pub.close()
+            self.rx_zmq_sub.close()
@@ -0,0 +1,322 @@
+import asyncio
+import logging
+import paho.mqtt.client as mqtt
+import ssl
+import uuid
+import zmq
+import zmq.asyncio
+
+from .compression import take_compress_request
+from .metrics import ConnectionMetrics
+from .mqttpublisher import MqttPublisher
+from .segmentqueue import SegmentQueue
+
+
+class MqttLoopAdapter:
+    """Drives a paho MQTT client from an asyncio event loop instead of paho's network thread.
+
+    The client's socket is watched with the loop's add_reader and add_writer, and its keepalive handled by a
+    task waking once a second while connected. Another task connects, and reconnects whenever the connection
+    drops, waiting longer after each failure. paho's connect blocks until the socket is open, so it runs in the
+    loop's default executor and the socket callbacks it makes are passed back to the loop.
+    """
+
+    def __init__(self, client, loop, min_delay=1, max_delay=120):
+        """
+        Arguments:
+            client {mqtt.Client} -- The client, connect_async sets where it connects to.
+            loop {asyncio.AbstractEventLoop} -- The loop driving it.
+
+        Keyword Arguments:
+            min_delay {float} -- Seconds before the first try to reconnect, doubled for each that fails.
+                (default: {1})
+            max_delay {float} -- The most seconds between tries to reconnect. (default: {120})
+        """
+        self.client = client
+        self.loop = loop
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.misc = None
+        self.connector = None
+        self._closed = asyncio.Event()
+        self._connected = False
+        client.on_socket_open = self.__on_socket_open
+        client.on_socket_close = self.__on_socket_close
+        client.on_socket_register_write = self.__on_socket_register_write
+        client.on_socket_unregister_write = self.__on_socket_unregister_write
+
+    def __call(self, func, *args):
+        try:
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            func(*args)
+        else:
+            self.loop.call_soon_threadsafe(func, *args)
+
+    def __on_socket_open(self, client, userdata, sock):
+        self.__call(self.__socket_opened, sock)
+
+    def __socket_opened(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        self.misc = self.loop.create_task(self.__misc_loop())
+
+    def __on_socket_close(self, client, userdata, sock):
+        self.__call(self.__socket_closed, sock)
+
+    def __socket_closed(self, sock):
+        self.loop.remove_reader(sock)
+        if self.misc is not None:
+            self.misc.cancel()
+            self.misc = None
+        self._closed.set()
+
+    def __on_socket_register_write(self, client, userdata, sock):
+        self.__call(self.loop.add_writer, sock, self.client.loop_write)
+
+    def __on_socket_unregister_write(self, client, userdata, sock):
+        self.__call(self.loop.remove_writer, sock)
+
+    async def __misc_loop(self):
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            if self.client.is_connected():
+                self._connected = True
+            await asyncio.sleep(1)
+
+    def connect(self):
+        """Start connecting, to where connect_async was last given."""
+        self.connector = self.loop.create_task(self.__connect_loop())
+
+    async def __connect_loop(self):
+        delay = self.min_delay
+        while True:
+            self._closed.clear()
+            self._connected = False
+            try:
+                await self.loop.run_in_executor(None, self.client.reconnect)
+            except OSError as e:
+                logging.debug("MQTT connect failed: %s", e)
+            else:
+                await self._closed.wait()
+                if self._connected:
+                    delay = self.min_delay
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+
+    def close(self):
+        if self.connector is not None:
+            self.connector.cancel()
+            self.connector = None
+
+
+class asyncMqttConnection:
+    """An mqttConnection run as a task on an asyncio event loop instead of its own thread.
+
+    It must be created from a coroutine running on the loop.
+    """
+
+    def __on_connect(self, client, userdata, flags, rc):
+        logging.debug("rc: %s", str(rc))
+        if rc == 0:
+            if self._connected_before:
+                self.metrics.reconnects += 1
+            self._connected_before = True
+            # The broker forgets subscriptions with the session, they are made again on every connect.
+            for control_topic in self._control_topics:
+                self.mqttc.subscribe(control_topic, 0)
+            self.publisher.on_connect()
+            # Wakes the loop to drain what was stored while disconnected.
+            self.__wake()
+
+    def __on_disconnect(self, client, userdata, rc):
+        logging.info("MQTT connection %s disconnected, rc: %s", self.connection_id, str(rc))
+        self.publisher.on_disconnect()
+
+    def __wake(self):
+        # paho's callbacks run on the loop, so the run task's poll can be ended here.
+        if self._polling is not None and not self._polling.done():
+            self._polling.set_result(0)
+
+    def __on_message(self, client, obj, msg):
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("DASH RX: %s", str(msg.payload, "utf-8", "replace").strip())
+        self.metrics.frames_in += 1
+        self.metrics.bytes_in += len(msg.payload)
+        commands, modes = take_compress_request(msg.payload)
+        if modes is not None:
+            # Asked of the connection for the device's data topic, the reply goes now rather than with the
+            # next frame.
+            self.publisher.compress_request(msg.topic.rsplit("/", 1)[0] + "/data", modes)
+            self.publisher.flush()
+        if commands:
+            self.tx_zmq_pub.send_multipart([self.b_connection_id, b'1', commands])
+
+    def __data_topic(self, b_device_id):
+        # Topics are built once per device and looked up by the device ID bytes of each frame.
+        try:
+            return self._data_topics[b_device_id]
+        except KeyError:
+            topic = "{}/{}/data".format(self.username, b_device_id.decode('utf-8').strip())
+            self._data_topics[b_device_id] = topic
+            return topic
+
+    def __on_publish(self, client, obj, mid):
+        self.publisher.on_publish(mid)
+
+    def __on_subscribe(self, client, obj, mid, granted_qos):
+        logging.debug("Subscribed: %s %s", str(mid), str(granted_qos))
+
+    def __on_log(self, client, obj, level, string):
+        logging.debug(string)
+
+    def add_device(self, device):
+        device.add_connection(self.connection_id.hex)
+        control_topic = "{}/{}/control".format(self.username, device.device_id)
+        self._control_topics.append(control_topic)
+        self.mqttc.subscribe(control_topic, 0)
+
+    def __init__(
+        self,
+        host,
+        port,
+        username="",
+        password="",
+        use_ssl=False,
+        context=None,
+        publish_window=0.0,
+        max_payload=16384,
+        max_inflight=20,
+        max_queued=1000,
+        max_rate=None,
+        compression=False,
+        compress_threshold=1024,
+        reconnect_min_delay=1,
+        reconnect_max_delay=120,
+        queue_path=None,
+        queue_max_bytes=16 * 1024 * 1024,
+        drain_rate=10.0,
+    ):
+        """
+        Arguments:
+            host {str} -- The server name of the mqtt host.
+            port {int} -- Port number to connect to.
+
+        Keyword Arguments:
+            username {str} -- username for the mqtt connection. (default: {""})
+            password {str} -- password for the mqtt connection. (default: {""})
+            use_ssl {bool} -- Whether to use ssl for the connection or not. (default: {False})
+            context {zmq.asyncio.Context} -- The zmq context to use, by default one sharing
+                zmq.Context.instance(). (default: {None})
+            publish_window {float} -- Seconds frames wait to be joined with others to the same topic, 0 joins
+                only those already waiting. (default: {0.0})
+            max_payload {int} -- The most bytes of frames joined in one message. (default: {16384})
+            max_inflight {int} -- The most alarms waiting for acknowledgement, they are sent at QoS 1.
+                (default: {20})
+            max_queued {int} -- The most messages held by paho, unwritten or unacknowledged. (default: {1000})
+            max_rate {float} -- The most messages published per second, None for no limit. (default: {None})
+            compression {bool} -- Whether a dashboard asking for a device's data to be compressed gets it.
+                Every dashboard reading the device then gets its large messages compressed. (default: {False})
+            compress_threshold {int} -- The smallest message compressed. (default: {1024})
+            reconnect_min_delay {float} -- Seconds before the first try to reconnect, doubled for each that
+                fails. (default: {1})
+            reconnect_max_delay {float} -- The most seconds between tries to reconnect. (default: {120})
+            queue_path {str} -- A directory of its own to keep frames in while disconnected, alarms and
+                event log entries included. None drops them. (default: {None})
+            queue_max_bytes {int} -- The most bytes kept in queue_path, the oldest frames are dropped past
+                it. (default: {16 MiB})
+            drain_rate {float} -- The most messages a second published from queue_path once reconnected.
+                (default: {10.0})
+        """
+        self.context = context or zmq.asyncio.Context(zmq.Context.instance())
+
+        self.connection_id = uuid.uuid4()
+        self.b_connection_id = self.connection_id.hex.encode('utf-8')
+        self.metrics = ConnectionMetrics("mqtt", self.connection_id.hex)
+        self._connected_before = False
+
+        self.username = username
+        self._data_topics = {}
+        self._control_topics = []
+        # The run task's poll of rx_zmq_sub, None until it first polls.
+        self._polling = None
+
+        self.tx_zmq_pub = self.context.socket(zmq.PUB)
+        self.tx_zmq_pub.bind("inproc://TX_{}".format(self.connection_id.hex))
+
+        self.rx_zmq_sub = self.context.socket(zmq.SUB)
+        self.rx_zmq_sub.bind("inproc://RX_{}".format(self.connection_id.hex))
+        # Subscribe on ALL, and my connection
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b"ALL")
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b"ALARM")
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, self.b_connection_id)
+
+        self.mqttc = mqtt.Client()
+        self.publisher = MqttPublisher(
+            self.mqttc,
+            self.metrics,
+            window=publish_window,
+            max_payload=max_payload,
+            max_inflight=max_inflight,
+            max_queued=max_queued,
+            max_rate=max_rate,
+            compression=compression,
+            compress_threshold=compress_threshold,
+            store=SegmentQueue(queue_path, queue_max_bytes) if queue_path else None,
+            drain_rate=drain_rate,
+        )
+        self.mqttc.on_message = self.__on_message
+        self.mqttc.on_connect = self.__on_connect
+        self.mqttc.on_disconnect = self.__on_disconnect
+        self.mqttc.on_publish = self.__on_publish
+        self.mqttc.on_subscribe = self.__on_subscribe
+        self.mqttc.on_log = self.__on_log
+        if use_ssl:
+            self.mqttc.tls_set(
+                ca_certs=None,
+                certfile=None,
+                keyfile=None,
+                cert_reqs=ssl.CERT_REQUIRED,
+                tls_version=ssl.PROTOCOL_TLSv1_2,
+                ciphers=None,
+            )
+            self.mqttc.tls_insecure_set(False)
+        if username and password:
+            self.mqttc.username_pw_set(username, password)
+
+        loop = asyncio.get_running_loop()
+        self.adapter = MqttLoopAdapter(self.mqttc, loop, reconnect_min_delay, reconnect_max_delay)
+        self.mqttc.connect_async(host, port)
+        self.adapter.connect()
+        self.task = loop.create_task(self.run())
+
+    def close(self):
+        self.task.cancel()
+
+    async def run(self):
+        try:
+            while True:
+                # Every frame waiting is taken so those to the same topic can be published together.
+                self._polling = self.rx_zmq_sub.poll(self.publisher.timeout())
+                if await self._polling:
+                    while True:
+                        try:
+                            [address, id, data] = await self.rx_zmq_sub.recv_multipart(zmq.NOBLOCK)
+                        except zmq.error.Again:
+                            break
+                        if logging.root.isEnabledFor(logging.DEBUG):
+                            logging.debug("%s TX: %s", self.connection_id.hex, data.decode('utf-8', 'replace').rstrip())
+                        self.publisher.add(self.__data_topic(data.split(b'\t', 2)[1]), data, address == b'ALARM')
+                self.publisher.flush()
+        except asyncio.CancelledError:
+            pass
+        except zmq.error.ContextTerminated:
+            logging.debug("MQTT connection %s context terminated", self.connection_id.hex)
+        finally:
+            self.publisher.flush(force=True)
+            if self.publisher.store is not None:
+                self.publisher.store.close()
+            self.adapter.close()
+            self.mqttc.disconnect()
+            self.tx_zmq_pub.close()
+            self.rx_zmq_sub.close()
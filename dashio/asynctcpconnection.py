@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import shortuuid
+import socket
+import time
+import zmq
+import zmq.asyncio
+from zeroconf import ServiceInfo, IPVersion
+from zeroconf.asyncio import AsyncZeroconf
+
+from .compression import MODES, FrameCompressor
+from .iotcontrol.enums import OverflowPolicy
+from .metrics import ConnectionMetrics
+from .tcpconnection import TcpClientRegistry
+
+
+class asyncTcpConnection:
+    """A tcpConnection run as a task on an asyncio event loop instead of its own thread.
+
+    It must be created from a coroutine running on the loop, and can serve both asyncDashDevice and dashDevice
+    when they share its zmq context.
+    """
+
+    def __get_local_ip_address(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # doesn't even have to be reachable
+            s.connect(('10.255.255.255', 1))
+            IP = s.getsockname()[0]
+        except Exception:
+            IP = '127.0.0.1'
+        finally:
+            s.close()
+        return IP
+
+    async def __zconf_publish_tcp(self, port):
+        zconf_desc = {'ConnectionUUID': self.connection_id}
+        zconf_info = ServiceInfo(
+            "_DashIO._tcp.local.",
+            "{}._DashIO._tcp.local.".format(self.connection_id),
+            addresses=[socket.inet_aton(self.local_ip)],
+            port=port,
+            properties=zconf_desc,
+            server=self.host_name + ".",
+        )
+        await self.zeroconf.async_register_service(zconf_info)
+
+    def add_device(self, device):
+        device.add_connection(self.connection_id)
+
+    def __init__(
+        self,
+        ip="*",
+        port=5000,
+        context=None,
+        max_rx_buffer=65536,
+        idle_timeout=0,
+        max_clients=0,
+        send_hwm=1000,
+        overflow=OverflowPolicy.DROP_OLDEST,
+        evict_after=30.0,
+        compression=True,
+        compress_threshold=1024
+    ):
+        """
+        Keyword Arguments:
+            ip {str} -- The interface to listen on. (default: {"*"})
+            port {int} -- The TCP port to listen on. (default: {5000})
+            context {zmq.asyncio.Context} -- The zmq context to use, by default one sharing
+                zmq.Context.instance(). (default: {None})
+            max_rx_buffer {int} -- The most bytes of an unfinished command kept per client. A client going
+                over it has its partial command dropped. (default: {65536})
+            idle_timeout {float} -- Seconds a client may send nothing before it is disconnected, 0 never
+                disconnects idle clients. (default: {0})
+            max_clients {int} -- The most clients connected at once, further connections are closed as they
+                arrive. 0 for no limit. (default: {0})
+            send_hwm {int} -- The most frames queued for a client whose socket can't keep up. (default: {1000})
+            overflow {OverflowPolicy} -- What to drop when a client's queue is full. COLLAPSE also replaces a
+                queued state update with a newer one for the same control, points, log entries and alarms are
+                all kept. (default: {OverflowPolicy.DROP_OLDEST})
+            evict_after {float} -- Seconds a client's queue may stay full before the client is disconnected,
+                0 never evicts. (default: {30.0})
+            compression {bool} -- Whether clients asking for compression get it. Those that do are sent
+                frames of compress_threshold bytes or more compressed. (default: {True})
+            compress_threshold {int} -- The smallest frame compressed. (default: {1024})
+        """
+        self.context = context or zmq.asyncio.Context(zmq.Context.instance())
+        self.connection_id = shortuuid.uuid()
+        self.b_connection_id = self.connection_id.encode('utf-8')
+        self.metrics = ConnectionMetrics("tcp", self.connection_id)
+        self.port = port
+        # Connected clients keyed by their zmq STREAM ID, and the frames queued for them, as tcpConnection.
+        compressors = {}
+        if compression:
+            compressors = {mode: FrameCompressor(mode, compress_threshold) for mode in MODES}
+        self.clients = TcpClientRegistry(
+            self.metrics, max_rx_buffer, idle_timeout, max_clients, send_hwm, overflow, evict_after, compressors
+        )
+
+        self.tx_zmq_pub = self.context.socket(zmq.PUB)
+        self.tx_zmq_pub.bind("inproc://TX_{}".format(self.connection_id))
+
+        self.rx_zmq_sub = self.context.socket(zmq.SUB)
+        self.rx_zmq_sub.bind("inproc://RX_{}".format(self.connection_id))
+        # Subscribe on ALL, and my connection
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b"ALL")
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b"ALARM")
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, self.b_connection_id)
+
+        self.tcpsocket = self.context.socket(zmq.STREAM)
+        self.tcpsocket.bind("tcp://" + ip + ":" + str(port))
+        # Clients are sent frames without waiting through a plain socket over the same zmq socket.
+        self.clients.socket = zmq.Socket.shadow(self.tcpsocket.underlying)
+
+        host_name = socket.gethostname()
+        hs = host_name.split(".")
+        # rename for .local mDNS advertising
+        self.host_name = "{}.local".format(hs[0])
+
+        self.local_ip = self.__get_local_ip_address()
+        self.zeroconf = AsyncZeroconf(ip_version=IPVersion.V4Only)
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def close(self):
+        self.task.cancel()
+
+    async def run(self):
+        await self.__zconf_publish_tcp(self.port)
+        clients = self.clients
+        # Polled like tcpConnection rather than left waiting in a receive, frames sent to clients between polls
+        # could otherwise use up the wake up for one already received.
+        poller = zmq.asyncio.Poller()
+        poller.register(self.tcpsocket, zmq.POLLIN)
+        poller.register(self.rx_zmq_sub, zmq.POLLIN)
+        try:
+            while True:
+                socks = dict(await poller.poll(clients.timeout(time.monotonic())))
+                now = time.monotonic()
+                if self.tcpsocket in socks:
+                    id, message = await self.tcpsocket.recv_multipart()
+                    commands = clients.receive(id, message, now)
+                    if commands:
+                        await self.tx_zmq_pub.send_multipart([self.b_connection_id, id, commands])
+                if self.rx_zmq_sub in socks:
+                    [address, msg_id, data] = await self.rx_zmq_sub.recv_multipart()
+                    if address == b'ALL':
+                        clients.broadcast(data)
+                    elif address == self.b_connection_id:
+                        clients.send(msg_id, data)
+                clients.service(now)
+        except asyncio.CancelledError:
+            pass
+        except zmq.error.ContextTerminated:
+            logging.debug("TCP connection %s context terminated", self.connection_id)
+        finally:
+            clients.close()
+            await self.zeroconf.async_unregister_all_services()
+            await self.zeroconf.async_close()
+            self.tcpsocket.close()
+            self.tx_zmq_pub.close()
+            self.rx_zmq_sub.close()
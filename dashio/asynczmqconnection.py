@@ -0,0 +1,133 @@
+import asyncio
+import logging
+import shortuuid
+import socket
+import zmq
+import zmq.asyncio
+from zeroconf import ServiceInfo, IPVersion
+from zeroconf.asyncio import AsyncZeroconf
+
+from .metrics import ConnectionMetrics
+
+
+class asyncZmqConnection:
+    """A zmqConnection run as a task on an asyncio event loop instead of its own thread.
+
+    It must be created from a coroutine running on the loop.
+    """
+
+    def __get_local_ip_address(self):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # doesn't even have to be reachable
+            s.connect(('10.255.255.255', 1))
+            IP = s.getsockname()[0]
+        except Exception:
+            IP = '127.0.0.1'
+        finally:
+            s.close()
+        return IP
+
+    async def __zconf_publish_zmq(self, sub_port, pub_port):
+        zconf_desc = {'sub_port': str(sub_port),
+                      'pub_port': str(pub_port)}
+
+        zconf_info = ServiceInfo(
+            "_DashZMQ._tcp.local.",
+            "{}._DashZMQ._tcp.local.".format(self.connection_id),
+            addresses=[socket.inet_aton(self.local_ip)],
+            port=pub_port,
+            properties=zconf_desc,
+            server=self.host_name + ".",
+        )
+        await self.zeroconf.async_register_service(zconf_info)
+
+    def add_device(self, device):
+        device.add_connection(self.connection_id)
+        sub_topic = "\t{}".format(device.device_id)
+        self.ext_rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, sub_topic.encode('utf-8'))
+
+    def close(self):
+        self.task.cancel()
+
+    def __init__(self, zmq_out_url="*", pub_port=5555, sub_port=5556, context=None):
+        """
+        Keyword Arguments:
+            zmq_out_url {str} -- The interface to bind to. (default: {"*"})
+            pub_port {int} -- The port messages to the dashboard are published on. (default: {5555})
+            sub_port {int} -- The port commands from the dashboard are received on. (default: {5556})
+            context {zmq.asyncio.Context} -- The zmq context to use, by default one sharing
+                zmq.Context.instance(). (default: {None})
+        """
+        self.context = context or zmq.asyncio.Context(zmq.Context.instance())
+        self.pub_port = pub_port
+        self.sub_port = sub_port
+
+        self.connection_id = shortuuid.uuid()
+        self.b_connection_id = self.connection_id.encode('utf-8')
+        self.metrics = ConnectionMetrics("zmq", self.connection_id)
+
+        self.tx_zmq_pub = self.context.socket(zmq.PUB)
+        self.tx_zmq_pub.bind("inproc://TX_{}".format(self.connection_id))
+
+        self.rx_zmq_sub = self.context.socket(zmq.SUB)
+        self.rx_zmq_sub.bind("inproc://RX_{}".format(self.connection_id))
+        #  Subscribe on ALL, and my connection
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b"ALL")
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b"ALARM")
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, self.b_connection_id)
+
+        self.ext_tx_zmq_pub = self.context.socket(zmq.PUB)
+        self.ext_tx_zmq_pub.bind("tcp://{}:{}".format(zmq_out_url, pub_port))
+
+        self.ext_rx_zmq_sub = self.context.socket(zmq.SUB)
+        self.ext_rx_zmq_sub.bind("tcp://{}:{}".format(zmq_out_url, sub_port))
+        # Subscribe on WHO, and my deviceID
+        self.ext_rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b'\tWHO')
+
+        host_name = socket.gethostname()
+        hs = host_name.split(".")
+        # rename for .local mDNS advertising
+        self.host_name = "{}.local".format(hs[0])
+
+        self.local_ip = self.__get_local_ip_address()
+        self.zeroconf = AsyncZeroconf(ip_version=IPVersion.V4Only)
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def __ext_rx(self):
+        while True:
+            message = await self.ext_rx_zmq_sub.recv()
+            self.metrics.frames_in += 1
+            self.metrics.bytes_in += len(message)
+            if logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("ZMQ Rx: %s", message.decode('utf-8', 'replace').rstrip())
+            await self.tx_zmq_pub.send_multipart([self.b_connection_id, b'', message])
+
+    async def __device_rx(self):
+        while True:
+            [address, msg_id, data] = await self.rx_zmq_sub.recv_multipart()
+            if address == b'ALL' or address == self.b_connection_id:
+                if logging.root.isEnabledFor(logging.DEBUG):
+                    logging.debug("ZMQ Tx: %s", data.decode('utf-8', 'replace').rstrip())
+                await self.ext_tx_zmq_pub.send(data, copy=False)
+                self.metrics.frames_out += 1
+                self.metrics.bytes_out += len(data)
+
+    async def run(self):
+        await self.__zconf_publish_zmq(self.sub_port, self.pub_port)
+        receivers = [asyncio.ensure_future(self.__ext_rx()), asyncio.ensure_future(self.__device_rx())]
+        try:
+            await asyncio.gather(*receivers)
+        except asyncio.CancelledError:
+            pass
+        except zmq.error.ContextTerminated:
+            logging.debug("ZMQ connection %s context terminated", self.connection_id)
+        finally:
+            for receiver in receivers:
+                receiver.cancel()
+            await self.zeroconf.async_unregister_all_services()
+            await self.zeroconf.async_close()
+            self.ext_tx_zmq_pub.close()
+            self.ext_rx_zmq_sub.close()
+            self.tx_zmq_pub.close()
+            self.rx_zmq_sub.close()
@@ -0,0 +1,154 @@
+import struct
+import zlib
+
+# A compressed frame is MAGIC, the length of the compressed data and a zlib stream. Plain frames are protocol
+# text, which starts with a tab and never holds a NUL, so a reader can tell them apart in a stream.
+MAGIC = b"\x00Z"
+HEADER = struct.Struct(">2sI")
+
+DEFLATE = "DEFLATE"
+# Deflate with PRESET_DICTIONARY, a peer must have the same dictionary. Changing it needs a new mode name.
+DEFLATE_CFG1 = "DEFLATE-CFG1"
+# The modes a connection accepts, most preferred first.
+MODES = (DEFLATE_CFG1, DEFLATE)
+
+# Sent by a peer to ask for compression, without a device ID, followed by the modes it supports.
+COMPRESS_COMMAND = b"\tCOMPRESS\t"
+
+# Strings common in CFG JSON and in status and history replies. zlib finds the end of a dictionary cheapest
+# to refer to, so the most common strings come last.
+PRESET_DICTIONARY = "".join(
+    (
+        '"ctrlBkgndColor": "0", "ctrlBkgndTransparency": 0, "ctrlBorderColor": "0", "ctrlBorderOn": false, ',
+        '"ctrlColor": "4", "ctrlMaxFontSize": 20, "ctrlTitleBoxColor": "0", "ctrlTitleBoxTransparency": 0, ',
+        '"ctrlTitleFontSize": 16, "pageColor": "0", "numPages": 1, "parentID": "", "hostURL": "", ',
+        '"userName": "", "ipAddress": "", "port": 5000, "header": "", "body": "", "selection": [], ',
+        '"kbdType": "ALL", "closeKbdOnSend": true, "textAlign": "left", "numberPosition": "None", ',
+        '"gridView": true, "calAngle": 0, "style": "BASIC", "Color": "1", "buttonEnabled": true, ',
+        '"onColor": "18", "offColor": "4", "iconName": "None", "text": "", ',
+        '"xAxisLabel": "", "xAxisMin": 0.0, "xAxisMax": 100.0, "xAxisNumBars": 5, "xAxisLabelsStyle": "on", ',
+        '"yAxisLabel": "", "yAxisMin": 0.0, "yAxisMax": 100.0, "yAxisNumBars": 5}\n',
+        '"sliderEnabled": true, "barFollowsSlider": false, "barColor": "18", "barStyle": "seg", ',
+        '"dialFollowsKnob": false, "dialColor": "18", "knobColor": "4", "dialFillColor": "4", ',
+        '"pointerColor": "18", "showMinMax": false, "sendOnlyOnRelease": true, "style": "upright", ',
+        '"min": 0.0, "max": 100.0, "redValue": 75.0, "precision": 0, "units": ""}\n',
+        '"xPositionRatio": 0.0, "yPositionRatio": 0.0, "widthRatio": 1.0, "heightRatio": 0.2}\n',
+        '\tCFG\tDVCE\t\tCFG\tDVVW\t\tCFG\tNAME\t\tCFG\tDIAL\t\tCFG\tKNOB\t\tCFG\tTEXT\t\tCFG\tSLDR\t',
+        '\tCFG\tBTTN\t\tCFG\tTGRPH\t\tCFG\tGRPH\t\tCFG\tDIR\t\tCFG\tMAP\t\tCFG\tMENU\t\tCFG\tSLCTR\t',
+        '\tCFG\tLBL\t\tCFG\tBTGP\t\tCFG\tLOG\t\tCFG\tALM\t',
+        '\tTGRPH\t\tLOG\t\tMAP\t\tDIAL\t\tKNOB\t\tSLDR\t\tTEXT\t\tBTTN\t',
+        '\t2000-01-01T00:00:00+00:00,0.0\t2000-01-01T00:00:00+00:00,0.0\t2000-01-01T00:00:00+00:00,0.0\n',
+        '{"title": "", "titlePosition": "Bottom", "controlID": "',
+    )
+).encode("utf-8")
+
+
+def compress(data, mode, level=6):
+    """Returns data as a compressed frame in mode."""
+    if mode == DEFLATE_CFG1:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zdict=PRESET_DICTIONARY)
+    else:
+        compressor = zlib.compressobj(level)
+    body = compressor.compress(data) + compressor.flush()
+    return HEADER.pack(MAGIC, len(body)) + body
+
+
+def decompress(body):
+    """Returns the data of a compressed frame's zlib stream, which says whether it used the dictionary."""
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS, zdict=PRESET_DICTIONARY)
+    return decompressor.decompress(body) + decompressor.flush()
+
+
+class FrameCompressor:
+    """Compresses frames for a peer that negotiated mode, those below threshold bytes are left as they are.
+
+    Each frame is compressed alone, so a frame dropped on the way leaves those after it readable.
+    """
+
+    def __init__(self, mode, threshold=1024, level=6):
+        """
+        Arguments:
+            mode {str} -- One of MODES.
+
+        Keyword Arguments:
+            threshold {int} -- The smallest frame compressed. (default: {1024})
+            level {int} -- The zlib compression level. (default: {6})
+        """
+        self.mode = mode
+        self.threshold = threshold
+        self.level = level
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def compress(self, data):
+        """Returns data compressed when it is large enough and compression makes it smaller."""
+        if len(data) < self.threshold:
+            return data
+        compressed = compress(data, self.mode, self.level)
+        if len(compressed) >= len(data):
+            return data
+        self.bytes_in += len(data)
+        self.bytes_out += len(compressed)
+        return compressed
+
+
+def take_compress_request(commands):
+    """Returns commands without any COMPRESS requests, and the modes the last asked for or None."""
+    if COMPRESS_COMMAND not in commands:
+        return commands, None
+    kept = []
+    modes = None
+    for line in commands.split(b"\n"):
+        if line.startswith(COMPRESS_COMMAND):
+            modes = [mode.decode("utf-8", "replace") for mode in line[len(COMPRESS_COMMAND):].strip().split(b"\t")]
+        elif line:
+            kept.append(line + b"\n")
+    return b"".join(kept), modes
+
+
+def choose_mode(modes, accepted=MODES):
+    """Returns the first of the peer's modes accepted, or None to stay uncompressed."""
+    for mode in modes:
+        if mode in accepted:
+            return mode
+    return None
+
+
+def compress_reply(mode):
+    """The reply to a COMPRESS request, the mode chosen or NONE."""
+    return COMPRESS_COMMAND + (mode or "NONE").encode("utf-8") + b"\n"
+
+
+class FrameReader:
+    """Splits bytes received from a connection into protocol text, inflating the compressed frames.
+
+    Compressed frames may arrive split across receives, what is incomplete is kept for the next.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        """Returns the protocol text in data and what was kept from earlier receives."""
+        buffer = self.buffer
+        buffer += data
+        text = []
+        while buffer:
+            if buffer[0] == 0:
+                if len(buffer) < HEADER.size:
+                    break
+                magic, length = HEADER.unpack_from(buffer)
+                if magic != MAGIC:
+                    raise ValueError("Not a compressed frame")
+                end = HEADER.size + length
+                if len(buffer) < end:
+                    break
+                text.append(decompress(bytes(buffer[HEADER.size:end])))
+                del buffer[:end]
+            else:
+                end = buffer.find(b"\x00")
+                if end < 0:
+                    end = len(buffer)
+                text.append(bytes(buffer[:end]))
+                del buffer[:end]
+        return b"".join(text)
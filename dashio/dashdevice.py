@@ -1,75 +1,152 @@
 import logging
 import zmq
 import threading
+import time
+from itertools import count
 
 from .iotcontrol.name import Name
 from .iotcontrol.alarm import Alarm
 from .iotcontrol.page import Page
+from .loopsignal import LoopSignal
+from .metrics import DeviceMetrics, SAMPLE_MASK
 
 
-class dashDevice(threading.Thread):
+class dashDeviceCore:
+    """The device protocol shared by dashDevice and asyncDashDevice, without the thread or event loop running it.
 
-    """Setups and manages a connection thread to iotdashboard via TCP."""
+    Subclasses create tx_zmq_pub and rx_zmq_sub and pass the commands received to _on_message.
+    """
 
-    def __on_message(self, payload):
-        data = str(payload, "utf-8").strip()
-        command_array = data.split("\n")
-        reply = ""
-        for ca in command_array:
-            try:
-                reply += self.__on_command(ca.strip())
-            except TypeError:
-                pass
+    def _on_message(self, payload):
+        # Commands are tokenized as bytes and dispatched through tables built by add_control, only the arguments
+        # passed to a control are decoded. bytes.split runs in C and gives the hashable keys the tables need, a
+        # walk over memoryview slices would copy each field out again. The tables and device ID are bound to
+        # locals for the loop. Commands are counted by type, only one frame in SAMPLE_EVERY is timed.
+        metrics = self.metrics
+        metrics.frames_in += 1
+        sampled = not metrics.frames_in & SAMPLE_MASK
+        if sampled:
+            start = time.perf_counter()
+        reply = []
+        b_device_id = self.b_device_id
+        device_command = self._device_commands.get
+        control_event = self._dispatch.get
+        commands = metrics.commands
+        for command in payload.strip().split(b"\n"):
+            fields = command.strip().split(b"\t", 3)
+            if fields[0] != b_device_id:
+                if fields[0] == b"WHO":
+                    commands[b"WHO"] += 1
+                    reply.append(self.__on_who())
+                continue
+            n_fields = len(fields)
+            if n_fields < 2:
+                continue
+            handler = device_command(fields[1])
+            if handler is not None:
+                commands[fields[1]] += 1
+                reply.append(handler(fields))
+            elif n_fields > 2:
+                event = control_event((fields[1], fields[2]))
+                if event is not None:
+                    # Only types a handler exists for are counted, a client can't grow the counts without bound.
+                    commands[fields[1]] += 1
+                    try:
+                        args = fields[3].decode("utf-8").split("\t") if n_fields > 3 else []
+                    except UnicodeDecodeError:
+                        logging.debug("Dropped command that isn't UTF-8: %s", command)
+                        continue
+                    if sampled:
+                        handler_start = time.perf_counter()
+                        event(args)
+                        metrics.handler_seconds.observe(time.perf_counter() - handler_start)
+                    else:
+                        event(args)
+        reply = b"".join(reply)
+        if sampled:
+            metrics.reply_seconds.observe(time.perf_counter() - start)
         return reply
 
-    def __on_command(self, data):
-        data_array = data.split("\t")
-        rx_device_id = data_array[0]
-        reply = ""
-        if rx_device_id == "WHO":
-            reply = self.device_id_str + "\tWHO\t{}\t{}\n".format(self.device_type, self.device_name_cntrl.control_id)
-            return reply
-        elif rx_device_id != self.device_id:
-            return reply
-        cntrl_type = data_array[1]
-        if cntrl_type == "CONNECT":
-            reply = self.connect
-        elif cntrl_type == "STATUS":
-            reply = self.__make_status()
-        elif cntrl_type == "CFG":
-            reply = self.__make_cfg()
-        elif cntrl_type == "NAME":
-            self.device_name_cntrl.message_rx_event(data_array[2:])
-        else:
-            try:
-                key = cntrl_type + "_" + data_array[2]
-            except IndexError:
-                return
-            try:
-                self.control_dict[key].message_rx_event(data_array[3:])
-            except KeyError:
-                pass
-        return reply
+    def __on_who(self):
+        # The reply is rebuilt only after the device is renamed.
+        name = self.device_name_cntrl.control_id
+        if name != self._who_name:
+            self._who_name = name
+            reply = self.device_id_str + "\tWHO\t{}\t{}\n".format(self.device_type, name)
+            self._who_reply = reply.encode("utf-8")
+        return self._who_reply
+
+    def __on_connect(self, fields):
+        return self.b_connect
+
+    def __on_status(self, fields):
+        return self.__make_status()
+
+    def __on_cfg(self, fields):
+        return self.__make_cfg()
+
+    def __on_name(self, fields):
+        try:
+            args = b"\t".join(fields[2:]).decode("utf-8").split("\t") if len(fields) > 2 else []
+        except UnicodeDecodeError:
+            logging.debug("Dropped NAME that isn't UTF-8: %s", fields)
+            return b""
+        self.device_name_cntrl.message_rx_event(args)
+        return b""
+
+    def __on_state_change(self, control):
+        self._status_reply = None
 
     def __make_status(self):
-        reply = ""
-        for key in self.control_dict.keys():
-            try:
-                status = self.control_dict[key].get_state()
-                if status:
-                    reply += self.device_id_str + self.__insert_device_id(self.control_dict[key].get_state())
-            except TypeError:
-                pass
+        # Controls set state_dirty when their state changes, only those are rebuilt, and those not cached. A
+        # change during the rebuild resets _status_reply so the result isn't cached.
+        if self._status_reply is not None:
+            return self._status_reply
+        self._status_reply = b""
+        reply = []
+        cached = True
+        for control in self.control_dict.values():
+            if not control.state_cached:
+                cached = False
+                control.state_dirty = True
+            if control.state_dirty:
+                control.state_dirty = False
+                segment = b""
+                try:
+                    status = control.get_state()
+                    if status:
+                        segment = self.__insert_device_id(status)
+                except TypeError:
+                    pass
+                self._status_segments[control] = segment
+            reply.append(self._status_segments[control])
+        reply = b"".join(reply)
+        if self._status_reply == b"" and cached:
+            self._status_reply = reply
+        else:
+            self._status_reply = None
         return reply
 
+    def __on_cfg_change(self, control):
+        self._cfg_reply = None
+
     def __make_cfg(self):
-        reply = ""
+        # The reply is kept until a control's CFG message changes or a control is added, each control caches
+        # its message until one of its settings changes. As for STATUS a change during the rebuild isn't cached.
+        if self._cfg_reply is not None:
+            return self._cfg_reply
+        self._cfg_reply = b""
+        reply = []
         if self.number_of_pages:
-            reply = self.device_id_str + '\tCFG\tDVCE\t{{"numPages": {}}}\n'.format(self.number_of_pages)
-        for key in self.control_dict.keys():
-            reply += self.device_id_str + self.control_dict[key].get_cfg()
-        for key in self.alarm_dict.keys():
-            reply += self.alarm_dict[key].get_cfg()
+            reply.append(self.device_id_str + '\tCFG\tDVCE\t{{"numPages": {}}}\n'.format(self.number_of_pages))
+        for control in self.control_dict.values():
+            reply.append(self.device_id_str)
+            reply.append(control.get_cfg())
+        for alarm in self.alarm_dict.values():
+            reply.append(alarm.get_cfg())
+        reply = "".join(reply).encode("utf-8")
+        if self._cfg_reply == b"":
+            self._cfg_reply = reply
         return reply
 
     def send_popup_message(self, title, header, message):
@@ -85,7 +162,7 @@ class dashDevice(threading.Thread):
             Message body.
         """
         data = self.device_id_str + "\tMSSG\t{}\t{}\t{}\n".format(title, header, message)
-        self.tx_zmq_pub.send_multipart([b"ALL", b'0', data.encode('utf-8')])
+        self._call_soon(self._publish, [b"ALL", b'0', data.encode('utf-8')])
 
     def send_alarm(self, alarm_id, message_header, message_body):
         """Send an Alarm to the Dash server.
@@ -102,31 +179,83 @@ class dashDevice(threading.Thread):
 
         payload = self.device_id_str + "\t{}\t{}\t{}\n".format(alarm_id, message_header, message_body)
         logging.debug("ALARM: %s", payload)
-        self.tx_zmq_pub.send_multipart([b"ALARM", b'0', payload.encode('utf-8')])
+        self._call_soon(self._publish, [b"ALARM", b'0', payload.encode('utf-8')])
 
     def send_dash_connect(self):
         data = self.device_id_str + "\tWHO\t{}\t{}\n".format(self.device_type, self.device_name_cntrl.control_id)
-        self.tx_zmq_pub.send_multipart([b'ANNOUNCE', b'0', data.encode('utf-8')])
+        self._call_soon(self._publish, [b'ANNOUNCE', b'0', data.encode('utf-8')])
 
     def __insert_device_id(self, data):
+        # Encode once and splice the device ID in front of every line, single line messages skip the replace.
+        if isinstance(data, str):
+            data = data.encode("utf-8")
         msg = data.rstrip()
-        reply = msg.replace("\n", "\n\t{}".format(self.device_id))
-        return reply + "\n"
+        if b"\n" in msg:
+            msg = msg.replace(b"\n", self._b_line_device_id)
+        return b"".join((self.b_device_id_str, msg, b"\n"))
 
     def send_data(self, data):
         """Send data.
 
         Parameters
         ----------
-        data : str
-            Data to be sent
+        data : str or bytes
+            Data to be sent, one or more lines of control messages without the device ID.
         """
-        msg = self.device_id_str + self.__insert_device_id(data)
+        metrics = self.metrics
+        metrics.updates += 1
+        if self.coalesce_window:
+            self._queue_data(self.__insert_device_id(data))
+            return
+        if metrics.updates & SAMPLE_MASK:
+            start = None
+        else:
+            start = time.perf_counter()
+        self._call_soon(self._publish, [b"ALL", b'0', self.__insert_device_id(data)])
+        if start is not None:
+            metrics.update_seconds.observe(time.perf_counter() - start)
+
+    def _call_soon(self, func, *args):
+        # Runs func on the thread the sockets belong to. Controls are set from any thread, and send from timer
+        # threads, subclasses hand those calls to their loop.
+        func(*args)
+
+    def _publish(self, frames):
         try:
-            self.tx_zmq_pub.send_multipart([b"ALL", b'0', msg.encode('utf-8')])
+            self.tx_zmq_pub.send_multipart(frames)
         except zmq.error.ZMQError:
             pass
 
+    def _queue_data(self, msg):
+        # Messages are keyed by device ID, type and control ID so a newer state replaces a pending one. Controls
+        # whose messages each carry new data get a unique key and are sent in order. Returns True when msg opens
+        # a new coalesce window.
+        t1 = msg.find(b"\t", 1)
+        t2 = msg.find(b"\t", t1 + 1)
+        t3 = msg.find(b"\t", t2 + 1)
+        if msg[t1 + 1:t2] in self._tx_passthrough_types:
+            key = next(self._tx_sequence)
+        else:
+            key = msg[:t3] if t3 > 0 else msg
+        with self._tx_lock:
+            opened = not self._tx_pending
+            if opened:
+                self._tx_deadline = time.monotonic() + self.coalesce_window
+            self._tx_pending[key] = msg
+        return opened
+
+    def _flush_data(self):
+        with self._tx_lock:
+            pending = self._tx_pending
+            self._tx_pending = {}
+        if pending:
+            # Timed from the update that opened the window.
+            self.metrics.update_seconds.observe(time.monotonic() - self._tx_deadline + self.coalesce_window)
+            try:
+                self.tx_zmq_pub.send_multipart([b"ALL", b'0', b"".join(pending.values())])
+            except zmq.error.ZMQError:
+                pass
+
     def add_control(self, iot_control):
         """Add a control to the connection.
 
@@ -142,8 +271,17 @@ class dashDevice(threading.Thread):
             if isinstance(iot_control, Page):
                 self.number_of_pages += 1
             iot_control.message_tx_event += self.send_data
+            iot_control.state_change_event += self.__on_state_change
+            iot_control.cfg_change_event += self.__on_cfg_change
+            if not iot_control.tx_coalesce:
+                self._tx_passthrough_types.add(iot_control.msg_type.encode("utf-8"))
+            iot_control.state_dirty = True
             key = iot_control.msg_type + "_" + iot_control.control_id
             self.control_dict[key] = iot_control
+            dispatch_key = (iot_control.msg_type.encode("utf-8"), iot_control.control_id.encode("utf-8"))
+            self._dispatch[dispatch_key] = iot_control.message_rx_event
+            self._status_reply = None
+        self._cfg_reply = None
 
     def add_connection(self, connection_id):
         tx_url_internal = "inproc://RX_{}".format(connection_id)
@@ -152,25 +290,93 @@ class dashDevice(threading.Thread):
         self.rx_zmq_sub.connect(rx_url_internal)
         self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, connection_id.encode('utf-8'))
 
-    def __init__(self, device_type, device_id, device_name, context=None) -> None:
-        threading.Thread.__init__(self, daemon=True)
-
-        self.context = context or zmq.Context.instance()
+    def __init__(self, device_type, device_id, device_name, coalesce_window=0.0) -> None:
         self.device_type = device_type
         self.device_id = device_id
         self.device_name_cntrl = Name(device_name)
         self.control_dict = {}
         self.alarm_dict = {}
+        # Cached STATUS reply and per-control segments of it.
+        self._status_reply = None
+        self._status_segments = {}
+        # Cached CFG reply, encoded with the device ID.
+        self._cfg_reply = None
+        # Control updates waiting for the coalesce window to close.
+        self.coalesce_window = coalesce_window
+        self._tx_lock = threading.Lock()
+        self._tx_pending = {}
+        self._tx_deadline = 0.0
+        self._tx_sequence = count()
+        self._tx_passthrough_types = set()
+        # Inbound commands are looked up by their type, then by (type, control ID) as bytes.
+        self._device_commands = {
+            b"CONNECT": self.__on_connect,
+            b"STATUS": self.__on_status,
+            b"CFG": self.__on_cfg,
+            b"NAME": self.__on_name,
+        }
+        self._dispatch = {}
+        self._who_name = None
+        self._who_reply = b""
+        self.metrics = DeviceMetrics(device_id)
 
         self.add_control(self.device_name_cntrl)
+        self.b_device_id = device_id.encode("utf-8")
         self.device_id_str = "\t{}".format(device_id)
+        self.b_device_id_str = self.device_id_str.encode("utf-8")
+        self._b_line_device_id = b"\n" + self.b_device_id_str
         self.connect = self.device_id_str + "\tCONNECT\n"
+        self.b_connect = self.connect.encode("utf-8")
         self.number_of_pages = 0
+
+
+class dashDevice(dashDeviceCore, threading.Thread):
+
+    """Setups and manages a connection thread to iotdashboard via TCP."""
+
+    def __init__(self, device_type, device_id, device_name, context=None, coalesce_window=0.0) -> None:
+        """
+        Parameters
+        ----------
+        device_type : str
+            The type of device, shown by the dashboard.
+        device_id : str
+            A unique identifier for the device.
+        device_name : str
+            The name of the device, shown by the dashboard.
+        context : zmq.Context, optional
+            The zmq context to use.
+        coalesce_window : float, optional
+            Seconds to hold control updates before sending them as one frame. Within the window only the
+            latest state of each control is sent. 0 sends every update immediately.
+        """
+        threading.Thread.__init__(self, daemon=True)
+        dashDeviceCore.__init__(self, device_type, device_id, device_name, coalesce_window)
+        self.context = context or zmq.Context.instance()
+        self.loop_signal = LoopSignal(self.context)
         self.running = True
         self.start()
 
     def close(self):
         self.running = False
+        self.loop_signal.stop()
+
+    def _call_soon(self, func, *args):
+        # The sockets belong to the device's thread, calls from others are made when it next wakes.
+        if threading.current_thread() is self:
+            func(*args)
+        else:
+            self.loop_signal.call(func, *args)
+
+    def add_connection(self, connection_id):
+        self._call_soon(super().add_connection, connection_id)
+
+    def _queue_data(self, msg):
+        opened = super()._queue_data(msg)
+        if opened and threading.current_thread() is not self:
+            # The loop is waiting without a timeout, wake it to time the new window.
+            self.loop_signal.signal()
+        return opened
 
     def run(self):
         # Continue the network loop, exit when an error occurs
@@ -181,19 +387,32 @@ class dashDevice(threading.Thread):
 
         poller = zmq.Poller()
         poller.register(self.rx_zmq_sub, zmq.POLLIN)
+        poller.register(self.loop_signal.socket, zmq.POLLIN)
+        # Connections added before the sockets were made.
+        self.loop_signal.run_calls()
 
         while self.running:
+            # Idle, the loop only wakes for a command or a signal. A coalesce window sets the timeout.
+            timeout = None
+            if self._tx_pending:
+                timeout = max(0, int((self._tx_deadline - time.monotonic()) * 1000) + 1)
             try:
-                socks = dict(poller.poll(50))
+                socks = dict(poller.poll(timeout))
             except zmq.error.ContextTerminated:
                 break
+            if self.loop_signal.socket in socks and self.loop_signal.receive():
+                break
             if self.rx_zmq_sub in socks:
                 msg = self.rx_zmq_sub.recv_multipart()
                 if len(msg) == 3:
-                    reply = self.__on_message(msg[2])
+                    reply = self._on_message(msg[2])
                     if reply:
-                        self.tx_zmq_pub.send_multipart([msg[0], msg[1], reply.encode('utf-8')])
+                        self.tx_zmq_pub.send_multipart([msg[0], msg[1], reply])
+            if self._tx_pending and time.monotonic() >= self._tx_deadline:
+                self._flush_data()
 
+        self._flush_data()
         self.tx_zmq_pub.close()
         self.rx_zmq_sub.close()
+        self.loop_signal.close()
         self.context.term()
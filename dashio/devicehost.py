@@ -0,0 +1,188 @@
+import heapq
+import logging
+import threading
+import time
+import zmq
+from itertools import count
+
+from .dashdevice import dashDeviceCore
+from .loopsignal import LoopSignal
+
+
+class hostedDevice(dashDeviceCore):
+
+    """A device serviced by a DeviceHost, sharing the host's thread and sockets instead of owning its own.
+
+    Create them with DeviceHost.add_device. They are added to connections and given controls like a dashDevice.
+    """
+
+    def __init__(self, host, device_type, device_id, device_name, coalesce_window=0.0) -> None:
+        self.host = host
+        # Only sent on from the host's thread, see _call_soon.
+        self.tx_zmq_pub = host.tx_zmq_pub
+        dashDeviceCore.__init__(self, device_type, device_id, device_name, coalesce_window)
+
+    def _call_soon(self, func, *args):
+        # The host's sockets belong to its thread, calls from others are made when it next wakes.
+        if threading.current_thread() is self.host:
+            func(*args)
+        else:
+            self.host.loop_signal.call(func, *args)
+
+    def add_connection(self, connection_id):
+        self.host.add_connection(connection_id)
+
+    def _queue_data(self, msg):
+        opened = super()._queue_data(msg)
+        if opened:
+            self.host.schedule_flush(self)
+        return opened
+
+    def close(self):
+        self.host.remove_device(self)
+
+
+class DeviceHost(threading.Thread):
+
+    """Services any number of devices from one thread, one PUB and one SUB socket.
+
+    Commands from the connections are routed to their device by a dict keyed by device ID, and WHO is answered
+    by every device. The host connects to each connection once however many of its devices use it.
+    """
+
+    def __init__(self, context=None) -> None:
+        """
+        Parameters
+        ----------
+        context : zmq.Context, optional
+            The zmq context to use.
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.context = context or zmq.Context.instance()
+        self.tx_zmq_pub = self.context.socket(zmq.PUB)
+        self.rx_zmq_sub = self.context.socket(zmq.SUB)
+        self.rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, b"")
+        self.loop_signal = LoopSignal(self.context)
+        # Devices keyed by their device ID as bytes, as it appears in commands.
+        self.devices = {}
+        self.connection_ids = set()
+        # Devices with an open coalesce window, as a heap of (deadline, sequence, device).
+        self._flush_lock = threading.Lock()
+        self._flush_heap = []
+        self._flush_sequence = count()
+        self.running = True
+        self.start()
+
+    def add_device(self, device_type, device_id, device_name, coalesce_window=0.0):
+        """Create a device serviced by the host.
+
+        Parameters
+        ----------
+        device_type : str
+            The type of device, shown by the dashboard.
+        device_id : str
+            A unique identifier for the device.
+        device_name : str
+            The name of the device, shown by the dashboard.
+        coalesce_window : float, optional
+            Seconds to hold control updates before sending them as one frame. 0 sends every update immediately.
+
+        Returns
+        -------
+        hostedDevice
+        """
+        device = hostedDevice(self, device_type, device_id, device_name, coalesce_window)
+        self.devices[device_id.encode("utf-8")] = device
+        return device
+
+    def remove_device(self, device):
+        self.devices.pop(device.device_id.encode("utf-8"), None)
+
+    def add_connection(self, connection_id):
+        if connection_id in self.connection_ids:
+            return
+        self.connection_ids.add(connection_id)
+        # The sockets are the host thread's to use once it has started, it connects them when it next wakes.
+        self.loop_signal.call(self.__connect, connection_id)
+
+    def __connect(self, connection_id):
+        self.tx_zmq_pub.connect("inproc://RX_{}".format(connection_id))
+        self.rx_zmq_sub.connect("inproc://TX_{}".format(connection_id))
+
+    def schedule_flush(self, device):
+        """Flush device's pending updates when its coalesce window closes."""
+        with self._flush_lock:
+            heapq.heappush(self._flush_heap, (device._tx_deadline, next(self._flush_sequence), device))
+            earliest = self._flush_heap[0][2] is device
+        if earliest and threading.current_thread() is not self:
+            # The loop may be waiting on a later deadline, or none, wake it to time this one.
+            self.loop_signal.signal()
+
+    def __flush_due(self, now):
+        due = []
+        with self._flush_lock:
+            while self._flush_heap and self._flush_heap[0][0] <= now:
+                due.append(heapq.heappop(self._flush_heap)[2])
+        for device in due:
+            device._flush_data()
+
+    def __poll_timeout(self):
+        with self._flush_lock:
+            if not self._flush_heap:
+                return None
+            wait = self._flush_heap[0][0] - time.monotonic()
+        return max(0, int(wait * 1000) + 1)
+
+    def __on_message(self, payload):
+        # Each line goes to the device named by its first field, WHO goes to them all.
+        reply = []
+        start = 0
+        end = len(payload)
+        while start < end:
+            stop = payload.find(b"\n", start)
+            if stop < 0:
+                stop = end
+            line = payload[start:stop + 1]
+            start = stop + 1
+            device_id = line.strip().split(b"\t", 1)[0]
+            if device_id == b"WHO":
+                for device in list(self.devices.values()):
+                    reply.append(device._on_message(line))
+                continue
+            device = self.devices.get(device_id)
+            if device is not None:
+                reply.append(device._on_message(line))
+            elif device_id and logging.root.isEnabledFor(logging.DEBUG):
+                logging.debug("No hosted device for: %s", line)
+        return b"".join(reply)
+
+    def close(self):
+        self.running = False
+        self.loop_signal.stop()
+
+    def run(self):
+        poller = zmq.Poller()
+        poller.register(self.rx_zmq_sub, zmq.POLLIN)
+        poller.register(self.loop_signal.socket, zmq.POLLIN)
+
+        while self.running:
+            try:
+                socks = dict(poller.poll(self.__poll_timeout()))
+            except zmq.error.ContextTerminated:
+                break
+            if self.loop_signal.socket in socks and self.loop_signal.receive():
+                break
+            if self.rx_zmq_sub in socks:
+                msg = self.rx_zmq_sub.recv_multipart()
+                if len(msg) == 3:
+                    reply = self.__on_message(msg[2])
+                    if reply:
+                        self.tx_zmq_pub.send_multipart([msg[0], msg[1], reply])
+            if self._flush_heap:
+                self.__flush_due(time.monotonic())
+
+        for device in list(self.devices.values()):
+            device._flush_data()
+        self.tx_zmq_pub.close()
+        self.rx_zmq_sub.close()
+        self.loop_signal.close()
@@ -1,5 +1,6 @@
 from .enums import Color, Icon, Precision, Keyboard, TextAlignment, SliderBarType, DialPosition, DialStyle, \
-    GraphLineType, TimeGraphLineType, TimeGraphTimeScale, TimeGraphPositionOfKey, ButtonState, LabelStyle, KnobStyle, GraphXAxisLabelsStyle
+    GraphLineType, TimeGraphLineType, TimeGraphTimeScale, TimeGraphPositionOfKey, ButtonState, LabelStyle, KnobStyle, GraphXAxisLabelsStyle, \
+    DownsampleMethod, HandlerPolicy, OverflowPolicy
 from .graph import Graph, GraphLine
 from .slider_single_bar import SliderSingleBar
 from .slider_double_bar import SliderDoubleBar
@@ -18,3 +19,4 @@ from .page import Page
 from .control import ControlPosition
 from .button_group import ButtonGroup
 from .event_log import EventLog, EventData
+from .send_policy import SendPolicy
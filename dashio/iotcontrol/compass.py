@@ -26,7 +26,8 @@ class Compass(Control):
     @direction_value.setter
     def direction_value(self, val):
         self._direction_value = val
-        self.state_str = "\t{}\t{}\t{}\n".format(self.msg_type, self.control_id, val)
+        self._state_str = "\t{}\t{}\t{}\n".format(self.msg_type, self.control_id, val)
+        self._send_value("direction", val, self._state_str)
 
     @property
     def pointer_color(self) -> Color:
@@ -1,5 +1,6 @@
 from .event import Event
 from .enums import TitlePosition
+from .send_policy import ValueThrottle
 import json
 import copy
 
@@ -12,17 +13,49 @@ class ControlPosition:
         self.height_ratio = height_ratio
 
 
+class ConfigDict(dict):
+    """A control's CFG settings, caching their CFG message until a value actually changes.
+
+    on_change is called when a cached message is dropped, so those built from it can be dropped too.
+    """
+
+    def __init__(self, on_change=None):
+        super().__init__()
+        self.encoded = None
+        self.on_change = on_change
+
+    def __setitem__(self, key, value):
+        if key in self and type(self[key]) is type(value) and self[key] == value:
+            return
+        super().__setitem__(key, value)
+        self.changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.changed()
+
+    def changed(self):
+        """Drop the cached CFG message after a mutable value was changed in place."""
+        if self.encoded is not None:
+            self.encoded = None
+            if self.on_change is not None:
+                self.on_change()
+
+
 class Control:
     def get_state(self):
         return self.state_str
 
     def get_cfg(self):
-        cfg_str = "\tCFG\t" + self.msg_type + "\t" + json.dumps(self._cfg) + "\n"
-        return cfg_str
+        if self._cfg.encoded is None:
+            self._cfg.encoded = "\tCFG\t" + self.msg_type + "\t" + json.dumps(self._cfg) + "\n"
+        return self._cfg.encoded
 
     def __init__(self, msg_type, control_id, control_position=None, title_position=None):
+        # Fired with the control when its CFG message changes.
+        self.cfg_change_event = Event()
         # Dictionary to store CFG json
-        self._cfg = {}
+        self._cfg = ConfigDict(self.__cfg_changed)
         self.title = ""
         self._title_position = None
         if title_position is not None:
@@ -31,13 +64,41 @@ class Control:
         self.control_id = control_id
         self.message_rx_event = Event()
         self.message_tx_event = Event()
+        # Fired with the control whenever its state changes, state_dirty stays set until a device clears it.
+        self.state_change_event = Event()
+        self.state_dirty = True
+        # Whether a device holding updates for a coalesce window may replace this control's pending update with
+        # a newer one. Controls whose every message carries new data turn this off.
+        self.tx_coalesce = True
+        # Whether a device may keep the control's state between STATUS requests until state_dirty is set.
+        # Controls whose state can change without them knowing turn this off.
+        self.state_cached = True
+        self._send_policy = None
+        self._throttles = {}
         self._state_str = "\t{}\t{}\n".format(self.msg_type, self.control_id)
         self._control_position = None
         if control_position is not None:
             self.control_position = control_position
 
+    def __cfg_changed(self):
+        self.cfg_change_event(self)
+
+    def _state_changed(self):
+        self.state_dirty = True
+        self.state_change_event(self)
+
+    @property
+    def _state_str(self):
+        return self.__state_str
+
+    @_state_str.setter
+    def _state_str(self, val):
+        self.__state_str = val
+        self._state_changed()
+
     @property
     def state_str(self):
+        """The control's state messages without the device ID, as str or UTF-8 bytes."""
         return self._state_str
 
     @state_str.setter
@@ -45,6 +106,28 @@ class Control:
         self._state_str = val
         self.message_tx_event(val)
 
+    @property
+    def send_policy(self):
+        """The SendPolicy limiting how often the control's values are sent, None to send every change."""
+        return self._send_policy
+
+    @send_policy.setter
+    def send_policy(self, val):
+        for throttle in self._throttles.values():
+            throttle.cancel()
+        self._throttles = {}
+        self._send_policy = val
+
+    def _send_value(self, key, value, msg):
+        # Send the update msg for the value named key, held back as the send policy requires.
+        if self._send_policy is None:
+            self.message_tx_event(msg)
+            return
+        throttle = self._throttles.get(key)
+        if throttle is None:
+            throttle = self._throttles[key] = ValueThrottle(self._send_policy, self.message_tx_event)
+        throttle.update(value, msg)
+
     # Use getter, setter properties to store the settings in the config dictionary
     @property
     def parent_id(self) -> str:
@@ -42,7 +42,8 @@ class Dial(Control):
     @dial_value.setter
     def dial_value(self, val):
         self._dial_value = val
-        self.state_str = "\t{}\t{}\t{}\n".format(self.msg_type, self.control_id, self._dial_value)
+        self._state_str = "\t{}\t{}\t{}\n".format(self.msg_type, self.control_id, val)
+        self._send_value("dial", val, self._state_str)
 
     @property
     def min(self):
@@ -0,0 +1,207 @@
+import math
+
+from .enums import DownsampleMethod
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# LTTB chooses each sample it keeps from the minimum and maximum of LTTB_PRESELECT // 2 buckets, MinMaxLTTB.
+LTTB_PRESELECT = 4
+
+
+class _Samples:
+    # The memoryviews a buffer returns for a range of samples, read by logical index without copying them whole.
+
+    def __init__(self, views):
+        self.views = views
+        self.offsets = []
+        n = 0
+        for view in views:
+            self.offsets.append(n)
+            n += len(view)
+        self.n = n
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        for view, offset in zip(self.views, self.offsets):
+            if i < offset + len(view):
+                return view[i - offset]
+        raise IndexError(i)
+
+    def slice(self, lo, hi):
+        """Return samples lo..hi as a list."""
+        items = []
+        for view, offset in zip(self.views, self.offsets):
+            if lo < offset + len(view) and hi > offset:
+                items += view[max(lo - offset, 0):hi - offset].tolist()
+        return items
+
+
+def _bucket_bounds(start, stop, buckets):
+    size = (stop - start) / buckets
+    return [(start + int(i * size), start + int((i + 1) * size)) for i in range(buckets)]
+
+
+def _join(views, dtype):
+    # The buffer's memoryviews as one array, copied only when the buffer has wrapped.
+    arrays = [numpy.frombuffer(view, dtype) for view in views if len(view)]
+    return arrays[0] if len(arrays) == 1 else numpy.concatenate(arrays)
+
+
+def _bucket_slots(start, stop, buckets):
+    # The indices of each bucket as a row, as _bucket_bounds, short rows repeating their last index.
+    edges = start + (numpy.arange(buckets + 1) * ((stop - start) / buckets)).astype(numpy.intp)
+    lo = edges[:-1]
+    hi = edges[1:]
+    width = int((hi - lo).max())
+    return lo, hi, numpy.minimum(lo[:, None] + numpy.arange(width), (hi - 1)[:, None])
+
+
+def _min_max_numpy(values, budget):
+    lo, hi, slots = _bucket_slots(0, len(values), budget // 2)
+    buckets = values[slots]
+    lows = lo + buckets.argmin(1)
+    highs = lo + buckets.argmax(1)
+    nan = numpy.isnan(buckets).any(1)
+    first = numpy.where(nan, lo, numpy.minimum(lows, highs))
+    last = numpy.where(nan, hi - 1, numpy.maximum(lows, highs))
+    indices = numpy.stack((first, last), 1).ravel()
+    return indices[numpy.append(True, indices[1:] != indices[:-1])]
+
+
+def _min_max_python(values, budget):
+    indices = []
+    for lo, hi in _bucket_bounds(0, len(values), budget // 2):
+        bucket = values.slice(lo, hi)
+        if math.isnan(sum(bucket)):
+            pair = (lo, hi - 1)
+        else:
+            pair = sorted((lo + bucket.index(min(bucket)), lo + bucket.index(max(bucket))))
+        indices.append(pair[0])
+        if pair[1] != pair[0]:
+            indices.append(pair[1])
+    return indices
+
+
+def min_max_indices(timestamps, values, budget):
+    """Keep the minimum and maximum of each of budget // 2 equal sized buckets, the newest sample for a budget of 1.
+
+    Buckets holding non-numeric samples keep their first and last samples instead.
+    """
+    n = sum(len(view) for view in values)
+    if n <= budget:
+        return list(range(n))
+    if budget < 2:
+        return [n - 1] if budget == 1 else []
+    if numpy is not None:
+        return _min_max_numpy(_join(values, numpy.float64), budget).tolist()
+    return _min_max_python(_Samples(values), budget)
+
+
+def _lttb_numpy(xs, ys, budget):
+    n = len(ys)
+    lo, hi, slots = _bucket_slots(1, n - 1, budget - 2)
+    # Buckets as columns, the sample within each as rows.
+    bucket_xs = xs[slots.T].astype(numpy.float64)
+    bucket_ys = ys[slots.T]
+    next_lo = numpy.append(lo[1:], n - 1)
+    count = numpy.append(hi[1:], n) - next_lo
+    avg_xs = numpy.add.reduceat(xs, next_lo) / count
+    avg_ys = numpy.add.reduceat(ys, next_lo) / count
+    # Each bucket's row i of ax and ay is the i'th sample of the bucket before, the first sample for the first
+    # bucket, and of kept the sample the bucket keeps after it. A non-numeric area is never the largest.
+    ax = numpy.concatenate((numpy.full((len(bucket_xs), 1), float(xs[0])), bucket_xs[:, :-1]), 1)
+    ay = numpy.concatenate((numpy.full((len(bucket_ys), 1), float(ys[0])), bucket_ys[:, :-1]), 1)
+    dx = ax - avg_xs
+    dy = avg_ys - ay
+    c = dx * ay + dy * ax
+    largest = numpy.full(dx.shape, -1.0)
+    kept = numpy.zeros(dx.shape, numpy.intp)
+    for i, (x, y) in enumerate(zip(bucket_xs, bucket_ys)):
+        areas = numpy.abs(dx * y + dy * x - c)
+        kept[areas > largest] = i
+        numpy.fmax(largest, areas, out=largest)
+    kept = kept.T.tolist()
+    best = kept[0][0]
+    chosen = [best]
+    for row in kept[1:]:
+        best = row[best]
+        chosen.append(best)
+    return numpy.concatenate(([0], lo + chosen, [n - 1]))
+
+
+def _lttb_python(xs, ys, budget):
+    n = len(ys)
+    indices = [0]
+    ax = xs[0]
+    ay = ys[0]
+    bounds = _bucket_bounds(1, n - 1, budget - 2) + [(n - 1, n)]
+    for (lo, hi), (next_lo, next_hi) in zip(bounds, bounds[1:]):
+        count = next_hi - next_lo
+        avg_x = sum(xs[next_lo:next_hi]) / count
+        avg_y = sum(ys[next_lo:next_hi]) / count
+        dx = ax - avg_x
+        dy = avg_y - ay
+        c = dx * ay + dy * ax
+        areas = [abs(dx * y + dy * x - c) for x, y in zip(xs[lo:hi], ys[lo:hi])]
+        if math.isnan(sum(areas)):
+            areas = [-1.0 if math.isnan(area) else area for area in areas]
+        best = lo + areas.index(max(areas))
+        indices.append(best)
+        ax = xs[best]
+        ay = ys[best]
+    indices.append(n - 1)
+    return indices
+
+
+def lttb_indices(timestamps, values, budget):
+    """Largest-Triangle-Three-Buckets over the minimum and maximum samples, keeping the first and last samples.
+
+    The minimum and maximum of LTTB_PRESELECT // 2 buckets for each sample kept are the candidates. Each
+    bucket of candidates keeps the one forming the largest triangle with the previously kept sample and the
+    average of the next bucket. Non-numeric samples are passed over, a bucket holding only non-numeric
+    samples, or followed by a bucket holding any, keeps its first candidate.
+    """
+    n = sum(len(view) for view in values)
+    if n <= budget:
+        return list(range(n))
+    if budget < 3:
+        return min_max_indices(timestamps, values, budget)
+    preselect = LTTB_PRESELECT * budget
+    if numpy is not None:
+        values = _join(values, numpy.float64)
+        candidates = _min_max_numpy(values, preselect) if n > preselect else numpy.arange(n)
+        if candidates[0] != 0:
+            candidates = numpy.append(0, candidates)
+        if candidates[-1] != n - 1:
+            candidates = numpy.append(candidates, n - 1)
+        xs = _join(timestamps, numpy.int64)[candidates]
+        return candidates[_lttb_numpy(xs, values[candidates], budget)].tolist()
+    values = _Samples(values)
+    timestamps = _Samples(timestamps)
+    candidates = _min_max_python(values, preselect) if n > preselect else range(n)
+    candidates = sorted({0, n - 1}.union(candidates))
+    xs = [timestamps[i] for i in candidates]
+    ys = [values[i] for i in candidates]
+    return [candidates[i] for i in _lttb_python(xs, ys, budget)]
+
+
+def downsample_indices(timestamps, values, budget, method=DownsampleMethod.MIN_MAX):
+    """Return the indices, in time order, of at most budget samples chosen with method.
+
+    Decimation is vectorized with numpy when it is installed.
+
+    Arguments:
+        timestamps {list} -- Memoryviews over the epoch seconds of the samples, oldest first, as a buffer's
+            timestamps_view returns them.
+        values {list} -- Memoryviews over the float value of the samples, NaN for non-numeric samples.
+        budget {int} -- The maximum number of samples to keep.
+        method {DownsampleMethod} -- The decimation to use.
+    """
+    if method == DownsampleMethod.LTTB:
+        return lttb_indices(timestamps, values, budget)
+    return min_max_indices(timestamps, values, budget)
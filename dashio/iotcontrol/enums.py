@@ -167,6 +167,23 @@ class TimeGraphPositionOfKey(Enum):
     TOPRIGHT = "Top Right"
 
 
+class DownsampleMethod(Enum):
+    MIN_MAX = "Min Max"
+    LTTB = "LTTB"
+
+
+class HandlerPolicy(Enum):
+    INLINE = "Inline"
+    POOL = "Pool"
+    TASK = "Task"
+
+
+class OverflowPolicy(Enum):
+    DROP_OLDEST = "Drop Oldest"
+    DROP_NEWEST = "Drop Newest"
+    COLLAPSE = "Collapse"
+
+
 class Color(Enum):
     BLACK = 0
     WHITE = 1
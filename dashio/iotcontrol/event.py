@@ -1,21 +1,184 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .enums import HandlerPolicy, OverflowPolicy
+
+
+class QueuedHandler:
+    """Runs a handler away from the thread firing the event, one call at a time and in the order fired.
+
+    Calls wait in a bounded queue. When it is full the overflow policy drops the oldest waiting call, the new
+    one, or with COLLAPSE all but the new one, and counts them in dropped.
+    """
+
+    def __init__(self, handler, policy, max_pending, overflow, loop=None):
+        self.handler = handler
+        self.policy = policy
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.loop = loop
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._running = False
+        self._task = None
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                if self.overflow == OverflowPolicy.DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                if self.overflow == OverflowPolicy.COLLAPSE:
+                    # Only the latest call matters, those waiting are stale.
+                    self.dropped += len(self._pending)
+                    self._pending.clear()
+                else:
+                    self.dropped += 1
+                    self._pending.popleft()
+            self._pending.append((args, kwargs))
+            if self._running:
+                return
+            self._running = True
+        self.__start()
+
+    def __start(self):
+        if self.policy == HandlerPolicy.TASK:
+            try:
+                self.loop.call_soon_threadsafe(self.__create_task)
+            except RuntimeError:
+                # The loop is closed, the calls waiting will never run.
+                with self._lock:
+                    self.dropped += len(self._pending)
+                    self._pending.clear()
+                    self._running = False
+                logging.warning("Event handler %s dropped calls, its loop is closed", self.handler)
+        else:
+            Event.get_executor().submit(self.__run_one)
+
+    def __create_task(self):
+        # Held on to so the task isn't collected while it drains.
+        self._task = self.loop.create_task(self.__drain_task())
+
+    def __next(self):
+        with self._lock:
+            if self._pending:
+                return self._pending.popleft()
+            self._running = False
+            return None
+
+    def __run_one(self):
+        # One call per pool submission so a busy handler doesn't hold a worker others are waiting on.
+        call = self.__next()
+        if call is None:
+            return
+        try:
+            result = self.handler(*call[0], **call[1])
+            if asyncio.iscoroutine(result):
+                result.close()
+                logging.error("Event handler %s returned a coroutine, which a POOL handler can't run", self.handler)
+        except Exception:
+            logging.exception("Event handler %s failed", self.handler)
+        with self._lock:
+            if not self._pending:
+                self._running = False
+                return
+        Event.get_executor().submit(self.__run_one)
+
+    async def __drain_task(self):
+        while True:
+            call = self.__next()
+            if call is None:
+                return
+            try:
+                result = self.handler(*call[0], **call[1])
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception:
+                logging.exception("Event handler %s failed", self.handler)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+
 class Event:
+    # Shared by every POOL handler, created on first use.
+    executor = None
+    max_workers = 4
+    _executor_lock = threading.Lock()
+
     def __init__(self):
         self.handlers = set()
+        self._tasks = set()
+        self._queued = {}
+
+    @classmethod
+    def get_executor(cls):
+        with cls._executor_lock:
+            if Event.executor is None:
+                Event.executor = ThreadPoolExecutor(max_workers=cls.max_workers, thread_name_prefix="dashio-event")
+            return Event.executor
 
-    def handle(self, handler):
-        self.handlers.add(handler)
+    def handle(self, handler, policy=HandlerPolicy.INLINE, max_pending=100, overflow=OverflowPolicy.DROP_OLDEST, loop=None):
+        """Add a handler to the event.
+
+        Arguments:
+            handler {callable} -- Called with the event's arguments. May be a coroutine function, when the
+                event is fired on a running loop or with the TASK policy.
+
+        Keyword Arguments:
+            policy {HandlerPolicy} -- INLINE runs the handler on the thread firing the event. POOL runs it on
+                the shared thread pool and TASK as a task on loop, leaving the firing thread free.
+                Either way calls to one handler run one at a time in the order fired. (default: {HandlerPolicy.INLINE})
+            max_pending {int} -- Calls a POOL or TASK handler may have waiting. (default: {100})
+            overflow {OverflowPolicy} -- Which call to drop when max_pending are waiting. (default: {OverflowPolicy.DROP_OLDEST})
+            loop {asyncio.AbstractEventLoop} -- The loop TASK handlers run on, by default the running loop. (default: {None})
+        """
+        if policy == HandlerPolicy.INLINE:
+            self.handlers.add(handler)
+            return self
+        if policy == HandlerPolicy.POOL and asyncio.iscoroutinefunction(handler):
+            raise ValueError("A coroutine function can't be a POOL handler, use HandlerPolicy.TASK.")
+        if policy == HandlerPolicy.TASK and loop is None:
+            loop = asyncio.get_running_loop()
+        queued = QueuedHandler(handler, policy, max_pending, overflow, loop)
+        self._queued[handler] = queued
+        self.handlers.add(queued)
         return self
 
     def unhandle(self, handler):
         try:
-            self.handlers.remove(handler)
+            self.handlers.remove(self._queued.pop(handler, handler))
         except (KeyError):
             raise ValueError("Handler is not handling this event, so cannot unhandle it.")
         return self
 
+    def get_queued_handler(self, handler):
+        """Returns the QueuedHandler running a POOL or TASK handler, for its pending and dropped counts."""
+        return self._queued.get(handler)
+
     def fire(self, *args, **kargs):
         for handler in self.handlers:
-            handler(*args, **kargs)
+            result = handler(*args, **kargs)
+            if asyncio.iscoroutine(result):
+                self.__schedule(result)
+
+    def __schedule(self, coro):
+        # Coroutine handlers run as tasks on the running event loop. Without one they are dropped, running a loop
+        # to completion would block the thread firing the event.
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            logging.error("Event handler coroutine %s dropped, fired without a running loop", coro.__qualname__)
+            coro.close()
+            return
+        task = loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
     def get_handler_count(self):
         return len(self.handlers)
@@ -1,8 +1,8 @@
 from .enums import Color, TitlePosition
 from .control import Control
+from .timestamp_index import TimestampIndex, parse_timestamp
 
 import datetime
-import dateutil.parser
 
 
 class EventData:
@@ -29,22 +29,39 @@ class EventLog(Control):
         super().__init__("LOG", control_id, control_position=control_position, title_position=title_position)
         self.title = title
         self.message_rx_event += self.__get_log_from_timestamp
+        self.tx_coalesce = False
 
+        # Oldest first, kept in time order. Callers may trim it, the index is rebuilt when it goes out of step.
         self.log_list = []
+        self._index = TimestampIndex()
+        self._indexed = (None, None)
         self.get_state_str = "\t{}\t{}\t".format(self.msg_type, self.control_id)
 
+    def __checked_index(self):
+        # log_list changed other than by add_event_data unless its ends are those indexed.
+        entries = self.log_list
+        if len(self._index) != len(entries) or (entries and self._indexed != (entries[0], entries[-1])):
+            entries.sort(key=lambda entry: entry.timestamp)
+            self._index = TimestampIndex()
+            for entry in entries:
+                self._index.append(int(entry.timestamp.timestamp()))
+            self.__indexed()
+        return self._index
+
+    def __indexed(self):
+        self._indexed = (self.log_list[0], self.log_list[-1]) if self.log_list else (None, None)
+
     def __get_log_from_timestamp(self, msg):
 
-        dt = dateutil.parser.isoparse(msg[0])
-        data_str = ""
-        for log in self.log_list:
-            if log.timestamp > dt:
-                data_str += self.get_state_str + log.to_string()
-        self.state_str = data_str
+        start = self.__checked_index().index_after(parse_timestamp(msg[0]))
+        self.state_str = "".join(self.get_state_str + log.to_string() for log in self.log_list[start:])
 
     def add_event_data(self, data: EventData):
+        """Add data to the log. Data timestamped before the newest entry is inserted in time order."""
         if isinstance(data, EventData):
-            self.log_list.append(data)
+            i = self.__checked_index().insert(int(data.timestamp.timestamp()))
+            self.log_list.insert(i, data)
+            self.__indexed()
             self.state_str = self.get_state_str + data.to_string()
 
     def send_data(self):
@@ -1,5 +1,6 @@
 from .enums import GraphLineType, Color, GraphXAxisLabelsStyle, TitlePosition
 from .control import Control
+from .event import Event
 
 
 class GraphLine:
@@ -7,7 +8,17 @@ class GraphLine:
         self.name = name
         self.line_type = line_type
         self.color = color
-        self.data = []
+        self.state_change_event = Event()
+        self._data = []
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, val):
+        self._data = val
+        self.state_change_event()
 
     def get_line_data(self):
         data_str = "\t{l_name}\t{l_type}\t{l_color}\t".format(
@@ -54,10 +65,14 @@ class Graph(Control):
         self.y_axis_num_bars = y_axis_num_bars
 
         self.line_dict = {}
+        # A line's data list can be changed in place, so the state is built again for every STATUS.
+        self.state_cached = False
         self.get_state_str = "\t{}\t{}\t".format(self.msg_type, self.control_id)
 
     def add_line(self, line_id, gline):
+        gline.state_change_event += self._state_changed
         self.line_dict[line_id] = gline
+        self._state_changed()
 
     def send_graph(self):
         state_str = ""
@@ -45,7 +45,7 @@ class Knob(Control):
     def knob_value(self, val):
         self._knob_value = val
         self._state_str_knob = "\t{}\t{}\t{}\n".format(self.msg_type, self.control_id, val)
-        self.message_tx_event(self._state_str_knob)
+        self._send_value("knob", val, self._state_str_knob)
         self._state_str = self._state_str_knob + self._state_str_dial
 
     @property
@@ -56,7 +56,7 @@ class Knob(Control):
     def knob_dial_value(self, val):
         self._knob_dial_value = val
         self._state_str_dial = "\t{}\t{}\t{}\n".format(self._control_id_dial, self.control_id, val)
-        self.message_tx_event(self._state_str_dial)
+        self._send_value("dial", val, self._state_str_dial)
         self._state_str = self._state_str_knob + self._state_str_dial
 
     @property
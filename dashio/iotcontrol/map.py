@@ -61,10 +61,14 @@ class Map(Control):
         super().__init__("MAP", control_id, control_position=control_position, title_position=title_position)
         self.title = title
         self.location_list = []
+        self.tx_coalesce = False
+        # The location list can be changed in place, so the state is built again for every STATUS.
+        self.state_cached = False
         self.get_state_str = "\t{}\t{}\t".format(self.msg_type, self.control_id)
 
     def add_location(self, location):
         self.location_list.append(location)
+        self._state_changed()
 
     def send_locations(self):
         state_str = ""
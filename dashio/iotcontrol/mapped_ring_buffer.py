@@ -0,0 +1,241 @@
+from itertools import chain
+
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from .timestamp_index import TimestampIndex
+
+_MAGIC = b"DASHTGL1"
+_VERSION = 1
+# magic, version, segment size, capacity, head, count
+_HEADER = struct.Struct("<8sIIqqq")
+_HEAD_COUNT = struct.Struct("<qq")
+_HEAD_COUNT_OFFSET = 24
+_HEADER_SIZE = 64
+_RECORD = struct.Struct("<qd")
+
+
+class MappedRingBuffer:
+    """A RingBuffer kept in a memory mapped file so a line's history survives restarts.
+
+    The file holds a fixed header followed by fixed size columns of capacity records: int64 timestamps,
+    float64 values, a CRC32 per record and the wire segment of each record, length prefixed in a slot of
+    segment_size bytes. Records are written before the header's head and count, which are the commit point,
+    and on open the newest records are dropped until their CRCs match. Opening is O(1) in the history size and
+    segments are read straight from the mapping.
+
+    A segment too long for its slot is cut short at a character boundary. A file written with another capacity
+    or segment size is rebuilt when opened, keeping its newest records.
+    """
+
+    def __init__(self, path, capacity, segment_size=64):
+        """
+        Arguments:
+            path {str} -- The history file, created if it doesn't exist.
+            capacity {int} -- The number of records kept, the oldest are overwritten.
+
+        Keyword Arguments:
+            segment_size {int} -- Bytes reserved for each record's wire segment, at most 256. (default: {64})
+        """
+        if capacity < 1:
+            raise ValueError("MappedRingBuffer capacity must be at least 1")
+        if not 1 < segment_size <= 256:
+            raise ValueError("MappedRingBuffer segment_size must be between 2 and 256")
+        self.path = path
+        self.capacity = capacity
+        self.segment_size = segment_size
+        self._values_offset = _HEADER_SIZE + 8 * capacity
+        self._crc_offset = self._values_offset + 8 * capacity
+        self._segments_offset = self._crc_offset + 4 * capacity
+        size = self._segments_offset + segment_size * capacity
+        self._truncated = False
+
+        if os.path.exists(path):
+            with open(path, "rb") as history:
+                header = history.read(_HEADER.size)
+            if len(header) == _HEADER.size:
+                magic, version, segment_size_, capacity_, _, _ = _HEADER.unpack(header)
+                if magic == _MAGIC and version == _VERSION and (segment_size_, capacity_) != (segment_size, capacity):
+                    _rebuild(path, capacity_, segment_size_, capacity, segment_size)
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            existing = os.fstat(fd).st_size
+            if existing == 0:
+                os.ftruncate(fd, size)
+            elif existing != size:
+                raise ValueError("{} does not hold {} records of {} bytes".format(path, capacity, segment_size))
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        head = count = 0
+        if existing:
+            magic, version, segment_size_, capacity_, head, count = _HEADER.unpack_from(self._mm)
+            if magic != _MAGIC or version != _VERSION or segment_size_ != segment_size or capacity_ != capacity:
+                self._mm.close()
+                raise ValueError("{} is not a history file for {} records".format(path, capacity))
+        else:
+            _HEADER.pack_into(self._mm, 0, _MAGIC, _VERSION, segment_size, capacity, 0, 0)
+
+        self._buf = memoryview(self._mm)
+        self._values = self._buf[self._values_offset:self._crc_offset].cast("d")
+        self._crcs = self._buf[self._crc_offset:self._segments_offset].cast("I")
+        self._timestamps = self._buf[_HEADER_SIZE:self._values_offset].cast("q")
+        head %= capacity
+        count = min(max(count, 0), capacity)
+        if count == capacity and (not self.__valid(head) or self._timestamps[head] >= self._timestamps[head - 1]):
+            # The oldest record was being overwritten when the last append was cut short, keep it if it's whole.
+            if not self.__valid(head):
+                count -= 1
+            head = (head + 1) % capacity
+        self.index = TimestampIndex(capacity, self._timestamps, head, count)
+        while len(self.index) and not self.__valid(self.index.slot(len(self.index) - 1)):
+            self.index.pop()
+        self.__commit()
+
+    def __segment_slot(self, i):
+        offset = self._segments_offset + i * self.segment_size
+        return self._buf[offset:offset + self.segment_size]
+
+    def __crc(self, i):
+        slot = self.__segment_slot(i)
+        record = _RECORD.pack(self._timestamps[i], self._values[i])
+        return zlib.crc32(slot[:slot[0] + 1], zlib.crc32(record))
+
+    def __valid(self, i):
+        return self.__segment_slot(i)[0] < self.segment_size and self._crcs[i] == self.__crc(i)
+
+    def __commit(self):
+        _HEAD_COUNT.pack_into(self._mm, _HEAD_COUNT_OFFSET, self.index.head, len(self.index))
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, timestamp, value, segment):
+        """Add a sample, overwriting the oldest one if the buffer is full.
+
+        Arguments:
+            timestamp {int} -- Epoch seconds.
+            value {float} -- Numeric value of the sample.
+            segment {bytes} -- The sample encoded as it is sent to the dashboard.
+        """
+        if len(segment) >= self.segment_size:
+            segment = self.__truncate(segment)
+        i = self.index.append(timestamp)
+        self._values[i] = value
+        slot = self.__segment_slot(i)
+        slot[0] = len(segment)
+        slot[1:len(segment) + 1] = segment
+        self._crcs[i] = self.__crc(i)
+        self.__commit()
+
+    def __truncate(self, segment):
+        # The slot's first byte is the length, a UTF-8 character cut in two is dropped.
+        if not self._truncated:
+            self._truncated = True
+            logging.warning("History %s: segments over %d bytes are cut short, open it with a larger segment_size",
+                            self.path, self.segment_size - 1)
+        return bytes(segment[:self.segment_size - 1]).decode("utf-8", "ignore").encode("utf-8")
+
+    def latest(self):
+        """Return the newest sample as a (timestamp, value, segment) tuple."""
+        timestamp = self.index.latest()
+        i = self.index.slot(len(self.index) - 1)
+        slot = self.__segment_slot(i)
+        return timestamp, self._values[i], bytes(slot[1:slot[0] + 1])
+
+    def ranges(self, start=0):
+        """Return the physical (lo, hi) index ranges covering samples start..end, oldest first."""
+        return self.index.ranges(start)
+
+    def index_after(self, epoch):
+        """Return the index of the first sample strictly after epoch."""
+        return self.index.index_after(epoch)
+
+    def timestamps_view(self, start=0):
+        """Return memoryview slices over the timestamps from start, oldest first."""
+        return self.index.view(start)
+
+    def values_view(self, start=0):
+        """Return memoryview slices over the values from start, oldest first."""
+        return [self._values[lo:hi] for lo, hi in self.ranges(start)]
+
+    def segments(self, start=0):
+        """Return an iterator over memoryviews of the sample segments from start, oldest first."""
+        size = self.segment_size
+        buf = self._buf
+        offset = self._segments_offset
+
+        def segment(i):
+            lo = offset + i * size
+            return buf[lo + 1:lo + 1 + buf[lo]]
+
+        return chain.from_iterable(map(segment, range(lo, hi)) for lo, hi in self.ranges(start))
+
+    def segments_at(self, indices, start=0):
+        """Return memoryviews of the segments of the samples at indices, counted from start, in the order of indices."""
+        slot = self.index.slot
+        segments = []
+        for i in indices:
+            lo = self._segments_offset + slot(start + i) * self.segment_size
+            segments.append(self._buf[lo + 1:lo + 1 + self._buf[lo]])
+        return segments
+
+    def clear(self):
+        self.index.clear()
+        self.__commit()
+
+    def flush(self):
+        """Write the mapping back to disk."""
+        self._mm.flush()
+
+    def close(self):
+        self._mm.flush()
+        self.index = TimestampIndex(self.capacity)
+        self._timestamps.release()
+        self._values.release()
+        self._crcs.release()
+        self._buf.release()
+        self._mm.close()
+
+
+def _copy_records(old, new, start):
+    # Every view into the old mapping is released before returning, so it can be closed.
+    timestamps = old.timestamps_view(start)
+    values = old.values_view(start)
+    records = zip(chain.from_iterable(timestamps), chain.from_iterable(values), old.segments(start))
+    try:
+        for ts, value, segment in records:
+            with segment:
+                new.append(ts, value, segment)
+    finally:
+        for view in timestamps + values:
+            view.release()
+
+
+def _rebuild(path, capacity, segment_size, new_capacity, new_segment_size):
+    # Copies the newest records of a history file into one of the new geometry, which then replaces it.
+    rebuilt = path + ".rebuild"
+    if os.path.exists(rebuilt):
+        os.remove(rebuilt)
+    old = MappedRingBuffer(path, capacity, segment_size)
+    try:
+        new = MappedRingBuffer(rebuilt, new_capacity, new_segment_size)
+        try:
+            _copy_records(old, new, max(len(old) - new_capacity, 0))
+            kept = len(new)
+        finally:
+            new.close()
+    except BaseException:
+        if os.path.exists(rebuilt):
+            os.remove(rebuilt)
+        raise
+    finally:
+        old.close()
+    logging.info("History %s rebuilt from %d records of %d bytes to %d of %d, %d kept",
+                 path, capacity, segment_size, new_capacity, new_segment_size, kept)
+    os.replace(rebuilt, path)
@@ -0,0 +1,73 @@
+from array import array
+from itertools import chain
+
+from .timestamp_index import TimestampIndex
+
+
+class RingBuffer:
+    """A fixed capacity circular store of timestamped samples.
+
+    Timestamps are kept as int64 epoch seconds in a TimestampIndex and values as float64 in a flat array.
+    The pre-encoded wire segment of each sample is kept alongside so sending history is a join over
+    segments. Appending and reading the latest sample are O(1), once full the oldest sample and its
+    segment are overwritten.
+    """
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError("RingBuffer capacity must be at least 1")
+        self.capacity = capacity
+        self.index = TimestampIndex(capacity)
+        self._values = array("d", bytes(8 * capacity))
+        self._segments = [None] * capacity
+
+    def __len__(self):
+        return len(self.index)
+
+    def append(self, timestamp, value, segment):
+        """Add a sample, overwriting the oldest one if the buffer is full.
+
+        Arguments:
+            timestamp {int} -- Epoch seconds.
+            value {float} -- Numeric value of the sample.
+            segment {bytes} -- The sample encoded as it is sent to the dashboard.
+        """
+        i = self.index.append(timestamp)
+        self._values[i] = value
+        self._segments[i] = segment
+
+    def latest(self):
+        """Return the newest sample as a (timestamp, value, segment) tuple."""
+        timestamp = self.index.latest()
+        i = self.index.slot(len(self.index) - 1)
+        return timestamp, self._values[i], self._segments[i]
+
+    def ranges(self, start=0):
+        """Return the physical (lo, hi) index ranges covering samples start..end, oldest first."""
+        return self.index.ranges(start)
+
+    def index_after(self, epoch):
+        """Return the index of the first sample strictly after epoch."""
+        return self.index.index_after(epoch)
+
+    def timestamps_view(self, start=0):
+        """Return memoryview slices over the timestamps from start, oldest first."""
+        return self.index.view(start)
+
+    def values_view(self, start=0):
+        """Return memoryview slices over the values from start, oldest first."""
+        mv = memoryview(self._values)
+        return [mv[lo:hi] for lo, hi in self.ranges(start)]
+
+    def segments(self, start=0):
+        """Return an iterator over the sample segments from start, oldest first."""
+        return chain.from_iterable(self._segments[lo:hi] for lo, hi in self.ranges(start))
+
+    def segments_at(self, indices, start=0):
+        """Return the segments of the samples at indices, counted from start, in the order of indices."""
+        slot = self.index.slot
+        return [self._segments[slot(start + i)] for i in indices]
+
+    def clear(self):
+        self.index.clear()
+        self._segments = [None] * self.capacity
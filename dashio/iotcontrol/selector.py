@@ -8,6 +8,8 @@ class Selector(Control):
         self.title = title
         self.selection_list = []
         self._position = 0
+        # The selection list can be changed in place, so the state is built again for every STATUS.
+        self.state_cached = False
         self._cfg["selection"] = self.selection_list
 
     def get_state(self):
@@ -18,6 +20,8 @@ class Selector(Control):
 
     def add_selection(self, text):
         self.selection_list.append(text)
+        self._cfg.changed()
+        self._state_changed()
 
     def set_selected(self, selected_text):
         if selected_text in self.selection_list:
@@ -0,0 +1,125 @@
+import threading
+import time
+
+
+class SendPolicy:
+    def __init__(self, deadband=0.0, relative_deadband=0.0, min_interval=0.0, settle_time=1.0):
+        """Limits how often a value control sends its value.
+
+        A new value is sent when it differs from the last value sent by more than the deadband, and at
+        least min_interval has passed since the last send. A value held back is still sent once changes
+        settle, so the dashboard always ends up showing the latest value.
+
+        Keyword Arguments:
+            deadband {float} -- Changes up to this size are held back. (default: {0.0})
+            relative_deadband {float} -- Changes up to this fraction of the last value sent are held
+                back. (default: {0.0})
+            min_interval {float} -- The least number of seconds between sends. (default: {0.0})
+            settle_time {float} -- Seconds without a change after which a held back value is sent.
+                (default: {1.0})
+        """
+        self.deadband = deadband
+        self.relative_deadband = relative_deadband
+        self.min_interval = min_interval
+        self.settle_time = settle_time
+
+    def outside_deadband(self, last_value, value):
+        """Whether value has moved from last_value by more than the deadband, for numbers or tuples of them."""
+        if isinstance(value, tuple):
+            return len(value) != len(last_value) or any(map(self.outside_deadband, last_value, value))
+        try:
+            delta = abs(float(value) - float(last_value))
+            threshold = max(self.deadband, self.relative_deadband * abs(float(last_value)))
+        except (TypeError, ValueError):
+            return value != last_value
+        return delta > threshold
+
+
+class ValueThrottle:
+    """Applies a SendPolicy to one value of a control, sending held back values from a timer.
+
+    Messages are sent outside the lock. Those held back are sent from the timer's thread, the device the
+    control belongs to hands them to its own loop.
+    """
+
+    def __init__(self, policy, send):
+        self.policy = policy
+        self._send = send
+        self._lock = threading.Lock()
+        self._sent_value = None
+        self._sent_time = None
+        self._pending = None
+        self._timer = None
+        self._deadline = None
+
+    def __sent(self, value, msg, now):
+        # Records msg as sent and returns it, for the caller to send once the lock is released.
+        self._sent_value = value
+        self._sent_time = now
+        self._pending = None
+        return msg
+
+    def __arm(self, delay, now):
+        # Replaces any timer armed, one that already fired and waits for the lock finds it isn't current.
+        if self._timer is not None:
+            self._timer.cancel()
+        self._deadline = now + delay
+        timer = threading.Timer(max(delay, 0.001), lambda: self.__on_timer(timer))
+        timer.daemon = True
+        self._timer = timer
+        timer.start()
+
+    def __due(self, now):
+        # Seconds until the pending value may be sent, 0 if it should go now, None if it can be dropped.
+        value, _, changed = self._pending
+        if not self.policy.outside_deadband(self._sent_value, value):
+            if value == self._sent_value:
+                return None
+            return max(changed + self.policy.settle_time - now, 0.0)
+        return max(self._sent_time + self.policy.min_interval - now, 0.0)
+
+    def update(self, value, msg):
+        """Send msg for value now, or hold it back as the policy requires."""
+        send = None
+        with self._lock:
+            now = time.monotonic()
+            if self._sent_time is None:
+                send = self.__sent(value, msg, now)
+            else:
+                self._pending = (value, msg, now)
+                due = self.__due(now)
+                if due is None:
+                    self._pending = None
+                elif due == 0.0:
+                    send = self.__sent(value, msg, now)
+                elif self._timer is None or now + due < self._deadline:
+                    self.__arm(due, now)
+        if send is not None:
+            self._send(send)
+
+    def __on_timer(self, timer):
+        send = None
+        with self._lock:
+            if self._timer is not timer:
+                return
+            self._timer = None
+            if self._pending is None:
+                return
+            now = time.monotonic()
+            due = self.__due(now)
+            if due is None:
+                self._pending = None
+            elif due == 0.0:
+                value, msg, _ = self._pending
+                send = self.__sent(value, msg, now)
+            else:
+                self.__arm(due, now)
+        if send is not None:
+            self._send(send)
+
+    def cancel(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._pending = None
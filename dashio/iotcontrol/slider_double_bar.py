@@ -48,7 +48,7 @@ class SliderDoubleBar(SliderSingleBar):
         self._bar_state_str = "\t{}\t{}\t{:.2f}\t{:.2f}\n".format(
             self._control_id_bar, self.control_id, val, self._bar2_value
         )
-        self.message_tx_event(self._bar_state_str)
+        self._send_value("bar", (self._bar1_value, self._bar2_value), self._bar_state_str)
         self._state_str = self._slider_state_str + self._bar_state_str
 
     @property
@@ -61,7 +61,7 @@ class SliderDoubleBar(SliderSingleBar):
         self._bar_state_str = "\t{}\t{}\t{:.2f}\t{:.2f}\n".format(
             self._control_id_bar, self.control_id, self._bar1_value, val
         )
-        self.message_tx_event(self._bar_state_str)
+        self._send_value("bar", (self._bar1_value, self._bar2_value), self._bar_state_str)
         self._state_str = self._slider_state_str + self._bar_state_str
 
     @property
@@ -72,5 +72,5 @@ class SliderDoubleBar(SliderSingleBar):
     def slider_value(self, val):
         self._slider_value = val
         self._slider_state_str = "\t{}\t{}\t{}\n".format(self.msg_type, self.control_id, self._slider_value)
-        self.message_tx_event(self._slider_state_str)
+        self._send_value("slider", val, self._slider_state_str)
         self._state_str = self._slider_state_str + self._bar_state_str
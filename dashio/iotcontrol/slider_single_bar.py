@@ -49,7 +49,7 @@ class SliderSingleBar(Control):
     def bar1_value(self, val):
         self._bar1_value = val
         self._bar1_state_str = "\t{}\t{}\t{}\n".format(self._control_id_bar, self.control_id, self._bar1_value)
-        self.message_tx_event(self._bar1_state_str)
+        self._send_value("bar", val, self._bar1_state_str)
         self._state_str = self._slider_state_str + self._bar1_state_str
 
     @property
@@ -60,7 +60,7 @@ class SliderSingleBar(Control):
     def slider_value(self, val):
         self._slider_value = val
         self._slider_state_str = "\t{}\t{}\t{}\n".format(self.msg_type, self.control_id, self._slider_value)
-        self.message_tx_event(self._slider_state_str)
+        self._send_value("slider", val, self._slider_state_str)
         self._state_str = self._slider_state_str + self._bar1_state_str
 
     @property
@@ -1,13 +1,23 @@
-from .enums import TimeGraphLineType, Color, TitlePosition
+from .enums import TimeGraphLineType, Color, TitlePosition, DownsampleMethod
 from .control import Control
+from .event import Event
+from .downsample import downsample_indices
+from .mapped_ring_buffer import MappedRingBuffer
+from .ring_buffer import RingBuffer
+from .timestamp_index import parse_timestamp
 
 import datetime
-import dateutil.parser
+import math
+import os
+import time
+from itertools import chain
 
 
 class DataPoint:
-    def __init__(self, data):
-        self.timestamp = datetime.datetime.utcnow().replace(microsecond=0, tzinfo=datetime.timezone.utc)
+    def __init__(self, data, timestamp=None):
+        if timestamp is None:
+            timestamp = datetime.datetime.utcnow().replace(microsecond=0, tzinfo=datetime.timezone.utc)
+        self.timestamp = timestamp
         self.data_point = data
 
     def to_string(self):
@@ -15,42 +25,144 @@ class DataPoint:
         return data_str
 
 
+def _iso_timestamp(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).isoformat()
+
+
+def _to_float(data_point):
+    try:
+        return float(data_point)
+    except (TypeError, ValueError):
+        return math.nan
+
+
 class TimeGraphLine:
     def __init__(
-        self, name="", line_type=TimeGraphLineType.LINE, color=Color.BLACK, transparency=1.0, max_data_points=60
+        self,
+        name="",
+        line_type=TimeGraphLineType.LINE,
+        color=Color.BLACK,
+        transparency=1.0,
+        max_data_points=60,
+        point_budget=None,
+        downsample_method=DownsampleMethod.MIN_MAX,
     ):
-        self.max_data_points = max_data_points
+        """A line of timestamped data points for a TimeGraph.
+
+        Keyword Arguments:
+            max_data_points {int} -- The number of data points kept, the oldest are dropped. (default: {60})
+            point_budget {int} -- The most data points sent in one reply, larger replies are downsampled.
+                None sends every point. (default: {None})
+            downsample_method {DownsampleMethod} -- How replies over the point budget are downsampled.
+                (default: {DownsampleMethod.MIN_MAX})
+        """
         self.name = name
         self.line_type = line_type
         self.color = color
         self.transparency = transparency
-        self.data = []
+        self.point_budget = point_budget
+        self.downsample_method = downsample_method
+        self._buffer = RingBuffer(max_data_points)
+        self.state_change_event = Event()
+        # Each data point is kept pre-encoded as its wire segment, this caches the timestamp part of the last one.
+        self._iso_cache = (None, "")
 
-    def get_line_data(self):
-        if not self.data:
-            return ""
-        data_str = "\t{l_name}\t{l_type}\t{l_color}\t{l_transparency}".format(
-            l_name=self.name, l_type=self.line_type.value, l_color=self.color.value, l_transparency=self.transparency
-        )
-        for d in self.data:
-            data_str += "\t" + d.to_string()
-        data_str += "\n"
-        return data_str
+    def __len__(self):
+        return len(self._buffer)
+
+    @property
+    def max_data_points(self):
+        return self._buffer.capacity
+
+    def open_history(self, path, segment_size=64):
+        """Keep the line's data points in a memory mapped history file so they survive restarts.
+
+        The file is created if needed and any points already in the line are appended to it. A file written
+        with a different max_data_points or segment_size is rebuilt, keeping its newest points.
+
+        Arguments:
+            path {str} -- The history file for this line.
+
+        Keyword Arguments:
+            segment_size {int} -- Bytes kept for each data point as sent, its timestamp takes 27. Longer data
+                points are cut short. At most 256. (default: {64})
+        """
+        store = MappedRingBuffer(path, self.max_data_points, segment_size)
+        timestamps = chain.from_iterable(self._buffer.timestamps_view())
+        values = chain.from_iterable(self._buffer.values_view())
+        for ts, value, segment in zip(timestamps, values, self._buffer.segments()):
+            store.append(ts, value, segment)
+        self._buffer = store
+
+    def flush_history(self):
+        """Write a memory mapped history back to disk."""
+        if isinstance(self._buffer, MappedRingBuffer):
+            self._buffer.flush()
+
+    @property
+    def data(self):
+        """A list of DataPoints copied from the line's store, oldest first."""
+        data = []
+        for ts, segment in zip(chain.from_iterable(self._buffer.timestamps_view()), self._buffer.segments()):
+            label = str(segment, "utf-8").split(",", 1)[1]
+            data.append(DataPoint(label, datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)))
+        return data
 
-    def get_line_from_timestamp(self, timestamp):
-        if not self.data:
-            return ""
-        data_str = "\t{l_name}\t{l_type}\t{l_color}\t{l_transparency}".format(
+    def __line_header(self):
+        return "\t{l_name}\t{l_type}\t{l_color}\t{l_transparency}".format(
             l_name=self.name, l_type=self.line_type.value, l_color=self.color.value, l_transparency=self.transparency
+        ).encode("utf-8")
+
+    def __downsampled_segments(self, start, budget):
+        indices = downsample_indices(
+            self._buffer.timestamps_view(start), self._buffer.values_view(start), budget, self.downsample_method
         )
+        return self._buffer.segments_at(indices, start)
 
-        dt = dateutil.parser.isoparse(timestamp)
+    def encode_line_data(self, start=0, point_budget=None):
+        """Return the line from its start'th data point as UTF-8 bytes, b"" if the line is empty.
 
-        for d in self.data:
-            if d.timestamp > dt:
-                data_str += "\t" + d.to_string()
-        data_str += "\n"
-        return data_str
+        Keyword Arguments:
+            start {int} -- Index of the first data point, oldest first. (default: {0})
+            point_budget {int} -- Downsample to this many points, overriding the line's point budget.
+        """
+        if not self._buffer:
+            return b""
+        budget = point_budget or self.point_budget
+        if budget and len(self._buffer) - start > budget:
+            segments = self.__downsampled_segments(start, budget)
+        else:
+            segments = self._buffer.segments(start)
+        return b"".join(chain((self.__line_header(),), segments, (b"\n",)))
+
+    def encode_line_from_timestamp(self, timestamp, point_budget=None):
+        """As get_line_from_timestamp, returning UTF-8 bytes."""
+        if not self._buffer:
+            return b""
+        if isinstance(timestamp, str):
+            timestamp = parse_timestamp(timestamp)
+        return self.encode_line_data(self._buffer.index_after(timestamp), point_budget)
+
+    def encode_latest_data(self):
+        """As get_latest_data, returning UTF-8 bytes."""
+        if not self._buffer:
+            return b""
+        return b"".join((self.__line_header(), self._buffer.latest()[2], b"\n"))
+
+    def get_line_data(self, point_budget=None):
+        """Return the whole line, downsampled to point_budget or the line's point budget if set."""
+        return self.encode_line_data(0, point_budget).decode("utf-8")
+
+    def get_line_from_timestamp(self, timestamp, point_budget=None):
+        """Return the line with the data points newer than timestamp.
+
+        Arguments:
+            timestamp {str|float} -- An ISO 8601 timestamp or epoch seconds.
+
+        Keyword Arguments:
+            point_budget {int} -- Downsample to this many points, overriding the line's point budget.
+        """
+        return self.encode_line_from_timestamp(timestamp, point_budget).decode("utf-8")
 
     def add_data_point(self, data_point):
         """Add and sends a single datapoint to the line. It automatically timestamps to the current time.
@@ -58,34 +170,26 @@ class TimeGraphLine:
         Arguments:
             data_point {str} -- A single data point
         """
-        dp = DataPoint(data_point)
-        # now = datetime.datetime.utcnow().replace(microsecond=0, tzinfo=datetime.timezone.utc).isoformat()
-        # data_str = "{ts},{data}".format(ts=now, data=data_point)
-        if len(self.data) < self.max_data_points:
-            self.data.append(dp)
-            return
-        for i in range(len(self.data) - 1):
-            self.data[i] = self.data[i + 1]
-        self.data[-1] = dp
+        ts = int(time.time())
+        if self._buffer:
+            ts = max(ts, self._buffer.latest()[0])
+        if ts != self._iso_cache[0]:
+            self._iso_cache = (ts, "\t" + _iso_timestamp(ts) + ",")
+        segment = (self._iso_cache[1] + str(data_point)).encode("utf-8")
+        self._buffer.append(ts, _to_float(data_point), segment)
+        self.state_change_event()
 
     def get_latest_data(self):
-        if not self.data:
-            return ""
-        data_str = "\t{l_name}\t{l_type}\t{l_color}\t{l_transparency}".format(
-            l_name=self.name, l_type=self.line_type.value, l_color=self.color.value, l_transparency=self.transparency
-        )
-        data_str += "\t" + self.data[-1].to_string()
-        data_str += "\n"
-        return data_str
+        return self.encode_latest_data().decode("utf-8")
 
 
 class TimeGraph(Control):
     def get_state(self):
-        state_str = ""
-        for key in self.line_dict.keys():
-            if self.line_dict[key].data:
-                state_str += self.get_state_str + key + self.line_dict[key].get_latest_data()
-        return state_str
+        return b"".join(
+            self._b_state_str + key.encode("utf-8") + line.encode_latest_data()
+            for key, line in self.line_dict.items()
+            if line
+        )
 
     def __init__(
         self,
@@ -97,41 +201,78 @@ class TimeGraph(Control):
         y_axis_max=100.0,
         y_axis_num_bars=5,
         control_position=None,
+        point_budget=None,
+        history_dir=None,
+        history_segment_size=64,
     ):
+        """
+        Keyword Arguments:
+            point_budget {int} -- The most data points sent per line in one reply for lines without their own
+                point budget. (default: {None})
+            history_dir {str} -- A directory to keep each line's history in, so it survives restarts.
+                None keeps history in memory. (default: {None})
+            history_segment_size {int} -- Bytes kept for each data point in a history file, see
+                TimeGraphLine.open_history. (default: {64})
+        """
         super().__init__("TGRPH", control_id, control_position=control_position, title_position=title_position)
 
         self.message_rx_event += self.__get_lines_from_timestamp
+        self.tx_coalesce = False
 
         self.y_axis_label = y_axis_label
         self.y_axis_min = y_axis_min
         self.y_axis_max = y_axis_max
         self.y_axis_num_bars = y_axis_num_bars
 
+        self.point_budget = point_budget
+        self.history_dir = history_dir
+        self.history_segment_size = history_segment_size
+
         self.line_dict = {}
         self.get_state_str = "\t{}\t{}\t".format(self.msg_type, self.control_id)
+        # The graph's state is sent as bytes joined from the lines' pre-encoded data points.
+        self._b_state_str = self.get_state_str.encode("utf-8")
 
     def add_line(self, line_id, gline):
+        if self.history_dir is not None:
+            gline.open_history(
+                os.path.join(self.history_dir, "{}_{}.tgl".format(self.control_id, line_id)), self.history_segment_size
+            )
+        gline.state_change_event += self._state_changed
         self.line_dict[line_id] = gline
+        self._state_changed()
 
-    def send_graph(self):
-        state_str = ""
-        for key in self.line_dict.keys():
-            state_str += self.get_state_str + key + self.line_dict[key].get_line_data()
-        self.state_str = state_str
+    def flush_history(self):
+        """Write the lines' history files back to disk."""
+        for line in self.line_dict.values():
+            line.flush_history()
+
+    def send_graph(self, point_budget=None):
+        """Send every line, each downsampled to point_budget, the line's or the graph's point budget."""
+        self.state_str = b"".join(
+            self._b_state_str
+            + key.encode("utf-8")
+            + line.encode_line_data(0, point_budget or line.point_budget or self.point_budget)
+            for key, line in self.line_dict.items()
+        )
 
     def __get_lines_from_timestamp(self, msg):
-        state_str = ""
-        for key in self.line_dict.keys():
-            if self.line_dict[key].data:
-                state_str += self.get_state_str + key + self.line_dict[key].get_line_from_timestamp(msg[0])
-        self.state_str = state_str
+        # An optional second field carries a point budget for this request, those under 1 are ignored.
+        epoch = parse_timestamp(msg[0])
+        try:
+            point_budget = max(int(msg[1]), 0)
+        except (IndexError, ValueError):
+            point_budget = None
+        self.state_str = b"".join(
+            self._b_state_str
+            + key.encode("utf-8")
+            + line.encode_line_from_timestamp(epoch, point_budget or line.point_budget or self.point_budget)
+            for key, line in self.line_dict.items()
+            if line
+        )
 
     def send_data(self):
-        state_str = ""
-        for key in self.line_dict.keys():
-            if self.line_dict[key].data:
-                state_str += self.get_state_str + key + self.line_dict[key].get_latest_data()
-        self.state_str = state_str
+        self.state_str = self.get_state()
 
     @property
     def y_axis_label(self):
@@ -0,0 +1,130 @@
+from array import array
+from bisect import bisect_right
+
+import datetime
+import dateutil.parser
+
+
+def parse_timestamp(timestamp):
+    """Convert an ISO 8601 timestamp from the dashboard to epoch seconds. Naive timestamps are taken as UTC."""
+    dt = dateutil.parser.isoparse(timestamp)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+class TimestampIndex:
+    """Append ordered int64 epoch timestamps with bisect lookup.
+
+    With a capacity the index is circular and the oldest timestamp is overwritten once full, otherwise it
+    grows without bound. A timestamp older than the newest one is stored as the newest so the index stays
+    sorted.
+    """
+
+    def __init__(self, capacity=None, timestamps=None, head=0, count=0):
+        """
+        Keyword Arguments:
+            capacity {int} -- The number of timestamps kept, None for unbounded. (default: {None})
+            timestamps {memoryview} -- A writable 'q' buffer of capacity slots to keep the timestamps in,
+                with head and count describing what it already holds. (default: {None})
+        """
+        self.capacity = capacity
+        if capacity is None:
+            self._timestamps = array("q")
+        else:
+            if capacity < 1:
+                raise ValueError("TimestampIndex capacity must be at least 1")
+            if timestamps is None:
+                timestamps = array("q", bytes(8 * capacity))
+            self._timestamps = timestamps
+        self._head = head
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def head(self):
+        """The physical slot of the oldest timestamp."""
+        return self._head
+
+    def append(self, timestamp):
+        """Add a timestamp and return the physical slot it was stored in."""
+        if self._count:
+            timestamp = max(timestamp, self.latest())
+        if self.capacity is None:
+            self._timestamps.append(timestamp)
+            self._count += 1
+            return self._count - 1
+        if self._count < self.capacity:
+            i = (self._head + self._count) % self.capacity
+            self._count += 1
+        else:
+            i = self._head
+            self._head = (self._head + 1) % self.capacity
+        self._timestamps[i] = timestamp
+        return i
+
+    def insert(self, timestamp):
+        """Add a timestamp after those not newer than it and return its logical index. Unbounded indexes only."""
+        if self.capacity is not None:
+            raise ValueError("Only an unbounded TimestampIndex can insert")
+        i = bisect_right(self._timestamps, timestamp)
+        self._timestamps.insert(i, timestamp)
+        self._count += 1
+        return i
+
+    def pop(self):
+        """Remove the newest timestamp."""
+        if not self._count:
+            raise IndexError("pop from empty TimestampIndex")
+        if self.capacity is None:
+            self._timestamps.pop()
+        self._count -= 1
+
+    def latest(self):
+        if not self._count:
+            raise IndexError("latest from empty TimestampIndex")
+        if self.capacity is None:
+            return self._timestamps[-1]
+        return self._timestamps[(self._head + self._count - 1) % self.capacity]
+
+    def slot(self, index):
+        """Return the physical slot of the logical index, oldest first."""
+        if self.capacity is None:
+            return index
+        return (self._head + index) % self.capacity
+
+    def ranges(self, start=0):
+        """Return the physical (lo, hi) slot ranges covering entries start..end, oldest first."""
+        if start >= self._count:
+            return []
+        if self.capacity is None:
+            return [(start, self._count)]
+        lo = self._head + start
+        end = self._head + self._count
+        if end <= self.capacity:
+            return [(lo, end)]
+        if lo >= self.capacity:
+            return [(lo - self.capacity, end - self.capacity)]
+        return [(lo, self.capacity), (0, end - self.capacity)]
+
+    def view(self, start=0):
+        """Return memoryview slices over the timestamps from start, oldest first."""
+        mv = memoryview(self._timestamps)
+        return [mv[lo:hi] for lo, hi in self.ranges(start)]
+
+    def index_after(self, epoch):
+        """Return the logical index of the first timestamp strictly after epoch in O(log n)."""
+        offset = 0
+        for lo, hi in self.ranges():
+            if self._timestamps[hi - 1] > epoch:
+                return offset + bisect_right(self._timestamps, epoch, lo, hi) - lo
+            offset += hi - lo
+        return offset
+
+    def clear(self):
+        if self.capacity is None:
+            self._timestamps = array("q")
+        self._head = 0
+        self._count = 0
@@ -0,0 +1,404 @@
+"""Simulated dashboard clients for load testing a tcpConnection or zmqConnection.
+
+Run as python -m dashio.loadgen DEVICE_ID, see --help. For example 50 clients asking for 200 commands a second
+between them, mostly STATUS, with writes to a slider:
+
+    python -m dashio.loadgen DEV1 --clients 50 --rate 200 --mix STATUS=10,CFG=1,WRITE=5 --write SLD:S1:{value}
+"""
+
+import argparse
+import datetime
+import json
+import random
+import time
+from collections import deque
+
+import zmq
+
+from .tcp_client import tcpClients
+
+COMMANDS = ("WHO", "CONNECT", "STATUS", "CFG", "WRITE", "HISTORY")
+
+
+class CommandMix:
+    """Picks the commands the clients send, at random by weight.
+
+    Every request ends with a CONNECT for the device, whose reply is a known line. The device answers the
+    commands of a frame in order, so that line marks the whole reply received, whatever the reply to the
+    command looks like and for commands without one.
+    """
+
+    def __init__(self, device_id, weights, write=None, history=None, history_seconds=3600.0, seed=None):
+        """
+        Arguments:
+            device_id {str} -- The device the commands are for.
+            weights {dict} -- The relative weight of each command sent, by its name in COMMANDS.
+
+        Keyword Arguments:
+            write {str} -- The control write sent for WRITE, the fields after the device ID tab separated.
+                {value} is replaced by a random integer from 0 to 100. (default: {None})
+            history {str} -- The type and ID, tab separated, of the control HISTORY requests. (default: {None})
+            history_seconds {float} -- How far back HISTORY asks from. (default: {3600.0})
+            seed {int} -- Seeds the choice of commands and values, for repeatable runs. (default: {None})
+        """
+        unknown = set(weights) - set(COMMANDS)
+        if unknown:
+            raise ValueError("Unknown commands: {}".format(", ".join(sorted(unknown))))
+        if weights.get("WRITE") and not write:
+            raise ValueError("WRITE needs the control write to send")
+        if weights.get("HISTORY") and not history:
+            raise ValueError("HISTORY needs the control to request")
+        self.names = [name for name, weight in weights.items() if weight > 0]
+        if not self.names:
+            raise ValueError("No commands to send")
+        self.weights = [weights[name] for name in self.names]
+        self.write = write
+        self.history = history
+        self.history_seconds = history_seconds
+        self.random = random.Random(seed)
+        self.prefix = "\t{}\t".format(device_id)
+        self.sentinel = "\t{}\tCONNECT\n".format(device_id).encode("utf-8")
+        self._requests = {
+            "WHO": b"\tWHO\n" + self.sentinel,
+            "CONNECT": self.sentinel,
+            "STATUS": (self.prefix + "STATUS\n").encode("utf-8") + self.sentinel,
+            "CFG": (self.prefix + "CFG\n").encode("utf-8") + self.sentinel,
+        }
+
+    @staticmethod
+    def parse_weights(spec):
+        """Returns the weights of a mix written as NAME=WEIGHT,..., e.g. "STATUS=10,CFG=1"."""
+        weights = {}
+        for item in spec.split(","):
+            name, _, weight = item.partition("=")
+            weights[name.strip().upper()] = float(weight or 1)
+        return weights
+
+    def next(self):
+        """Returns the name and request of the next command."""
+        name = self.random.choices(self.names, self.weights)[0]
+        if name == "WRITE":
+            command = self.prefix + self.write.format(value=self.random.randint(0, 100)) + "\n"
+        elif name == "HISTORY":
+            since = datetime.datetime.fromtimestamp(time.time() - self.history_seconds, datetime.timezone.utc)
+            command = self.prefix + self.history + "\t" + since.isoformat() + "\n"
+        else:
+            return name, self._requests[name]
+        return name, command.encode("utf-8") + self.sentinel
+
+
+class tcpLoadClients(tcpClients):
+    """Clients of a tcpConnection, each reply comes only to the client that asked."""
+
+    shared_replies = False
+
+    def __init__(self, url, clients, context=None, compression=None):
+        super().__init__(url, clients, context, compression)
+        self.sockets = [self.socket]
+
+    def wait_ready(self, probe, timeout=10.0):
+        """Connect, then send probe until a reply comes, a device still joining its connection drops replies."""
+        deadline = time.monotonic() + timeout
+        if not self.wait_connected(timeout):
+            return False
+        replied = set()
+        while len(replied) < len(self.ids):
+            if time.monotonic() > deadline:
+                return False
+            for index in range(len(self.ids)):
+                if index not in replied:
+                    self.send(index, probe)
+            while self.socket.poll(100):
+                received = self.receive()
+                if received is not None and probe in received[1]:
+                    replied.add(received[0])
+        # Drop the replies to repeated probes.
+        while self.socket.poll(200):
+            self.receive()
+        return True
+
+    def receive_from(self, socket):
+        return self.receive()
+
+
+class zmqLoadClients:
+    """Clients of a zmqConnection, each a SUB and PUB pair.
+
+    zmqConnection publishes every reply to every subscriber, so each client receives all of them. Replies are
+    matched to requests in the order sent across all the clients, on the first client's SUB.
+    """
+
+    shared_replies = True
+
+    def __init__(self, pub_url, sub_url, clients, context=None):
+        """
+        Arguments:
+            pub_url {str} -- The zmqConnection's PUB address, replies come from it.
+            sub_url {str} -- The zmqConnection's SUB address, requests go to it.
+            clients {int} -- The number of clients.
+        """
+        self.context = context or zmq.Context.instance()
+        self.sockets = []
+        self.pubs = []
+        for _ in range(clients):
+            sub = self.context.socket(zmq.SUB)
+            sub.setsockopt(zmq.SUBSCRIBE, b"")
+            sub.connect(pub_url)
+            self.sockets.append(sub)
+            pub = self.context.socket(zmq.PUB)
+            pub.connect(sub_url)
+            self.pubs.append(pub)
+        self.index = {sub: n for n, sub in enumerate(self.sockets)}
+
+    def wait_ready(self, probe, timeout=10.0):
+        """Send probe from each client until a reply comes, PUB and SUB drop what is sent before they've joined."""
+        deadline = time.monotonic() + timeout
+        for pub, sub in zip(self.pubs, self.sockets):
+            while not sub.poll(100):
+                if time.monotonic() > deadline:
+                    return False
+                pub.send(probe)
+        # Drop the replies to the probes.
+        for sub in self.sockets:
+            while sub.poll(200):
+                sub.recv()
+        return True
+
+    def send(self, index, data):
+        try:
+            self.pubs[index].send(data, zmq.NOBLOCK)
+        except zmq.error.ZMQError:
+            return False
+        return True
+
+    def receive_from(self, socket):
+        return self.index[socket], socket.recv()
+
+    def close(self):
+        for socket in self.sockets + self.pubs:
+            socket.close(0)
+
+
+def percentile(samples, fraction):
+    """The sample at fraction through samples, which are sorted."""
+    return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class LoadReport:
+    """What a run measured, latencies in seconds by command name."""
+
+    def __init__(self, clients, rate, duration, sent, completed, skipped, failed, lost, bytes_in, latencies):
+        self.clients = clients
+        self.rate = rate
+        self.duration = duration
+        self.sent = sent
+        self.completed = completed
+        self.skipped = skipped
+        self.failed = failed
+        self.lost = lost
+        self.bytes_in = bytes_in
+        self.latencies = {name: sorted(samples) for name, samples in latencies.items()}
+
+    @property
+    def throughput(self):
+        """Replies per second to the requests of the measured period."""
+        return self.completed / self.duration
+
+    def summary(self, samples):
+        if not samples:
+            return {"count": 0}
+        return {
+            "count": len(samples),
+            "p50": percentile(samples, 0.5),
+            "p95": percentile(samples, 0.95),
+            "p99": percentile(samples, 0.99),
+            "max": samples[-1],
+        }
+
+    def to_dict(self):
+        every = sorted(sample for samples in self.latencies.values() for sample in samples)
+        return {
+            "clients": self.clients,
+            "target_rate": self.rate,
+            "duration": self.duration,
+            "sent": self.sent,
+            "completed": self.completed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "lost": self.lost,
+            "bytes_in": self.bytes_in,
+            "throughput": self.throughput,
+            "latency": dict({name: self.summary(samples) for name, samples in self.latencies.items()},
+                            ALL=self.summary(every)),
+        }
+
+    def format(self):
+        report = self.to_dict()
+        lines = [
+            "clients {clients}, target {target_rate:.0f}/s over {duration:.0f} s".format(**report),
+            "sent {sent}, completed {completed}, skipped {skipped}, failed {failed}, lost {lost}".format(**report),
+            "throughput {:.1f} replies/s, {:.0f} bytes/s received".format(
+                report["throughput"], report["bytes_in"] / report["duration"]),
+            "{:>8} {:>8} {:>10} {:>10} {:>10} {:>10}".format("command", "count", "p50 ms", "p95 ms", "p99 ms", "max ms"),
+        ]
+        for name, summary in report["latency"].items():
+            if summary["count"]:
+                lines.append("{:>8} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+                    name, summary["count"], summary["p50"] * 1e3, summary["p95"] * 1e3, summary["p99"] * 1e3,
+                    summary["max"] * 1e3))
+        return "\n".join(lines)
+
+
+class LoadGenerator:
+    """Sends commands from many clients at a target rate and times their replies, on the calling thread.
+
+    Requests are scheduled at even intervals and given to the clients in turn, whether or not earlier replies
+    have arrived. Latency is timed from when a request was due, so a server or generator falling behind shows
+    in it rather than slowing the requests down. Replies are matched to requests in order, one the server
+    drops is counted as lost at the end but the replies after it are matched to the requests before them.
+    """
+
+    def __init__(self, clients, mix, rate, duration, warmup=1.0, max_outstanding=100, drain=2.0):
+        """
+        Arguments:
+            clients {tcpLoadClients or zmqLoadClients} -- The clients sending.
+            mix {CommandMix} -- The commands sent.
+            rate {float} -- Requests per second from all the clients together.
+            duration {float} -- Seconds measured.
+
+        Keyword Arguments:
+            warmup {float} -- Seconds of requests before those measured. (default: {1.0})
+            max_outstanding {int} -- The most requests waiting for replies per client, those due while a client
+                has as many are skipped. (default: {100})
+            drain {float} -- Seconds to wait for the last replies after the run. (default: {2.0})
+        """
+        self.clients = clients
+        self.mix = mix
+        self.rate = rate
+        self.duration = duration
+        self.warmup = warmup
+        self.max_outstanding = max_outstanding
+        self.drain = drain
+
+    def run(self):
+        """Returns a LoadReport once the run, its warmup and drain are over."""
+        clients = self.clients
+        count = len(clients.sockets) if clients.shared_replies else len(clients.ids)
+        if not clients.wait_ready(self.mix.sentinel):
+            raise TimeoutError("The clients could not connect")
+        sentinel = self.mix.sentinel
+        overlap = len(sentinel) - 1
+        # Shared replies are all matched on the first client, in the order the requests were sent.
+        outstanding = [deque() for _ in range(1 if clients.shared_replies else count)]
+        tails = [b""] * count
+        latencies = {}
+        sent = completed = skipped = failed = bytes_in = 0
+        poller = zmq.Poller()
+        for socket in clients.sockets:
+            poller.register(socket, zmq.POLLIN)
+
+        interval = 1.0 / self.rate
+        start = time.perf_counter()
+        measured = start + self.warmup
+        end = measured + self.duration
+        due = start
+        sequence = 0
+        while True:
+            now = time.perf_counter()
+            while due <= now and due < end:
+                client = sequence % count
+                sequence += 1
+                queue = outstanding[0 if clients.shared_replies else client]
+                in_period = due >= measured
+                if len(queue) >= self.max_outstanding * (count if clients.shared_replies else 1):
+                    skipped += in_period
+                else:
+                    name, request = self.mix.next()
+                    if clients.send(client, request):
+                        queue.append((due, name))
+                        sent += in_period
+                    else:
+                        failed += in_period
+                due += interval
+            if due >= end and (not any(outstanding) or now > end + self.drain):
+                break
+            timeout = (due if due < end else end + self.drain) - now
+            for socket, _ in poller.poll(max(0, int(timeout * 1000))):
+                received = clients.receive_from(socket)
+                if received is None:
+                    continue
+                index, data = received
+                bytes_in += len(data)
+                if clients.shared_replies and index:
+                    continue
+                # A sentinel may be split between frames, the tail kept can't hold a whole one.
+                window = tails[index] + data
+                tails[index] = window[-overlap:]
+                replies = window.count(sentinel)
+                if not replies:
+                    continue
+                done = time.perf_counter()
+                queue = outstanding[index]
+                for _ in range(min(replies, len(queue))):
+                    due_at, name = queue.popleft()
+                    if due_at >= measured:
+                        completed += 1
+                        latencies.setdefault(name, []).append(done - due_at)
+        lost = sum(1 for queue in outstanding for due_at, _ in queue if due_at >= measured)
+        return LoadReport(
+            count, self.rate, self.duration, sent, completed, skipped, failed, lost, bytes_in, latencies
+        )
+
+
+def fields(value):
+    """Command line fields are colon separated, the protocol's are tab separated."""
+    return value.replace(":", "\t") if value else value
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m dashio.loadgen", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("device_id", help="The device the commands are for.")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--tcp", default="localhost:5000", help="A tcpConnection's HOST:PORT.")
+    target.add_argument("--zmq", help="A zmqConnection's HOST:PUB_PORT:SUB_PORT.")
+    parser.add_argument("-c", "--clients", type=int, default=10, help="Simulated dashboard clients.")
+    parser.add_argument("-r", "--rate", type=float, default=100.0, help="Requests per second from all clients.")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="Seconds measured.")
+    parser.add_argument("-w", "--warmup", type=float, default=1.0, help="Seconds sent before those measured.")
+    parser.add_argument("-m", "--mix", default="STATUS=10,CFG=1,WHO=1,CONNECT=1",
+                        help="Command weights, NAME=WEIGHT,... of " + ", ".join(COMMANDS) + ".")
+    parser.add_argument("--write", help="The control write for WRITE, TYPE:ID:VALUE, {value} is a random 0-100.")
+    parser.add_argument("--history", help="The control HISTORY requests, TYPE:ID, e.g. TGRPH:TG1.")
+    parser.add_argument("--history-seconds", type=float, default=3600.0, help="How far back HISTORY asks.")
+    parser.add_argument("--max-outstanding", type=int, default=100, help="Requests waiting per client.")
+    parser.add_argument("--seed", type=int, help="Seeds the command choice, for repeatable runs.")
+    parser.add_argument("--compress", action="store_true", help="TCP clients ask for compressed replies.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    mix = CommandMix(
+        args.device_id,
+        CommandMix.parse_weights(args.mix),
+        write=fields(args.write),
+        history=fields(args.history),
+        history_seconds=args.history_seconds,
+        seed=args.seed,
+    )
+    if args.zmq:
+        host, pub_port, sub_port = args.zmq.rsplit(":", 2)
+        clients = zmqLoadClients(
+            "tcp://{}:{}".format(host, pub_port), "tcp://{}:{}".format(host, sub_port), args.clients
+        )
+    else:
+        clients = tcpLoadClients("tcp://" + args.tcp, args.clients, compression=args.compress or None)
+    report = LoadGenerator(
+        clients, mix, args.rate, args.duration, warmup=args.warmup, max_outstanding=args.max_outstanding
+    ).run()
+    clients.close()
+    print(json.dumps(report.to_dict(), indent=2) if args.json else report.format())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import threading
+import shortuuid
+from collections import deque
+import zmq
+
+STOP = b"STOP"
+WAKE = b"WAKE"
+
+
+class LoopSignal:
+    """Wakes a thread blocked polling its sockets, so run loops can wait without a timeout while idle.
+
+    The loop registers socket in its poller and calls receive when it is readable. Any thread may call signal,
+    STOP asks the loop to exit and WAKE to look again at its timers. call runs a function on the loop's thread,
+    for work on sockets only that thread may touch.
+    """
+
+    def __init__(self, context):
+        """
+        Arguments:
+            context {zmq.Context} -- The context of the sockets the loop polls.
+        """
+        url = "inproc://SIGNAL_{}".format(shortuuid.uuid())
+        self.socket = context.socket(zmq.PULL)
+        self.socket.bind(url)
+        # One sending socket for every thread, zmq sockets aren't thread safe so it is used under the lock.
+        self._lock = threading.Lock()
+        self._sender = context.socket(zmq.PUSH)
+        self._sender.connect(url)
+        self._calls = deque()
+        self.stopped = False
+
+    def signal(self, command=WAKE):
+        with self._lock:
+            try:
+                self._sender.send(command, zmq.NOBLOCK)
+            except zmq.error.ZMQError:
+                # The queue only fills when the loop has signals it hasn't read, it'll wake for those.
+                pass
+
+    def stop(self):
+        self.signal(STOP)
+
+    def call(self, func, *args):
+        self._calls.append((func, args))
+        self.signal()
+
+    def receive(self):
+        """Read every waiting signal and make the calls, returns True when the loop should stop."""
+        while True:
+            try:
+                if self.socket.recv(zmq.NOBLOCK) == STOP:
+                    self.stopped = True
+            except zmq.error.Again:
+                break
+        self.run_calls()
+        return self.stopped
+
+    def run_calls(self):
+        while self._calls:
+            func, args = self._calls.popleft()
+            func(*args)
+
+    def close(self):
+        with self._lock:
+            self._sender.close(0)
+        self.socket.close(0)
@@ -0,0 +1,194 @@
+import bisect
+import logging
+import threading
+import weakref
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Latency histograms time one frame in SAMPLE_EVERY, counters count every frame.
+SAMPLE_EVERY = 16
+SAMPLE_MASK = SAMPLE_EVERY - 1
+
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+class Histogram:
+    """Counts observations into fixed buckets, Prometheus style."""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # One more than buckets, the last counts observations above the largest.
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        """Returns the cumulative count of observations at or below each bucket, then count and sum."""
+        cumulative = []
+        total = 0
+        for count in self.counts[:-1]:
+            total += count
+            cumulative.append(total)
+        return {"buckets": dict(zip(self.buckets, cumulative)), "count": self.count, "sum": self.sum}
+
+
+class ConnectionMetrics:
+    """Counters a connection keeps as plain attributes, its loop adds to them directly.
+
+    Each counter is only written by the connection's own thread, so they need no lock.
+    """
+
+    __slots__ = ("kind", "connection_id", "frames_in", "bytes_in", "frames_out", "bytes_out", "dropped",
+                 "reconnects", "__weakref__")
+
+    def __init__(self, kind, connection_id, registry=None):
+        self.kind = kind
+        self.connection_id = str(connection_id)
+        self.frames_in = 0
+        self.bytes_in = 0
+        self.frames_out = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        self.reconnects = 0
+        (registry or default_registry).add(self)
+
+    def samples(self):
+        labels = {"kind": self.kind, "connection": self.connection_id}
+        yield "dashio_connection_frames_in_total", "counter", labels, self.frames_in
+        yield "dashio_connection_bytes_in_total", "counter", labels, self.bytes_in
+        yield "dashio_connection_frames_out_total", "counter", labels, self.frames_out
+        yield "dashio_connection_bytes_out_total", "counter", labels, self.bytes_out
+        yield "dashio_connection_dropped_total", "counter", labels, self.dropped
+        yield "dashio_connection_reconnects_total", "counter", labels, self.reconnects
+
+
+class DeviceMetrics:
+    """Counters and latency histograms for a device.
+
+    commands counts the commands received by type, as bytes. handler_seconds times the control handlers of
+    sampled frames and reply_seconds the whole of a sampled frame from receipt until its reply is built.
+    update_seconds times sampled control updates from the setter until the frame is handed to the socket,
+    including any coalesce window.
+    """
+
+    __slots__ = ("device_id", "frames_in", "commands", "updates", "handler_seconds", "reply_seconds",
+                 "update_seconds", "__weakref__")
+
+    def __init__(self, device_id, registry=None):
+        self.device_id = device_id
+        self.frames_in = 0
+        self.commands = defaultdict(int)
+        self.updates = 0
+        self.handler_seconds = Histogram()
+        self.reply_seconds = Histogram()
+        self.update_seconds = Histogram()
+        (registry or default_registry).add(self)
+
+    def samples(self):
+        labels = {"device": self.device_id}
+        yield "dashio_device_frames_in_total", "counter", labels, self.frames_in
+        for command_type, count in list(self.commands.items()):
+            yield "dashio_device_commands_total", "counter", dict(labels, type=command_type.decode("utf-8", "replace")), count
+        yield "dashio_device_updates_total", "counter", labels, self.updates
+        yield "dashio_device_handler_seconds", "histogram", labels, self.handler_seconds.snapshot()
+        yield "dashio_device_reply_seconds", "histogram", labels, self.reply_seconds.snapshot()
+        yield "dashio_device_update_seconds", "histogram", labels, self.update_seconds.snapshot()
+
+
+class MetricsRegistry:
+    """Collects the metrics of every connection and device when asked, the pull API.
+
+    Metric groups are held weakly, those of objects that are gone drop out.
+    """
+
+    def __init__(self):
+        self._groups = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def add(self, group):
+        with self._lock:
+            self._groups.add(group)
+
+    def remove(self, group):
+        with self._lock:
+            self._groups.discard(group)
+
+    def collect(self):
+        """Returns {name: (kind, [(labels, value), ...])}, a histogram's value is a dict of buckets, count and sum."""
+        with self._lock:
+            groups = list(self._groups)
+        metrics = {}
+        for group in groups:
+            for name, kind, labels, value in group.samples():
+                metrics.setdefault(name, (kind, []))[1].append((labels, value))
+        return metrics
+
+    def prometheus_text(self):
+        """Returns the metrics in the Prometheus text exposition format."""
+        lines = []
+        for name, (kind, samples) in sorted(self.collect().items()):
+            lines.append("# TYPE {} {}".format(name, kind))
+            for labels, value in samples:
+                if kind == "histogram":
+                    for bound, count in value["buckets"].items():
+                        lines.append(_sample_line(name + "_bucket", dict(labels, le=repr(bound)), count))
+                    lines.append(_sample_line(name + "_bucket", dict(labels, le="+Inf"), value["count"]))
+                    lines.append(_sample_line(name + "_count", labels, value["count"]))
+                    lines.append(_sample_line(name + "_sum", labels, value["sum"]))
+                else:
+                    lines.append(_sample_line(name, labels, value))
+        return "\n".join(lines) + "\n"
+
+
+def _sample_line(name, labels, value):
+    label_text = ",".join(
+        '{}="{}"'.format(key, str(label).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, label in labels.items()
+    )
+    return "{}{{{}}} {}".format(name, label_text, value)
+
+
+default_registry = MetricsRegistry()
+
+
+class MetricsServer(threading.Thread):
+    """Serves a registry's metrics as Prometheus text over HTTP, at any path."""
+
+    def __init__(self, port=9464, host="127.0.0.1", registry=None):
+        """
+        Keyword Arguments:
+            port {int} -- The port to listen on. (default: {9464})
+            host {str} -- The interface to listen on, by default only this machine. (default: {"127.0.0.1"})
+            registry {MetricsRegistry} -- The registry served. (default: {the default registry})
+        """
+        threading.Thread.__init__(self, daemon=True)
+        registry = registry or default_registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("Metrics: " + format, *args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run(self):
+        self.server.serve_forever()
@@ -4,6 +4,12 @@ import ssl
 import logging
 import zmq
 import uuid
+
+from .loopsignal import LoopSignal
+from .compression import take_compress_request
+from .metrics import ConnectionMetrics
+from .mqttpublisher import MqttPublisher
+from .segmentqueue import SegmentQueue
 # TODO: Add documentation
 
 
@@ -12,14 +18,44 @@ class mqttConnection(threading.Thread):
 
     def __on_connect(self, client, userdata, flags, rc):
         logging.debug("rc: %s", str(rc))
+        if rc == 0:
+            if self._connected_before:
+                self.metrics.reconnects += 1
+            self._connected_before = True
+            # The broker forgets subscriptions with the session, they are made again on every connect.
+            for control_topic in self._control_topics:
+                self.mqttc.subscribe(control_topic, 0)
+            self.publisher.on_connect()
+            # Wakes the loop to drain what was stored while disconnected.
+            self.loop_signal.signal()
+
+    def __on_disconnect(self, client, userdata, rc):
+        logging.info("MQTT connection %s disconnected, rc: %s", self.connection_id, str(rc))
+        self.publisher.on_disconnect()
 
     def __on_message(self, client, obj, msg):
-        data = str(msg.payload, "utf-8").strip()
-        logging.debug("DASH RX: %s", data)
-        self.tx_zmq_pub.send_multipart([self.b_connection_id, b'1', msg.payload])
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("DASH RX: %s", str(msg.payload, "utf-8", "replace").strip())
+        self.metrics.frames_in += 1
+        self.metrics.bytes_in += len(msg.payload)
+        commands, modes = take_compress_request(msg.payload)
+        if modes is not None:
+            # Asked of the connection for the device's data topic, the publisher belongs to the loop's thread.
+            self.loop_signal.call(self.publisher.compress_request, msg.topic.rsplit("/", 1)[0] + "/data", modes)
+        if commands:
+            self.tx_zmq_pub.send_multipart([self.b_connection_id, b'1', commands])
+
+    def __data_topic(self, b_device_id):
+        # Topics are built once per device and looked up by the device ID bytes of each frame.
+        try:
+            return self._data_topics[b_device_id]
+        except KeyError:
+            topic = "{}/{}/data".format(self.username, b_device_id.decode('utf-8').strip())
+            self._data_topics[b_device_id] = topic
+            return topic
 
     def __on_publish(self, client, obj, mid):
-        pass
+        self.publisher.on_publish(mid)
 
     def __on_subscribe(self, client, obj, mid, granted_qos):
         logging.debug("Subscribed: %s %s", str(mid), str(granted_qos))
@@ -28,13 +64,36 @@ class mqttConnection(threading.Thread):
         logging.debug(string)
 
     def add_device(self, device):
-        device.add_connection(self.connection_id)
+        device.add_connection(self.connection_id.hex)
         control_topic = "{}/{}/control".format(self.username, device.device_id)
-        self.dash_c.subscribe(control_topic, 0)
-
-    def __init__(self, device_id, host, port, username="", password="", use_ssl=False, context=None):
+        self._control_topics.append(control_topic)
+        self.mqttc.subscribe(control_topic, 0)
+
+    def __init__(
+        self,
+        device_id,
+        host,
+        port,
+        username="",
+        password="",
+        use_ssl=False,
+        context=None,
+        publish_window=0.0,
+        max_payload=16384,
+        max_inflight=20,
+        max_queued=1000,
+        max_rate=None,
+        compression=False,
+        compress_threshold=1024,
+        reconnect_min_delay=1,
+        reconnect_max_delay=120,
+        queue_path=None,
+        queue_max_bytes=16 * 1024 * 1024,
+        drain_rate=10.0,
+    ):
         """
         Arguments:
+            device_id {str} -- The device whose data topic carries the connection's will.
             host {str} -- The server name of the mqtt host.
             port {int} -- Port number to connect to.
             username {str} -- username for the mqtt connection.
@@ -42,23 +101,61 @@ class mqttConnection(threading.Thread):
 
         Keyword Arguments:
             use_ssl {bool} -- Whether to use ssl for the connection or not. (default: {False})
+            publish_window {float} -- Seconds frames wait to be joined with others to the same topic, 0 joins
+                only those already waiting. (default: {0.0})
+            max_payload {int} -- The most bytes of frames joined in one message. (default: {16384})
+            max_inflight {int} -- The most alarms waiting for acknowledgement, they are sent at QoS 1.
+                (default: {20})
+            max_queued {int} -- The most messages held by paho, unwritten or unacknowledged. (default: {1000})
+            max_rate {float} -- The most messages published per second, None for no limit. (default: {None})
+            compression {bool} -- Whether a dashboard asking for a device's data to be compressed gets it.
+                Every dashboard reading the device then gets its large messages compressed. (default: {False})
+            compress_threshold {int} -- The smallest message compressed. (default: {1024})
+            reconnect_min_delay {float} -- Seconds before the first try to reconnect, doubled for each that
+                fails. (default: {1})
+            reconnect_max_delay {float} -- The most seconds between tries to reconnect. (default: {120})
+            queue_path {str} -- A directory of its own to keep frames in while disconnected, alarms and
+                event log entries included. None drops them. (default: {None})
+            queue_max_bytes {int} -- The most bytes kept in queue_path, the oldest frames are dropped past
+                it. (default: {16 MiB})
+            drain_rate {float} -- The most messages a second published from queue_path once reconnected.
+                (default: {10.0})
         """
 
         threading.Thread.__init__(self, daemon=True)
 
         self.context = context or zmq.Context.instance()
+        self.loop_signal = LoopSignal(self.context)
 
         self.connection_id = uuid.uuid4()
-        self.b_connection_id = self.connection_id.bytes
+        self.b_connection_id = self.connection_id.hex.encode('utf-8')
+        self.metrics = ConnectionMetrics("mqtt", self.connection_id.hex)
+        self._connected_before = False
+        self._control_topics = []
 
         self.LWD = "OFFLINE"
         self.running = True
         self.username = username
+        self._data_topics = {}
         self.mqttc = mqtt.Client()
+        self.publisher = MqttPublisher(
+            self.mqttc,
+            self.metrics,
+            window=publish_window,
+            max_payload=max_payload,
+            max_inflight=max_inflight,
+            max_queued=max_queued,
+            max_rate=max_rate,
+            compression=compression,
+            compress_threshold=compress_threshold,
+            store=SegmentQueue(queue_path, queue_max_bytes) if queue_path else None,
+            drain_rate=drain_rate,
+        )
 
         # Assign event callbacks
         self.mqttc.on_message = self.__on_message
         self.mqttc.on_connect = self.__on_connect
+        self.mqttc.on_disconnect = self.__on_disconnect
         self.mqttc.on_publish = self.__on_publish
         self.mqttc.on_subscribe = self.__on_subscribe
 
@@ -74,23 +171,29 @@ class mqttConnection(threading.Thread):
             self.mqttc.tls_insecure_set(False)
 
         self.mqttc.on_log = self.__on_log
-        self.mqttc.will_set(self.data_topic, self.LWD, qos=1, retain=False)
+        self.mqttc.will_set("{}/{}/data".format(username, device_id), self.LWD, qos=1, retain=False)
         # Connect
         if username and password:
             self.mqttc.username_pw_set(username, password)
-        self.mqttc.connect(host, port)
+        # paho's thread connects, and reconnects whenever the connection drops, waiting longer after each
+        # failure up to reconnect_max_delay.
+        self.mqttc.reconnect_delay_set(reconnect_min_delay, reconnect_max_delay)
+        self.mqttc.connect_async(host, port)
+        # Commands are sent on from paho's thread, so the socket is ready before that starts.
+        self.tx_zmq_pub = self.context.socket(zmq.PUB)
+        self.tx_zmq_pub.bind("inproc://TX_{}".format(self.connection_id.hex))
         # Start subscribe, with QoS level 0
         self.start()
 
+    def close(self):
+        self.running = False
+        self.loop_signal.stop()
+
     def run(self):
         self.mqttc.loop_start()
 
-        tx_url_internal = "inproc://TX_{}".format(self.connection_id.hex)
         rx_url_internal = "inproc://RX_{}".format(self.connection_id.hex)
 
-        self.tx_zmq_pub = self.context.socket(zmq.PUB)
-        self.tx_zmq_pub.bind(tx_url_internal)
-
         rx_zmq_sub = self.context.socket(zmq.SUB)
         rx_zmq_sub.bind(rx_url_internal)
 
@@ -101,20 +204,31 @@ class mqttConnection(threading.Thread):
 
         poller = zmq.Poller()
         poller.register(rx_zmq_sub, zmq.POLLIN)
+        poller.register(self.loop_signal.socket, zmq.POLLIN)
 
         while self.running:
             try:
-                socks = dict(poller.poll(50))
+                socks = dict(poller.poll(self.publisher.timeout()))
             except zmq.error.ContextTerminated:
                 break
+            if self.loop_signal.socket in socks and self.loop_signal.receive():
+                break
             if rx_zmq_sub in socks:
-                [address, id, data] = rx_zmq_sub.recv_multipart()
-                msg_l = data.split(b'\t')
-                device_id = msg_l[1].decode('utf-8').strip()
-                logging.debug("%s TX: %s", self.b_connection_id.decode('utf-8'), data.decode('utf-8').rstrip())
-                data_topic = "{}/{}/data".format(self.username, device_id)
-                self.mqttc.publish(data_topic, data)
-
+                # Every frame waiting is taken so those to the same topic can be published together.
+                while True:
+                    try:
+                        [address, id, data] = rx_zmq_sub.recv_multipart(zmq.NOBLOCK)
+                    except zmq.error.Again:
+                        break
+                    if logging.root.isEnabledFor(logging.DEBUG):
+                        logging.debug("%s TX: %s", self.connection_id.hex, data.decode('utf-8', 'replace').rstrip())
+                    self.publisher.add(self.__data_topic(data.split(b'\t', 2)[1]), data, address == b'ALARM')
+            self.publisher.flush()
+
+        self.publisher.flush(force=True)
+        if self.publisher.store is not None:
+            self.publisher.store.close()
         self.mqttc.loop_stop()
         self.tx_zmq_pub.close()
         rx_zmq_sub.close()
+        self.loop_signal.close()
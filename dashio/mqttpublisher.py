@@ -0,0 +1,285 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+from .compression import MODES, FrameCompressor, choose_mode, compress_reply
+
+# How soon to look again while held back by messages paho hasn't written yet, its callbacks don't wake the loop.
+BACKOFF = 0.005
+
+
+class MqttPublisher:
+    """Publishes a connection's frames to MQTT in as few messages as it can, brokers throttle on message rate.
+
+    Frames are queued by topic and each topic's frames go out joined into one message, up to max_payload
+    bytes, when the window closes. A window of 0 publishes at every flush, joining the frames that arrived
+    together. Alarms are published at once at alarm_qos, paho holds those it can't send, max_inflight
+    unacknowledged and max_queued in all. Frames are held back, and keep joining, while max_queued messages
+    are not yet written to the socket or max_rate would be exceeded.
+
+    With compression a topic a dashboard asked to have compressed has its messages of compress_threshold
+    bytes or more compressed once joined. Alarms are left plain, they may be passed on to notifications.
+
+    With a store, a SegmentQueue, frames are kept in it while the client isn't connected, alarms too. Once
+    connected they are drained, joined by topic, at drain_rate messages a second and at most max_inflight
+    unacknowledged. Frames arriving meanwhile join the end of the store, so everything goes in order. Drained
+    messages are published at QoS 1, so paho sends them again if the connection drops before they are
+    acknowledged, and are consumed from the store once they and those drained before them are.
+
+    The connection's loop calls add and flush and waits at most timeout before the next flush. Its paho
+    client's on_publish, on_connect and on_disconnect callbacks call those of the publisher, and on_connect
+    should wake the loop to drain the store.
+    """
+
+    def __init__(self, client, metrics, window=0.0, max_payload=16384, max_inflight=20, max_queued=1000,
+                 alarm_qos=1, max_rate=None, compression=False, compress_threshold=1024, store=None,
+                 drain_rate=10.0):
+        """
+        Arguments:
+            client {mqtt.Client} -- The paho client published with.
+            metrics {ConnectionMetrics} -- The connection's metrics, frames_out, bytes_out and dropped are
+                counted here.
+
+        Keyword Arguments:
+            window {float} -- Seconds frames wait for others to the same topic. (default: {0.0})
+            max_payload {int} -- The most bytes of frames joined in one message. (default: {16384})
+            max_inflight {int} -- The most QoS 1 messages waiting for acknowledgement. (default: {20})
+            max_queued {int} -- The most messages paho holds, unwritten or unacknowledged. (default: {1000})
+            alarm_qos {int} -- The QoS alarms are published at. (default: {1})
+            max_rate {float} -- The most messages published per second, None for no limit. (default: {None})
+            compression {bool} -- Whether topics may be compressed when a dashboard asks. (default: {False})
+            compress_threshold {int} -- The smallest message compressed. (default: {1024})
+            store {SegmentQueue} -- Keeps frames while disconnected, None drops them. (default: {None})
+            drain_rate {float} -- The most messages a second drained from the store. (default: {10.0})
+        """
+        self.client = client
+        self.metrics = metrics
+        self.window = window
+        self.max_payload = max_payload
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.alarm_qos = alarm_qos
+        self.max_rate = max_rate
+        client.max_inflight_messages_set(max_inflight)
+        client.max_queued_messages_set(max_queued)
+        # Frames by topic, in the order topics first had one pending.
+        self._pending = {}
+        self.pending_frames = 0
+        self._deadline = None
+        self._held = False
+        self.messages_out = 0
+        # Message IDs paho hasn't reported published, QoS 0 until written and QoS 1 until acknowledged.
+        self._lock = threading.Lock()
+        self._unsent = set()
+        self._unacked = set()
+        # paho's thread may write a message and report it before publish has returned its ID.
+        self._reported = set()
+        self._tokens = max_rate or 0.0
+        self._refilled = time.monotonic()
+        self.compressors = {}
+        if compression:
+            self.compressors = {mode: FrameCompressor(mode, compress_threshold) for mode in MODES}
+        # The compressor of each topic a dashboard asked to have compressed.
+        self._compressed_topics = {}
+        self.store = store
+        self.drain_rate = drain_rate
+        self.connected = False
+        self._drain_tokens = 1.0
+        self._drain_refilled = time.monotonic()
+        # Batches drained from the store as (message ID, batch), in the order published.
+        self._draining = deque()
+
+    @property
+    def queue_depth(self):
+        """Frames waiting to be published, stored included, plus messages paho hasn't written or had
+        acknowledged."""
+        stored = self.store.pending if self.store is not None else 0
+        with self._lock:
+            return self.pending_frames + stored + len(self._unsent) + len(self._unacked)
+
+    def add(self, topic, data, alarm=False):
+        """Queue data, a frame of one or more lines, for topic. An alarm is published at once."""
+        if alarm:
+            if self.store is not None and not self.connected:
+                self.__store(topic, data, True)
+            elif self.__publish(topic, data, 1, self.alarm_qos) is None:
+                self.metrics.dropped += 1
+            return
+        frames = self._pending.get(topic)
+        if frames is None:
+            self._pending[topic] = [data]
+        else:
+            frames.append(data)
+        self.pending_frames += 1
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self.window
+
+    def compress_request(self, topic, modes):
+        """Compress topic in the first of modes accepted, or stop compressing it, and queue the reply to topic.
+
+        Every dashboard reading topic gets what it is published, so the mode applies to them all.
+        """
+        mode = choose_mode(modes, self.compressors)
+        if mode is None:
+            self._compressed_topics.pop(topic, None)
+        else:
+            self._compressed_topics[topic] = self.compressors[mode]
+        logging.debug("MQTT topic %s compression %s", topic, mode)
+        self.add(topic, compress_reply(mode))
+
+    def timeout(self):
+        """Milliseconds until flush has work, for the loop's poll, None when nothing is pending."""
+        if self.store is not None and self.store.pending:
+            # Frames are stored as they are flushed, only draining waits.
+            return int(max(BACKOFF, 1.0 / self.drain_rate) * 1000) if self.connected else None
+        if not self.pending_frames:
+            return None
+        now = time.monotonic()
+        wait = self._deadline - now
+        if self._held:
+            wait = max(wait, BACKOFF)
+        return max(0, int(wait * 1000) + 1) if wait > 0 else 0
+
+    def flush(self, force=False):
+        """Publish the pending frames once the window has closed, all of them when force is True."""
+        store = self.store
+        if store is not None and (store.pending or not self.connected):
+            if self.pending_frames:
+                for topic, frames in self._pending.items():
+                    for data in frames:
+                        self.__store(topic, data, False)
+                self._pending.clear()
+                self.pending_frames = 0
+                self._deadline = None
+            self.__consume_delivered()
+            if self.connected:
+                self.__drain()
+            return
+        if not self.pending_frames:
+            return
+        now = time.monotonic()
+        if now < self._deadline and not force:
+            return
+        self._held = False
+        while self._pending:
+            if not force and not self.__can_publish(now):
+                # Those held keep joining with new frames, so the next publish carries more.
+                self._held = True
+                self._deadline = now
+                return
+            topic = next(iter(self._pending))
+            frames = self._pending[topic]
+            payload, count = self.__join(frames)
+            del frames[:count]
+            if not frames:
+                del self._pending[topic]
+            self.pending_frames -= count
+            compressor = self._compressed_topics.get(topic)
+            if compressor is not None:
+                payload = compressor.compress(payload)
+            if self.__publish(topic, payload, count, 0) is None:
+                self.metrics.dropped += count
+        self._deadline = None
+
+    def __store(self, topic, data, alarm):
+        dropped = self.store.dropped
+        self.store.append(topic, data, alarm)
+        self.metrics.dropped += self.store.dropped - dropped
+
+    def __drain(self):
+        store = self.store
+        now = time.monotonic()
+        self._drain_tokens = min(1.0, self._drain_tokens + (now - self._drain_refilled) * self.drain_rate)
+        self._drain_refilled = now
+        while store.pending and self._drain_tokens >= 1.0 and self.__can_publish(now):
+            with self._lock:
+                if len(self._unacked) >= self.max_inflight:
+                    return
+            batch = store.peek(self.max_payload)
+            if not batch:
+                return
+            topic = batch[0][1]
+            alarm = batch[0][3]
+            payload = batch[0][2] if len(batch) == 1 else b"".join(entry[2] for entry in batch)
+            compressor = None if alarm else self._compressed_topics.get(topic)
+            if compressor is not None:
+                payload = compressor.compress(payload)
+            mid = self.__publish(topic, payload, len(batch), 1)
+            if mid is None:
+                return
+            self._drain_tokens -= 1.0
+            store.take(batch)
+            self._draining.append((mid, batch))
+
+    def __consume_delivered(self):
+        # The cursor only passes a batch once the broker has acknowledged it, on_publish's thread leaves it to
+        # the loop's, which the store belongs to.
+        draining = self._draining
+        while draining:
+            mid, batch = draining[0]
+            with self._lock:
+                if mid in self._unacked:
+                    return
+            draining.popleft()
+            self.store.consume(batch)
+
+    def __join(self, frames):
+        # The first frame always goes, even when larger than max_payload.
+        size = len(frames[0])
+        count = 1
+        while count < len(frames) and size + len(frames[count]) <= self.max_payload:
+            size += len(frames[count])
+            count += 1
+        if count == 1:
+            return frames[0], 1
+        return b"".join(frames[:count]), count
+
+    def __can_publish(self, now):
+        with self._lock:
+            if len(self._unsent) >= self.max_queued:
+                return False
+        if self.max_rate is None:
+            return True
+        self._tokens = min(self.max_rate, self._tokens + (now - self._refilled) * self.max_rate)
+        self._refilled = now
+        return self._tokens >= 1.0
+
+    def __publish(self, topic, payload, frames, qos):
+        if self.max_rate is not None:
+            # Alarms aren't held back, they take their token regardless.
+            self._tokens -= 1.0
+        info = self.client.publish(topic, payload, qos)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS or (qos and info.rc == mqtt.MQTT_ERR_NO_CONN):
+            # paho keeps QoS 1 messages published while disconnected and sends them when it reconnects.
+            with self._lock:
+                if info.mid in self._reported:
+                    self._reported.discard(info.mid)
+                else:
+                    (self._unacked if qos else self._unsent).add(info.mid)
+            self.messages_out += 1
+            self.metrics.frames_out += frames
+            self.metrics.bytes_out += len(payload)
+            return info.mid
+        return None
+
+    def on_publish(self, mid):
+        with self._lock:
+            if mid in self._unsent:
+                self._unsent.discard(mid)
+            elif mid in self._unacked:
+                self._unacked.discard(mid)
+            else:
+                self._reported.add(mid)
+
+    def on_connect(self):
+        self.connected = True
+        # QoS 0 messages unwritten when the connection dropped went with it.
+        with self._lock:
+            self._unsent.clear()
+            self._reported.clear()
+
+    def on_disconnect(self):
+        self.connected = False
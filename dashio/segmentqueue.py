@@ -0,0 +1,288 @@
+import logging
+import os
+import struct
+import zlib
+from collections import deque
+from itertools import islice
+
+# A record is its header, the topic and the frame. The CRC covers everything after the CRC and length, so a
+# record torn by a crash is found when loading and the segment is cut short there.
+RECORD = struct.Struct(">IIQBH")
+# The part of a record's header its length doesn't count.
+RECORD_PREFIX = 8
+ALARM_FLAG = 1
+SEGMENT_SUFFIX = ".seg"
+CURSOR_FILE = "cursor"
+
+# Frames of these types add to what a dashboard shows rather than replacing it, so they are never collapsed.
+EVENT_TYPES = frozenset((b"TGRPH", b"LOG", b"MAP", b"ALM"))
+
+
+def collapse_key(topic, data):
+    """The key a state-only frame is collapsed by, its topic, device, control type and ID. None for others."""
+    if data.count(b"\n") != 1:
+        return None
+    fields = data.split(b"\t", 4)
+    if len(fields) < 5 or fields[2] in EVENT_TYPES:
+        return None
+    return topic, fields[1], fields[2], fields[3]
+
+
+class SegmentQueue:
+    """Frames waiting to be published, kept in append-only segment files so they outlast the connection and
+    the process.
+
+    Frames are appended to the newest segment, a new one is started every segment_bytes. A frame that only
+    sets a control's state replaces the one waiting for the same control, the older stays on disk but isn't
+    sent. Frames are taken from the front with peek and take, and removed with consume once delivered, the
+    last consumed is kept in a cursor file and segments wholly consumed are deleted. Frames are sent at least
+    once, those taken but not consumed are sent again after a crash.
+
+    When the segments grow past max_bytes the frames still waiting are written to new segments and the old
+    deleted, the oldest frames are dropped while they'd fill more than three quarters of max_bytes.
+
+    Not thread safe, it belongs to the thread of the connection publishing it. The path is its own directory,
+    one per connection.
+    """
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024, segment_bytes=1024 * 1024, sync=False):
+        """
+        Arguments:
+            path {str} -- The directory the segments are kept in, made if it doesn't exist.
+
+        Keyword Arguments:
+            max_bytes {int} -- The most bytes of segments kept. (default: {16 MiB})
+            segment_bytes {int} -- The size a segment is closed at. (default: {1 MiB})
+            sync {bool} -- Whether each frame is fsync'd to disk, rather than left to the OS. (default: {False})
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.sync = sync
+        os.makedirs(path, exist_ok=True)
+        # Waiting frames as [seq, topic, data, alarm, key], data is None once a newer frame replaced it.
+        self.entries = deque()
+        self.keys = {}
+        self.pending = 0
+        self.collapsed = 0
+        self.dropped = 0
+        # Segment files as [number, size, last seq], oldest first. Only the last is appended to.
+        self.segments = deque()
+        self.bytes = 0
+        self.cursor = 0
+        # Entries at the front of entries taken but not yet consumed, those replaced included.
+        self.taken = 0
+        self._seq = 0
+        self._next_segment = 0
+        self._file = None
+        self.__load()
+
+    def __len__(self):
+        return self.pending
+
+    def __segment_path(self, number):
+        return os.path.join(self.path, "{:016d}{}".format(number, SEGMENT_SUFFIX))
+
+    def __load(self):
+        cursor_path = os.path.join(self.path, CURSOR_FILE)
+        if os.path.exists(cursor_path):
+            with open(cursor_path) as cursor_file:
+                self.cursor = int(cursor_file.read() or 0)
+        numbers = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.path)
+                         if name.endswith(SEGMENT_SUFFIX))
+        # A crash while compacting leaves frames in both the old and new segments, they are kept once.
+        records = {}
+        for number in numbers:
+            segment_path = self.__segment_path(number)
+            with open(segment_path, "rb") as segment:
+                buffer = segment.read()
+            offset = 0
+            last = 0
+            while offset + RECORD.size <= len(buffer):
+                crc, length, seq, flags, topic_length = RECORD.unpack_from(buffer, offset)
+                end = offset + RECORD_PREFIX + length
+                if end > len(buffer) or zlib.crc32(buffer[offset + RECORD_PREFIX:end]) != crc:
+                    break
+                if seq > self.cursor:
+                    start = offset + RECORD.size
+                    topic = buffer[start:start + topic_length].decode("utf-8")
+                    records[seq] = (topic, buffer[start + topic_length:end], bool(flags & ALARM_FLAG))
+                last = max(last, seq)
+                offset = end
+            if offset < len(buffer):
+                logging.warning("Outbound queue %s: cut torn segment %d at %d of %d bytes",
+                                self.path, number, offset, len(buffer))
+                with open(segment_path, "r+b") as segment:
+                    segment.truncate(offset)
+            self._seq = max(self._seq, last)
+            self._next_segment = number + 1
+            if last <= self.cursor:
+                os.remove(segment_path)
+                continue
+            self.segments.append([number, offset, last])
+            self.bytes += offset
+        self._seq = max(self._seq, self.cursor)
+        for seq in sorted(records):
+            self.__add(seq, *records[seq])
+        if self.pending:
+            logging.info("Outbound queue %s: %d frames waiting from before", self.path, self.pending)
+
+    def __add(self, seq, topic, data, alarm):
+        key = None if alarm else collapse_key(topic, data)
+        if key is not None:
+            replaced = self.keys.get(key)
+            if replaced is not None:
+                replaced[2] = None
+                self.pending -= 1
+                self.collapsed += 1
+        entry = [seq, topic, data, alarm, key]
+        self.entries.append(entry)
+        if key is not None:
+            self.keys[key] = entry
+        self.pending += 1
+
+    def __encode(self, seq, topic, data, alarm):
+        topic = topic.encode("utf-8")
+        body = struct.pack(">QBH", seq, ALARM_FLAG if alarm else 0, len(topic)) + topic + data
+        return struct.pack(">II", zlib.crc32(body), len(body)) + body
+
+    def __write(self, record, seq):
+        if self._file is None or self.segments[-1][1] >= self.segment_bytes:
+            if self._file is not None:
+                self._file.close()
+            number = self._next_segment
+            self._next_segment += 1
+            self._file = open(self.__segment_path(number), "ab")
+            self.segments.append([number, 0, 0])
+        self._file.write(record)
+        self._file.flush()
+        if self.sync:
+            os.fsync(self._file.fileno())
+        segment = self.segments[-1]
+        segment[1] += len(record)
+        segment[2] = seq
+        self.bytes += len(record)
+
+    def append(self, topic, data, alarm=False):
+        """Queue data, a frame of one or more lines, for topic behind those waiting."""
+        self._seq += 1
+        self.__write(self.__encode(self._seq, topic, data, alarm), self._seq)
+        self.__add(self._seq, topic, data, alarm)
+        if self.bytes > self.max_bytes:
+            self.__compact()
+
+    def peek(self, max_bytes):
+        """Returns the entries following those taken to publish as one message, [seq, topic, data, alarm, key]
+        each, or an empty list.
+
+        Those following the first for the same topic are included up to max_bytes of data. An alarm goes alone.
+        """
+        entries = self.entries
+        if not self.taken:
+            while entries and entries[0][2] is None:
+                entries.popleft()
+        following = islice(entries, self.taken, None)
+        for first in following:
+            if first[2] is not None:
+                break
+        else:
+            return []
+        batch = [first]
+        if first[3]:
+            return batch
+        size = len(first[2])
+        for entry in following:
+            if entry[2] is None:
+                continue
+            if entry[3] or entry[1] != first[1] or size + len(entry[2]) > max_bytes:
+                break
+            batch.append(entry)
+            size += len(entry[2])
+        return batch
+
+    def take(self, batch):
+        """Mark the entries of batch, from peek, as published, the next peek follows them."""
+        last = batch[-1][0]
+        for entry in islice(self.entries, self.taken, None):
+            if entry[0] > last:
+                break
+            self.taken += 1
+
+    def consume(self, batch):
+        """Remove the entries of batch, taken earlier, once delivered. Batches are consumed in the order taken."""
+        last = batch[-1][0]
+        entries = self.entries
+        while entries and entries[0][0] <= last:
+            self.taken = max(self.taken - 1, 0)
+            entry = entries.popleft()
+            if entry[2] is not None:
+                self.pending -= 1
+                if entry[4] is not None and self.keys.get(entry[4]) is entry:
+                    del self.keys[entry[4]]
+        self.cursor = last
+        self.__write_cursor()
+        segments = self.segments
+        while segments and segments[0][2] <= last:
+            if len(segments) == 1:
+                if entries:
+                    break
+                # Everything is sent, the next frame starts a new segment.
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+            number, size, _ = segments.popleft()
+            self.bytes -= size
+            os.remove(self.__segment_path(number))
+
+    def __write_cursor(self):
+        cursor_path = os.path.join(self.path, CURSOR_FILE)
+        with open(cursor_path + ".tmp", "w") as cursor_file:
+            cursor_file.write(str(self.cursor))
+            if self.sync:
+                cursor_file.flush()
+                os.fsync(cursor_file.fileno())
+        os.replace(cursor_path + ".tmp", cursor_path)
+
+    def __compact(self):
+        # Rewrite the frames still waiting into new segments, without those replaced and those dropped.
+        taken = self.entries[self.taken - 1][0] if self.taken else 0
+        records = [(entry, self.__encode(*entry[:4])) for entry in self.entries if entry[2] is not None]
+        size = sum(len(record) for _, record in records)
+        target = self.max_bytes * 3 // 4
+        drop = 0
+        while drop < len(records) and size > target:
+            entry, record = records[drop]
+            size -= len(record)
+            entry[2] = None
+            if entry[4] is not None and self.keys.get(entry[4]) is entry:
+                del self.keys[entry[4]]
+            drop += 1
+        if drop:
+            logging.warning("Outbound queue %s full, dropped the %d oldest frames", self.path, drop)
+            self.pending -= drop
+            self.dropped += drop
+        old = self.segments
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self.segments = deque()
+        self.bytes = 0
+        self.entries = deque()
+        self.taken = 0
+        for entry, record in records[drop:]:
+            self.__write(record, entry[0])
+            self.entries.append(entry)
+            if entry[0] <= taken:
+                self.taken += 1
+        # The new segments are on disk before the old go, a crash between leaves both and loading keeps one.
+        if not self.sync:
+            for number, _, _ in self.segments:
+                with open(self.__segment_path(number), "rb") as segment:
+                    os.fsync(segment.fileno())
+        for number, _, _ in old:
+            os.remove(self.__segment_path(number))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -3,62 +3,158 @@ import threading
 import logging
 import time
 
-
-class tcpClientThread(threading.Thread):
-    """Setups and manages a client thread via TCP."""
-
-    def __on_message(self, data):
-        pass
-
-    def _zmq_send(self, id, data):
-        logging.debug("TX: " + data.rstrip())
+from .compression import COMPRESS_COMMAND, MODES, FrameReader
+from .iotcontrol.event import Event
+from .loopsignal import LoopSignal
+
+
+class tcpClients:
+    """Client connections to a tcpConnection, as many as wanted on one zmq STREAM socket.
+
+    Each client is its own TCP connection, given the routing ID b"client<n>" so replies are known by the
+    index of the client they came to. Not thread safe, the socket belongs to the thread using it.
+
+    With compression each client asks for it as it connects, the mode agreed is kept in modes. Compressed
+    frames are inflated as they are received.
+    """
+
+    def __init__(self, url="tcp://localhost:5000", clients=1, context=None, compression=None):
+        """
+        Keyword Arguments:
+            url {str} -- The tcpConnection's address. (default: {"tcp://localhost:5000"})
+            clients {int} -- The number of client connections. (default: {1})
+            context {zmq.Context} -- The context for the socket. (default: {zmq.Context.instance()})
+            compression {list} -- The compression modes to ask for, most preferred first, True for all
+                those known. None for none. (default: {None})
+        """
+        self.url = url
+        self.context = context or zmq.Context.instance()
+        self.socket = self.context.socket(zmq.STREAM)
+        # Sends never wait, a client whose connection is down or backed up loses the data.
+        self.socket.setsockopt(zmq.SNDTIMEO, 0)
+        self.ids = [b"client%d" % n for n in range(clients)]
+        self.index = {id: n for n, id in enumerate(self.ids)}
+        self.connected = [False] * clients
+        if compression is True:
+            compression = MODES
+        self.compression = compression
+        self.modes = [None] * clients
+        self.readers = [FrameReader() for _ in range(clients)]
+        for id in self.ids:
+            self.socket.setsockopt(zmq.CONNECT_ROUTING_ID, id)
+            self.socket.connect(url)
+
+    def wait_connected(self, timeout=10.0):
+        """Receive until every client is connected, returns False when timeout passes first."""
+        deadline = time.monotonic() + timeout
+        while not all(self.connected):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.socket.poll(int(remaining * 1000)):
+                return False
+            self.receive()
+        return True
+
+    def send(self, index, data):
+        """Send data, str or bytes, to the tcpConnection from client index. Returns False when it can't be sent."""
+        if isinstance(data, str):
+            data = data.encode("utf-8")
         try:
-            self.socket.send(id, zmq.SNDMORE)
-            self.socket.send_string(data, zmq.NOBLOCK)
+            self.socket.send(self.ids[index], zmq.SNDMORE)
+            self.socket.send(data, zmq.NOBLOCK)
         except zmq.error.ZMQError:
-            logging.debug("Sending TX Error.")
-        time.sleep(0.1)
-
-    def send_data(self, data):
-        self._zmq_send(self.id, data)
+            logging.debug("TCP client %d TX error.", index)
+            return False
+        return True
+
+    def receive(self):
+        """Returns (index, data) for a frame waiting on the socket, or None for a connect or disconnect, or
+        when only part of a compressed frame has arrived.
+
+        zmq reconnects a client that is disconnected, connected tracks which are up.
+        """
+        id, data = self.socket.recv_multipart()
+        index = self.index[id]
+        if not data:
+            self.connected[index] = not self.connected[index]
+            logging.debug("TCP client %d %s", index, "connected" if self.connected[index] else "disconnected")
+            # A new connection starts uncompressed.
+            self.modes[index] = None
+            self.readers[index] = FrameReader()
+            if self.connected[index] and self.compression:
+                self.send(index, COMPRESS_COMMAND + "\t".join(self.compression).encode("utf-8") + b"\n")
+            return None
+        data = self.readers[index].feed(data)
+        if not data:
+            return None
+        if COMPRESS_COMMAND in data:
+            for line in data.split(b"\n"):
+                if line.startswith(COMPRESS_COMMAND):
+                    mode = line[len(COMPRESS_COMMAND):].decode("utf-8")
+                    self.modes[index] = None if mode == "NONE" else mode
+                    logging.debug("TCP client %d compression %s", index, mode)
+        return index, data
+
+    def close(self):
+        self.socket.close(0)
 
-    def _connect(self, url):
-        self.socket.connect(url)
-        self.id = self.socket.getsockopt(zmq.IDENTITY)
-
-    def __init__(self, context=None, url="tcp://*:5000"):
 
+class tcpClientThread(threading.Thread):
+    """Setups and manages client connections to a tcpConnection via TCP on a thread.
+
+    Data received is passed to message_rx_event as (index, data), the index of the client it came to.
+    """
+
+    def send_data(self, data, index=0):
+        """Send data from client index, from any thread.
+
+        Parameters
+        ----------
+        data : str or bytes
+            Data to be sent, one or more lines of commands.
+        index : int
+            The client sending it.
+        """
+        self.loop_signal.call(self.clients.send, index, data)
+
+    def close(self):
+        self.loop_signal.stop()
+
+    def __init__(self, context=None, url="tcp://localhost:5000", clients=1, compression=None):
+        """
+        Keyword Arguments:
+            context {zmq.Context} -- The context for the sockets. (default: {zmq.Context.instance()})
+            url {str} -- The tcpConnection's address. (default: {"tcp://localhost:5000"})
+            clients {int} -- The number of client connections. (default: {1})
+            compression {list} -- The compression modes to ask for, True for all those known. (default: {None})
+        """
         threading.Thread.__init__(self, daemon=True)
         self.context = context or zmq.Context.instance()
-        self.socket = self.context.socket(zmq.STREAM)
-        self.socket.set(zmq.SNDTIMEO, 5)
-        self._connect("tcp://localhost:5000")
-
-        self.id = self.socket.getsockopt(zmq.IDENTITY)
-        # Initialize poll set
-        self.poller = zmq.Poller()
-        self.poller.register(self.socket, zmq.POLLIN)
-
-        self.running = True
+        self.loop_signal = LoopSignal(self.context)
+        self.message_rx_event = Event()
+        self.clients = tcpClients(url, clients, self.context, compression)
+        self.start()
 
     def run(self):
-        # Continue the network loop, exit when an error occurs
-        id = self.socket.recv()
-        self.socket.recv()
-        while self.running:
-            socks = dict(self.poller.poll())
-            if self.socket in socks:
-                id = self.socket.recv()
-                message = self.socket.recv_string()
-                logging.debug("RX: " + message.rstrip())
-                if not message:
-                    time.sleep(5)
-                    self._connect("tcp://localhost:5000")
-
-            time.sleep(0.1)
-
-        self.socket.close()
-        self.context.term()
+        # zmq drops what is sent to a client before it connects, data sent meanwhile waits for them.
+        self.clients.wait_connected()
+        poller = zmq.Poller()
+        poller.register(self.clients.socket, zmq.POLLIN)
+        poller.register(self.loop_signal.socket, zmq.POLLIN)
+        while True:
+            try:
+                socks = dict(poller.poll())
+            except zmq.error.ContextTerminated:
+                break
+            if self.loop_signal.socket in socks and self.loop_signal.receive():
+                break
+            if self.clients.socket in socks:
+                received = self.clients.receive()
+                if received is not None:
+                    logging.debug("TCP client %d RX: %s", received[0], received[1].decode("utf-8", "replace").rstrip())
+                    self.message_rx_event(*received)
+
+        self.clients.close()
+        self.loop_signal.close()
 
 
 def init_logging(logfilename, level):
@@ -85,7 +181,6 @@ def main():
     shutdown = False
     init_logging("", 2)
     tcp = tcpClientThread()
-    tcp.start()
     tcp.send_data("\tWHO\n")
     tcp.send_data("\t00001\tCONNECT\n")
     tcp.send_data("\t00001\tSTATUS\n")
@@ -2,8 +2,333 @@ import zmq
 import threading
 import logging
 import shortuuid
+import time
 from zeroconf import ServiceInfo, Zeroconf, IPVersion
 import socket
+from collections import deque
+
+from .compression import MAGIC, MODES, FrameCompressor, choose_mode, compress_reply, take_compress_request
+from .iotcontrol.enums import OverflowPolicy
+from .loopsignal import LoopSignal
+from .metrics import ConnectionMetrics
+from .segmentqueue import collapse_key
+
+# Combined once, or'ing zmq's flag enums costs more than a send of a small frame.
+SNDMORE_NOBLOCK = zmq.SNDMORE | zmq.NOBLOCK
+
+
+class CommandFramer:
+    """Reassembles newline terminated commands per TCP client.
+
+    TCP can split a command across receives, so only complete commands are passed on and the remainder is kept
+    per client. A client whose unfinished command grows past max_rx_buffer has it dropped up to its newline.
+    """
+
+    def __init__(self, max_rx_buffer=65536):
+        # Bytes received per client that don't yet end in a newline.
+        self.rx_buffers = {}
+        self.rx_discarding = set()
+        self.max_rx_buffer = max_rx_buffer
+
+    def frame(self, id, message):
+        """Return the complete commands in message, keeping any unfinished command for the client's next receive."""
+        if id in self.rx_discarding:
+            end = message.find(b"\n") + 1
+            if not end:
+                return b""
+            self.rx_discarding.discard(id)
+            message = message[end:]
+            if not message:
+                return b""
+        buffer = self.rx_buffers.get(id)
+        if buffer is None:
+            end = message.rfind(b"\n") + 1
+            if end == len(message):
+                return message
+            buffer = self.rx_buffers[id] = bytearray(message)
+        else:
+            buffer += message
+            end = buffer.rfind(b"\n") + 1
+        commands = bytes(buffer[:end])
+        del buffer[:end]
+        if len(buffer) > self.max_rx_buffer:
+            # Drop the oversized command, including the rest of it still to come.
+            logging.debug("TCP ID: %s, dropped %d bytes of unterminated command", id.hex(), len(buffer))
+            buffer.clear()
+            self.rx_discarding.add(id)
+        if not buffer:
+            del self.rx_buffers[id]
+        return commands
+
+    def remove(self, id):
+        """Forget a disconnected client's unfinished command."""
+        self.rx_buffers.pop(id, None)
+        self.rx_discarding.discard(id)
+
+
+class TcpClient:
+    """What a tcpConnection knows about one connected client.
+
+    Frames the client's socket can't take yet wait in its queue, in order, up to the connection's send_hwm.
+    """
+
+    def __init__(self, id, now):
+        self.id = id
+        self.connected = now
+        self.last_seen = now
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.dropped = 0
+        # When the queue reached the high water mark, None while it is below.
+        self.over_mark_since = None
+        # Queued frames as [key, data], key is the control a single state update is for when collapsing, else None.
+        self.queue = deque()
+        self.queued_keys = {}
+        # The compression mode the client negotiated, None while it is sent plain text.
+        self.compression = None
+
+    @property
+    def queue_depth(self):
+        return len(self.queue)
+
+    def enqueue(self, data, send_hwm, overflow):
+        """Queue data behind the frames already waiting, making room by the overflow policy when full.
+
+        Returns the number of frames dropped."""
+        key = None
+        if overflow == OverflowPolicy.COLLAPSE:
+            raw = data.bytes if isinstance(data, zmq.Frame) else data
+            # Frames adding a point or an entry, TGRPH, LOG, MAP and alarms, have no key and always queue.
+            if not raw.startswith(MAGIC):
+                key = collapse_key(None, raw)
+        if key is not None:
+            entry = self.queued_keys.get(key)
+            if entry is not None:
+                entry[1] = data
+                self.dropped += 1
+                return 1
+        dropped = 0
+        if len(self.queue) >= send_hwm:
+            dropped = 1
+            self.dropped += 1
+            if overflow == OverflowPolicy.DROP_NEWEST:
+                return dropped
+            self.pop()
+        entry = [key, data]
+        self.queue.append(entry)
+        if key is not None:
+            self.queued_keys[key] = entry
+        return dropped
+
+    def pop(self):
+        key, data = self.queue.popleft()
+        if key is not None:
+            del self.queued_keys[key]
+        return data
+
+
+class TcpClientRegistry:
+    """The clients of a TCP connection keyed by their zmq STREAM ID, and the frames queued for them.
+
+    Shared by tcpConnection and asyncTcpConnection, each calls it from its loop once socket is set to its STREAM
+    socket. Sends never block, frames a client's socket can't take wait in its queue, up to send_hwm, and are
+    sent again by service. A client whose queue stays full for evict_after seconds is disconnected, as is one
+    sending nothing for idle_timeout seconds.
+    """
+
+    def __init__(
+        self,
+        metrics,
+        max_rx_buffer=65536,
+        idle_timeout=0,
+        max_clients=0,
+        send_hwm=1000,
+        overflow=OverflowPolicy.DROP_OLDEST,
+        evict_after=30.0,
+        compressors=None,
+    ):
+        self.socket = None
+        self.clients = {}
+        # Frames dropped from client queues are counted in metrics, clients evicted for not keeping up here.
+        self.metrics = metrics
+        self.evicted = 0
+        self.framer = CommandFramer(max_rx_buffer)
+        # One compressor per mode offered, it counts the bytes it took and saved for all clients using it.
+        self.compressors = compressors or {}
+        self.idle_timeout = idle_timeout
+        self.max_clients = max_clients
+        self.send_hwm = send_hwm
+        self.overflow = overflow
+        self.evict_after = evict_after
+        # Clients with frames queued, and IDs closed while their socket was full still to be sent the close.
+        self.backlog = set()
+        self.closing = set()
+        self.next_idle_check = time.monotonic() + 1.0
+
+    def __len__(self):
+        return len(self.clients)
+
+    def try_send(self, id, data):
+        """Send data to the client unless its socket can't take it now, returning False then."""
+        try:
+            self.socket.send(id, SNDMORE_NOBLOCK)
+            self.socket.send(data, zmq.NOBLOCK, copy=False)
+        except zmq.error.Again:
+            return False
+        except zmq.error.ZMQError as e:
+            logging.debug("Sending TX Error: " + str(e))
+        return True
+
+    def __compress(self, client, data):
+        # Frames too small to compress are sent as the zmq.Frame received, without copying out its bytes.
+        if client.compression is None:
+            return data
+        compressor = self.compressors[client.compression]
+        if len(data) < compressor.threshold:
+            return data
+        return compressor.compress(data.bytes if isinstance(data, zmq.Frame) else data)
+
+    def __send(self, id, client, data):
+        if not client.queue and self.try_send(id, data):
+            size = len(data)
+            client.bytes_out += size
+            self.metrics.frames_out += 1
+            self.metrics.bytes_out += size
+            return
+        self.metrics.dropped += client.enqueue(data, self.send_hwm, self.overflow)
+        if client.over_mark_since is None and len(client.queue) >= self.send_hwm:
+            client.over_mark_since = time.monotonic()
+        self.backlog.add(id)
+
+    def send(self, id, data):
+        """Send data to one client, compressed if it asked for compression."""
+        client = self.clients.get(id)
+        if client is None:
+            return
+        if logging.root.isEnabledFor(logging.DEBUG):
+            raw = data.bytes if isinstance(data, zmq.Frame) else data
+            logging.debug("TCP ID: %s, Tx: %s", id.hex(), raw.decode('utf-8', 'replace').rstrip())
+        self.__send(id, client, self.__compress(client, data))
+
+    def broadcast(self, data):
+        """Send data to every client, compressed once per mode in use and shared like the plain frame."""
+        if logging.root.isEnabledFor(logging.DEBUG):
+            raw = data.bytes if isinstance(data, zmq.Frame) else data
+            logging.debug("TCP %d clients, Tx: %s", len(self.clients), raw.decode('utf-8', 'replace').rstrip())
+        compressed = {}
+        for id, client in self.clients.items():
+            mode = client.compression
+            if mode is not None and mode not in compressed:
+                compressed[mode] = self.__compress(client, data)
+            self.__send(id, client, data if mode is None else compressed[mode])
+
+    def __add(self, id, now):
+        if self.max_clients and len(self.clients) >= self.max_clients:
+            logging.info("TCP ID: %s, rejected, already serving %d clients", id.hex(), len(self.clients))
+            return None
+        logging.debug("Added Socket ID: " + id.hex())
+        client = self.clients[id] = TcpClient(id, now)
+        return client
+
+    def __remove(self, id):
+        self.backlog.discard(id)
+        self.framer.remove(id)
+        if self.clients.pop(id, None) is not None:
+            logging.debug("Removed Socket ID: " + id.hex())
+
+    def disconnect(self, id):
+        """Close the client's connection, zmq doesn't report back a disconnect we made."""
+        # An empty frame closes the connection.
+        if not self.try_send(id, b''):
+            self.closing.add(id)
+        self.__remove(id)
+
+    def receive(self, id, message, now):
+        """Take a message from the STREAM socket, returning the complete commands in it for the devices.
+
+        An empty message is sent by zmq when a client connects and again when it disconnects. COMPRESS
+        requests are answered here.
+        """
+        client = self.clients.get(id)
+        if id in self.closing:
+            if not message:
+                self.closing.discard(id)
+            return b""
+        if client is None:
+            # The first frame from a client is the empty connect notification, unless it was missed.
+            client = self.__add(id, now)
+            if client is None:
+                self.try_send(id, b'')
+                return b""
+            if not message:
+                return b""
+        elif not message:
+            self.__remove(id)
+            return b""
+        client.last_seen = now
+        client.bytes_in += len(message)
+        self.metrics.frames_in += 1
+        self.metrics.bytes_in += len(message)
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug("TCP ID: %s, RX: %s", id.hex(), message.decode('utf-8', 'replace').rstrip())
+        commands = self.framer.frame(id, message)
+        commands, modes = take_compress_request(commands)
+        if modes is not None:
+            # Asked of the connection, not a device. Frames are marked compressed or not, so those already on
+            # their way are read either way.
+            client.compression = choose_mode(modes, self.compressors)
+            logging.debug("TCP ID: %s, compression %s", id.hex(), client.compression)
+            self.__send(id, client, compress_reply(client.compression))
+        return commands
+
+    def timeout(self, now):
+        """Milliseconds until service is next needed, None while nothing waits on it."""
+        # Queued frames are retried every few milliseconds until the clients' sockets take them. Otherwise only
+        # the idle check is waited for, or nothing when idle clients are left connected.
+        if self.backlog or self.closing:
+            return 5
+        if self.idle_timeout and self.clients:
+            return max(0, int((self.next_idle_check - now) * 1000) + 1)
+        return None
+
+    def service(self, now):
+        """Send what is queued, evicting clients that haven't kept up, and disconnect idle clients."""
+        if self.backlog or self.closing:
+            self.__drain(now)
+        if self.idle_timeout and now >= self.next_idle_check:
+            self.next_idle_check = now + 1.0
+            idle = [id for id, client in self.clients.items() if now - client.last_seen > self.idle_timeout]
+            for id in idle:
+                logging.debug("TCP ID: %s, disconnected after %.0fs idle", id.hex(), now - self.clients[id].last_seen)
+                self.disconnect(id)
+
+    def __drain(self, now):
+        metrics = self.metrics
+        for id in list(self.backlog):
+            client = self.clients[id]
+            while client.queue and self.try_send(id, client.queue[0][1]):
+                size = len(client.pop())
+                client.bytes_out += size
+                metrics.frames_out += 1
+                metrics.bytes_out += size
+            if len(client.queue) < self.send_hwm:
+                client.over_mark_since = None
+            elif self.evict_after and now - client.over_mark_since > self.evict_after:
+                logging.info("TCP ID: %s, evicted, its queue was full for %.0fs", id.hex(), now - client.over_mark_since)
+                self.evicted += 1
+                metrics.dropped += len(client.queue)
+                self.disconnect(id)
+                continue
+            if not client.queue:
+                self.backlog.discard(id)
+        for id in list(self.closing):
+            if self.try_send(id, b''):
+                self.closing.discard(id)
+
+    def close(self):
+        """Disconnect every client."""
+        for id in list(self.clients):
+            self.disconnect(id)
 
 
 class tcpConnection(threading.Thread):
@@ -36,12 +361,45 @@ class tcpConnection(threading.Thread):
     def add_device(self, device):
         device.add_connection(self.connection_id)
 
-    def __init__(self, ip="*", port=5000, context=None):
+    def __init__(
+        self,
+        ip="*",
+        port=5000,
+        context=None,
+        max_rx_buffer=65536,
+        idle_timeout=0,
+        max_clients=0,
+        send_hwm=1000,
+        overflow=OverflowPolicy.DROP_OLDEST,
+        evict_after=30.0,
+        compression=True,
+        compress_threshold=1024
+    ):
         """
+        Keyword Arguments:
+            ip {str} -- The interface to listen on. (default: {"*"})
+            port {int} -- The TCP port to listen on. (default: {5000})
+            context {zmq.Context} -- The zmq context to use. (default: {None})
+            max_rx_buffer {int} -- The most bytes of an unfinished command kept per client. A client going
+                over it has its partial command dropped. (default: {65536})
+            idle_timeout {float} -- Seconds a client may send nothing before it is disconnected, 0 never
+                disconnects idle clients. (default: {0})
+            max_clients {int} -- The most clients connected at once, further connections are closed as they
+                arrive. 0 for no limit. (default: {0})
+            send_hwm {int} -- The most frames queued for a client whose socket can't keep up. (default: {1000})
+            overflow {OverflowPolicy} -- What to drop when a client's queue is full. COLLAPSE also replaces a
+                queued state update with a newer one for the same control, points, log entries and alarms are
+                all kept. (default: {OverflowPolicy.DROP_OLDEST})
+            evict_after {float} -- Seconds a client's queue may stay full before the client is disconnected,
+                0 never evicts. (default: {30.0})
+            compression {bool} -- Whether clients asking for compression get it. Those that do are sent
+                frames of compress_threshold bytes or more compressed. (default: {True})
+            compress_threshold {int} -- The smallest frame compressed. (default: {1024})
         """
 
         threading.Thread.__init__(self, daemon=True)
         self.context = context or zmq.Context.instance()
+        self.loop_signal = LoopSignal(self.context)
         self.connection_id = shortuuid.uuid()
         self.b_connection_id = self.connection_id.encode('utf-8')
 
@@ -51,7 +409,14 @@ class tcpConnection(threading.Thread):
         self.ext_url = "tcp://" + ip + ":" + str(port)
 
         self.zeroconf = Zeroconf(ip_version=IPVersion.V4Only)
-        self.socket_ids = []
+        # Connected clients keyed by their zmq STREAM ID, and the frames queued for them.
+        self.metrics = ConnectionMetrics("tcp", self.connection_id)
+        compressors = {}
+        if compression:
+            compressors = {mode: FrameCompressor(mode, compress_threshold) for mode in MODES}
+        self.clients = TcpClientRegistry(
+            self.metrics, max_rx_buffer, idle_timeout, max_clients, send_hwm, overflow, evict_after, compressors
+        )
         self.running = True
 
         host_name = socket.gethostname()
@@ -68,15 +433,10 @@ class tcpConnection(threading.Thread):
         self.zeroconf.unregister_all_services()
         self.zeroconf.close()
         self.running = False
+        self.loop_signal.stop()
 
     def run(self):
-        def __zmq_tcp_send(id, data):
-            try:
-                tcpsocket.send(id, zmq.SNDMORE)
-                tcpsocket.send(data, zmq.NOBLOCK)
-            except zmq.error.ZMQError as e:
-                logging.debug("Sending TX Error: " + str(e))
-                # self.socket_ids.remove(id)
+        clients = self.clients
 
         tx_zmq_pub = self.context.socket(zmq.PUB)
         tx_zmq_pub.bind(self.tx_url_internal)
@@ -92,46 +452,41 @@ class tcpConnection(threading.Thread):
         tcpsocket = self.context.socket(zmq.STREAM)
 
         tcpsocket.bind(self.ext_url)
-        tcpsocket.set(zmq.SNDTIMEO, 5)
+        clients.socket = tcpsocket
 
         poller = zmq.Poller()
         poller.register(tcpsocket, zmq.POLLIN)
         poller.register(rx_zmq_sub, zmq.POLLIN)
-
-        id = tcpsocket.recv()
-        tcpsocket.recv()  # empty data here
+        poller.register(self.loop_signal.socket, zmq.POLLIN)
 
         while self.running:
             try:
-                socks = dict(poller.poll(50))
+                socks = dict(poller.poll(clients.timeout(time.monotonic())))
             except zmq.error.ContextTerminated:
                 break
+            if self.loop_signal.socket in socks and self.loop_signal.receive():
+                break
+            now = time.monotonic()
 
             if tcpsocket in socks:
                 id = tcpsocket.recv()
                 message = tcpsocket.recv()
-                if id not in self.socket_ids:
-                    logging.debug("Added Socket ID: " + id.hex())
-                    self.socket_ids.append(id)
-                logging.debug("TCP ID: %s, RX: %s", id.hex(), message.decode('utf-8').rstrip())
-                if message:
-                    tx_zmq_pub.send_multipart([self.b_connection_id, id, message])
-                else:
-                    if id in self.socket_ids:
-                        logging.debug("Removed Socket ID: " + id.hex())
-                        self.socket_ids.remove(id)
+                commands = clients.receive(id, message, now)
+                if commands:
+                    tx_zmq_pub.send_multipart([self.b_connection_id, id, commands])
             if rx_zmq_sub in socks:
-                [address, msg_id, data] = rx_zmq_sub.recv_multipart()
+                # The data is received once and the same zmq.Frame is sent to every client, zmq shares its
+                # buffer between them rather than copying it per client.
+                [address, msg_id, data] = rx_zmq_sub.recv_multipart(copy=False)
+                address = address.bytes
                 if address == b'ALL':
-                    for id in self.socket_ids:
-                        logging.debug("TCP ID: %s, Tx: %s", id.hex(), data.decode('utf-8').rstrip())
-                        __zmq_tcp_send(id, data)
+                    clients.broadcast(data)
                 elif address == self.b_connection_id:
-                    logging.debug("TCP ID: %s, Tx: %s", msg_id.hex(), data.decode('utf-8').rstrip())
-                    __zmq_tcp_send(msg_id, data)
+                    clients.send(msg_id.bytes, data)
+            clients.service(now)
 
-        for id in self.socket_ids:
-            __zmq_tcp_send(id, b'')
+        clients.close()
+        self.loop_signal.close()
 
         # self.tcpsocket.close()
         # self.tx_zmq_pub.close()
@@ -5,6 +5,9 @@ import shortuuid
 from zeroconf import ServiceInfo, Zeroconf, IPVersion
 import socket
 
+from .loopsignal import LoopSignal
+from .metrics import ConnectionMetrics
+
 
 class zmqConnection(threading.Thread):
     """Setups and manages a connection thread to iotdashboard via TCP."""
@@ -38,12 +41,17 @@ class zmqConnection(threading.Thread):
     def add_device(self, device):
         device.add_connection(self.connection_id)
         sub_topic = "\t{}".format(device.device_id)
-        self.ext_rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, sub_topic.encode('utf-8'))
+        # The socket is the connection thread's, it subscribes when it next wakes.
+        self.loop_signal.call(self.__subscribe, sub_topic.encode('utf-8'))
+
+    def __subscribe(self, topic):
+        self.ext_rx_zmq_sub.setsockopt(zmq.SUBSCRIBE, topic)
 
     def close(self):
         self.zeroconf.unregister_all_services()
         self.zeroconf.close()
         self.running = False
+        self.loop_signal.stop()
 
     def __init__(self, zmq_out_url="*", pub_port=5555, sub_port=5556, context=None):
         """
@@ -52,6 +60,7 @@ class zmqConnection(threading.Thread):
 
         threading.Thread.__init__(self, daemon=True)
         self.context = context or zmq.Context.instance()
+        self.loop_signal = LoopSignal(self.context)
         self.running = True
 
         self.tx_url_external = "tcp://{}:{}".format(zmq_out_url, pub_port)
@@ -59,6 +68,7 @@ class zmqConnection(threading.Thread):
 
         self.connection_id = shortuuid.uuid()
         self.b_connection_id = self.connection_id.encode('utf-8')
+        self.metrics = ConnectionMetrics("zmq", self.connection_id)
 
         self.tx_url_internal = "inproc://TX_{}".format(self.connection_id)
         self.rx_url_internal = "inproc://RX_{}".format(self.connection_id)
@@ -98,22 +108,34 @@ class zmqConnection(threading.Thread):
         poller = zmq.Poller()
         poller.register(self.ext_rx_zmq_sub, zmq.POLLIN)
         poller.register(rx_zmq_sub, zmq.POLLIN)
+        poller.register(self.loop_signal.socket, zmq.POLLIN)
+        # Devices added before the sockets were made.
+        self.loop_signal.run_calls()
 
         while self.running:
             try:
-                socks = dict(poller.poll(50))
+                socks = dict(poller.poll())
             except zmq.error.ContextTerminated:
                 break
+            if self.loop_signal.socket in socks and self.loop_signal.receive():
+                break
             if self.ext_rx_zmq_sub in socks:
                 message = self.ext_rx_zmq_sub.recv()
-                logging.debug("ZMQ Rx: %s", message.decode('utf-8').rstrip())
+                self.metrics.frames_in += 1
+                self.metrics.bytes_in += len(message)
+                if logging.root.isEnabledFor(logging.DEBUG):
+                    logging.debug("ZMQ Rx: %s", message.decode('utf-8', 'replace').rstrip())
                 tx_zmq_pub.send_multipart([self.b_connection_id, b'', message])
 
             if rx_zmq_sub in socks:
                 [address, msg_id, data] = rx_zmq_sub.recv_multipart()
                 if address == b'ALL' or address == self.b_connection_id:
-                    logging.debug("ZMQ Tx: %s", data.decode('utf-8').rstrip())
-                    ext_tx_zmq_pub.send(data)
+                    if logging.root.isEnabledFor(logging.DEBUG):
+                        logging.debug("ZMQ Tx: %s", data.decode('utf-8', 'replace').rstrip())
+                    ext_tx_zmq_pub.send(data, copy=False)
+                    self.metrics.frames_out += 1
+                    self.metrics.bytes_out += len(data)
 
         tx_zmq_pub.close()
         rx_zmq_sub.close()
+        self.loop_signal.close()
@@ -18,5 +18,7 @@ setup(
     license="MIT",
     classifiers=["Programming Language :: Python :: 3", "Operating System :: OS Independent"],
     install_requires=["paho-mqtt", "pyzmq", "python-dateutil", "zeroconf", "shortuuid"],
+    # Vectorizes downsampling TimeGraph replies.
+    extras_require={"numpy": ["numpy"]},
 )
 